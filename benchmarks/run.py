@@ -0,0 +1,342 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import models.ocr
+import models.solver
+import pipeline.core
+from benchmarks import synthetic
+
+# constants
+PUZZLES_DIR = "data/puzzles/"
+GROUND_TRUTH = os.path.join(os.path.dirname(__file__), "ground_truth.json")
+
+
+def peak_rss_mb() -> float:
+    # linux reports kilobytes, macos bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def measure(fn, inputs: list, repeat: int) -> dict:
+    """
+    Calls a function on every input `repeat` times, after one warm-up pass.
+
+    Parameters
+    ----------
+        fn: function taking a single input
+        inputs (list): inputs of the stage
+        repeat (int): number of timed passes over the inputs
+
+    Returns
+    -------
+        stats (dict): latency percentiles and maximum in milliseconds, calls
+            per second and the peak resident memory so far
+    """
+
+    for x in inputs:
+        fn(x)
+
+    latencies = []
+    for _ in range(repeat):
+        for x in inputs:
+            start = time.perf_counter()
+            fn(x)
+            latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+
+    return {
+        "calls": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "max_ms": round(float(latencies.max()), 3),
+        "throughput": round(1000 * len(latencies) / latencies.sum(), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def as_grid(digits: str) -> np.ndarray:
+    return np.array(list(map(int, digits))).reshape((9, 9))
+
+
+def accuracy(images: dict, results: dict, truth: dict) -> dict:
+    """
+    Scores detection and OCR against the ground truth grids. OCR accuracy is
+    measured over the cells of the grids that were found.
+    """
+
+    found = [name for name in images if results[name].found]
+    correct_cells = sum(
+        int((results[name].puzzle == as_grid(truth[name])).sum()) for name in found
+    )
+    correct_grids = sum(
+        (results[name].puzzle == as_grid(truth[name])).all() for name in found
+    )
+
+    return {
+        "images": len(images),
+        "detection_rate": round(len(found) / len(images), 4),
+        "ocr_cell_accuracy": round(correct_cells / max(81 * len(found), 1), 4),
+        "ocr_grid_accuracy": round(correct_grids / max(len(found), 1), 4),
+        "solve_rate": round(
+            sum(results[name].solved for name in images) / len(images), 4
+        ),
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Benchmarks the full pipeline and each stage in isolation on the sample
+    puzzles, then the solvers on synthetic puzzles.
+    """
+
+    with open(GROUND_TRUTH) as f:
+        truth = json.load(f)
+
+    model = pipeline.core.load_model(args.model, args.ocr_backend)
+    images = {name: cv2.imread(PUZZLES_DIR + name) for name in sorted(truth)}
+    paths = [PUZZLES_DIR + name for name in images]
+    stages = {}
+
+    # full pipeline, including reading the file
+    def full(path):
+        return pipeline.core.process_image(
+            cv2.imread(path),
+            model,
+            args.solver,
+            max_candidates=args.max_candidates,
+            cell_mode=args.cell_mode,
+            blank_threshold=args.blank_threshold,
+            max_corrections=args.max_corrections,
+            repair_budget=args.repair_budget_ms / 1000,
+        )
+
+    stages["pipeline"] = measure(full, paths, args.repeat)
+    results = {name: full(PUZZLES_DIR + name) for name in images}
+
+    # intermediate results feeding each stage in isolation
+    preprocessed = [
+        (image, *pipeline.core.preprocess(image)) for image in images.values()
+    ]
+
+    def detect(inputs):
+        image, resized, scale, thresh = inputs
+        result = pipeline.core.GridResult(image=resized, source=image, scale=scale)
+        pipeline.core.find_grid(
+            resized, thresh, result, args.max_candidates, args.cell_mode
+        )
+        return result
+
+    found = [r for r in map(detect, preprocessed) if r.found]
+    digits = [pipeline.core.extract_digits(r) for r in found]
+    puzzles = [r.puzzle for r in results.values() if r.found]
+
+    def solve(puzzle):
+        models.solver.get_solver(args.solver)(puzzle).solve()
+
+    stages["read"] = measure(cv2.imread, paths, args.repeat)
+    stages["preprocess"] = measure(
+        pipeline.core.preprocess, images.values(), args.repeat
+    )
+    stages["detect"] = measure(detect, preprocessed, args.repeat)
+    stages["extract"] = measure(pipeline.core.extract_digits, found, args.repeat)
+    stages["ocr"] = measure(model.predict, digits, args.repeat)
+    stages["solve"] = measure(solve, puzzles, args.repeat)
+
+    # solver load test, one grid at a time and all at once
+    generated = synthetic.make_puzzles(args.synthetic, seed=args.seed)
+    stages["solve_synthetic"] = measure(solve, list(generated), 1)
+    stages["solve_batch_synthetic"] = measure(
+        models.solver.solve_batch, [generated], args.repeat
+    )
+    stages["solve_batch_synthetic"]["throughput"] = round(
+        stages["solve_batch_synthetic"]["throughput"] * len(generated), 2
+    )
+    stages["canonicalize_synthetic"] = measure(
+        models.solver.canonical_form, list(generated), args.repeat
+    )
+
+    # larger grids, with about as many clues relative to their cells
+    generated = synthetic.make_puzzles(args.synthetic, (100, 150), args.seed, 16)
+    stages["solve_synthetic_16x16"] = measure(solve, list(generated), 1)
+
+    return {
+        "config": {
+            "model": args.model,
+            "ocr_backend": args.ocr_backend,
+            "solver": args.solver,
+            "max_candidates": args.max_candidates,
+            "cell_mode": args.cell_mode,
+            "blank_threshold": args.blank_threshold,
+            "max_corrections": args.max_corrections,
+            "repair_budget_ms": args.repair_budget_ms,
+            "repeat": args.repeat,
+            "synthetic": args.synthetic,
+            "seed": args.seed,
+        },
+        "stages": stages,
+        "accuracy": accuracy(images, results, truth),
+    }
+
+
+def compare(
+    baseline: dict, current: dict, max_slowdown: float, max_accuracy_drop: float
+) -> list:
+    """
+    Lists the regressions of a run against a baseline run.
+
+    Parameters
+    ----------
+        baseline (dict): results of the reference run
+        current (dict): results of the run being checked
+        max_slowdown (float): allowed relative increase of p50 and p95 latency
+        max_accuracy_drop (float): allowed absolute drop of any accuracy metric
+
+    Returns
+    -------
+        regressions (list): human readable description of every regression
+    """
+
+    regressions = []
+
+    for stage, stats in current["stages"].items():
+        if stage not in baseline["stages"]:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            before, after = baseline["stages"][stage][key], stats[key]
+            if after > before * (1 + max_slowdown):
+                regressions.append(
+                    f"{stage} {key}: {before:.3f} -> {after:.3f} "
+                    f"(+{after / before - 1:.1%})"
+                )
+
+    for key, after in current["accuracy"].items():
+        before = baseline["accuracy"].get(key)
+        if (
+            key != "images"
+            and before is not None
+            and after < before - max_accuracy_drop
+        ):
+            regressions.append(f"{key}: {before:.4f} -> {after:.4f}")
+
+    return regressions
+
+
+def format_table(results: dict) -> str:
+    lines = [
+        f"{'stage':<24}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'per s':>10}{'rss mb':>10}"
+    ]
+    for stage, s in results["stages"].items():
+        lines.append(
+            f"{stage:<24}{s['calls']:>8}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}"
+            f"{s['throughput']:>10.1f}{s['peak_rss_mb']:>10.1f}"
+        )
+    lines += [f"{key:<24}{value:>8}" for key, value in results["accuracy"].items()]
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", "-m", default="digitnet", help="Name of OCR model")
+    parser.add_argument(
+        "--ocr-backend",
+        default="keras",
+        choices=models.ocr.BACKENDS,
+        help="Inference backend for the OCR model.",
+    )
+    parser.add_argument(
+        "--solver",
+        "-s",
+        default="bitmask",
+        choices=models.solver.SOLVERS,
+        help="Solving engine.",
+    )
+    parser.add_argument(
+        "--max-candidates",
+        type=int,
+        default=pipeline.core.MAX_CANDIDATES,
+        help="Most grid candidates warped per image.",
+    )
+    parser.add_argument(
+        "--cell-mode",
+        default="contours",
+        choices=pipeline.core.CELL_MODES,
+        help="How cells are located in the warped grid.",
+    )
+    parser.add_argument(
+        "--blank-threshold",
+        type=float,
+        default=pipeline.core.BLANK_THRESHOLD,
+        help="Most ink of a cell skipping the OCR model, negative for none.",
+    )
+    parser.add_argument(
+        "--max-corrections",
+        type=int,
+        default=pipeline.core.MAX_CORRECTIONS,
+        help="Most misread digits corrected in infeasible puzzles.",
+    )
+    parser.add_argument(
+        "--repair-budget-ms",
+        type=float,
+        default=pipeline.core.REPAIR_BUDGET * 1000,
+        help="Time spent looking for corrections, 0 for none.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Timed passes over the inputs."
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=1000,
+        help="Number of generated puzzles for the solver load test.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator.")
+    parser.add_argument("--output", "-o", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--baseline", help="Results of a previous run to check for regressions."
+    )
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        default=0.2,
+        help="Allowed relative latency increase over the baseline.",
+    )
+    parser.add_argument(
+        "--max-accuracy-drop",
+        type=float,
+        default=0.0,
+        help="Allowed absolute accuracy drop from the baseline.",
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    print(format_table(results))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(
+            baseline, results, args.max_slowdown, args.max_accuracy_drop
+        )
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import numpy as np
+
+import models.solver
+
+
+def solved_grid(rng: np.random.Generator, size: int = 9) -> np.ndarray:
+    """
+    Generates a random valid solved grid by shuffling a base pattern with
+    transformations that preserve validity: relabeling digits, permuting
+    bands, rows within bands, stacks and columns within stacks, and
+    transposing if the boxes are square.
+
+    Parameters
+    ----------
+        rng (np.random.Generator): source of randomness
+        size (int): number of cells per side, see models.solver.box_shape
+
+    Returns
+    -------
+        grid (np.ndarray): NxN matrix of digits 1-N
+    """
+
+    box_rows, box_cols = models.solver.box_shape(size)
+
+    # every row is the previous one shifted, shifted by a box at band borders
+    r, c = np.indices((size, size))
+    grid = (box_cols * (r % box_rows) + r // box_rows + c) % size
+
+    def order(lines):
+        bands = rng.permutation(size // lines)
+        return np.concatenate([lines * b + rng.permutation(lines) for b in bands])
+
+    grid = grid[order(box_rows)][:, order(box_cols)]
+    if box_rows == box_cols and rng.random() < 0.5:
+        grid = grid.T
+
+    return rng.permutation(size)[grid] + 1
+
+
+def make_puzzle(rng: np.random.Generator, clues: int = 30, size: int = 9) -> np.ndarray:
+    """
+    Removes digits from a random solved grid. The puzzle always has at least
+    one solution, uniqueness is not guaranteed.
+
+    Parameters
+    ----------
+        rng (np.random.Generator): source of randomness
+        clues (int): number of digits to keep
+        size (int): number of cells per side
+
+    Returns
+    -------
+        puzzle (np.ndarray): NxN matrix of digits, 0 for blanks
+    """
+
+    puzzle = solved_grid(rng, size).flatten()
+    puzzle[rng.permutation(size * size)[clues:]] = 0
+
+    return puzzle.reshape((size, size))
+
+
+def make_puzzles(
+    count: int, clues: tuple = (22, 36), seed: int | None = None, size: int = 9
+) -> np.ndarray:
+    """
+    Generates puzzles for solver load tests.
+
+    Parameters
+    ----------
+        count (int): number of puzzles
+        clues (tuple): inclusive range the number of clues is drawn from
+        seed (int): seed for reproducible puzzles
+        size (int): number of cells per side
+
+    Returns
+    -------
+        puzzles (np.ndarray): (count, N, N) array of puzzles
+    """
+
+    rng = np.random.default_rng(seed)
+    low, high = clues
+
+    return np.array(
+        [make_puzzle(rng, int(rng.integers(low, high + 1)), size) for _ in range(count)]
+    ).reshape((count, size, size))
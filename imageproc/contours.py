@@ -70,73 +70,107 @@ def find_quadrilaterals(
     quad_contours = []
     quad_corners = []
 
+    image_area = image.shape[0] * image.shape[1]
     for c in contours:
-        quad, _, corners = _is_quadrilateral(c, error)
-
-        # area of contour is irrelevant
-        if bounds is None:
-            area_cond = True
-        # area of contour matters
-        else:
-            image_area = image.shape[0] * image.shape[1]
+        # contours out of bounds aren't approximated at all, there can be
+        # thousands of specks in a large image
+        if bounds is not None:
             ratio = cv2.contourArea(c) / image_area
-            area_cond = bounds[0] < ratio < bounds[1]
+            if not bounds[0] < ratio < bounds[1]:
+                continue
 
         # conditionally adding to result
-        if quad and area_cond:
+        quad, _, corners = _is_quadrilateral(c, error)
+        if quad:
             quad_contours.append(c)
             quad_corners.append(corners)
 
     return quad_contours, quad_corners
 
 
-def fill_contours(
-    image: np.ndarray, mode: int, bounds: Tuple[float, float]
-) -> np.ndarray:
+def get_center(contour: np.ndarray) -> Tuple[int, int]:
     """
-    Fills contours whose area relavant to the image falls within bounds
+    Finds the center of a contour
 
     Parameters
     ----------
-        image (np.ndarray): black and white image in which to fill contours
-        bounds (float, float): upper and lower bound search restrictions for contour
-            area relative to image area
+        contour (np.ndarray): contour for which to find center of
 
     Returns
     -------
-        filled (np.ndarray): image with contours filled
+        center_x (int): x-coordinate of center
+        center_y (int): y-coordinate of center
     """
 
-    # image area will be needed for targeting contours of certain size
-    image_area = image.shape[0] * image.shape[1]
+    m = cv2.moments(contour)
 
-    # finding the contours and filling them based on condition
-    contours, _ = cv2.findContours(image, mode=mode, method=cv2.CHAIN_APPROX_SIMPLE)
-    contours = [
-        c for c in contours if bounds[0] < cv2.contourArea(c) / image_area < bounds[1]
-    ]
-    filled = cv2.drawContours(image, contours, -1, (0, 0, 0), -1)
+    center_x = int(m["m10"] / m["m00"])
+    center_y = int(m["m01"] / m["m00"])
 
-    return filled
+    return center_x, center_y
 
 
-def get_center(contour: np.ndarray) -> Tuple[int, int]:
+def quad_squareness(corners: np.ndarray) -> float:
     """
-    Finds the center of a contour
+    Measures how close a quadrilateral is to a square, as the ratio of its
+    shortest to longest side multiplied by the ratio of its diagonals.
 
     Parameters
     ----------
-        contour (np.ndarray): contour for which to find center of
+        corners (np.ndarray): the four corners in order around the quadrilateral
 
     Returns
     -------
-        center_x (int): x-coordinate of center
-        center_y (int): y-coordinate of center
+        squareness (float): 1 for a square, approaching 0 for slivers
     """
 
-    m = cv2.moments(contour)
+    corners = corners.reshape((4, 2)).astype("float32")
 
-    center_x = int(m["m10"] / m["m00"])
-    center_y = int(m["m01"] / m["m00"])
+    sides = np.linalg.norm(corners - np.roll(corners, 1, axis=0), axis=1)
+    diagonals = np.linalg.norm(corners[:2] - corners[2:], axis=1)
+    if sides.max() == 0 or diagonals.max() == 0:
+        return 0.0
 
-    return center_x, center_y
+    return float(sides.min() / sides.max() * diagonals.min() / diagonals.max())
+
+
+def line_crossings(
+    image: np.ndarray, corners: np.ndarray, lines: int = 5, samples: int = 96
+) -> np.ndarray:
+    """
+    Counts the foreground runs along scanlines across a quadrilateral, in both
+    directions, without warping it. Scanlines connect points interpolated
+    along opposite sides, so perspective is taken into account.
+
+    Parameters
+    ----------
+        image (np.ndarray): thresholded image, foreground is non-zero
+        corners (np.ndarray): corners of the quadrilateral, sorted left to
+            right, top to bottom
+        lines (int): number of scanlines in each direction
+        samples (int): points sampled along each scanline
+
+    Returns
+    -------
+        crossings (np.ndarray): number of foreground runs on every scanline
+    """
+
+    tl, tr, bl, br = corners.reshape((4, 2)).astype("float32")
+
+    # scanlines at fractions of the quad, away from its border
+    fractions = (np.arange(lines) + 0.5) / lines
+    t = np.linspace(0.0, 1.0, samples)[:, None]
+
+    crossings = []
+    for f in fractions:
+        for start, end in (
+            (tl + f * (bl - tl), tr + f * (br - tr)),
+            (tl + f * (tr - tl), bl + f * (br - bl)),
+        ):
+            points = np.rint(start + t * (end - start)).astype("int")
+            xs = points[:, 0].clip(0, image.shape[1] - 1)
+            ys = points[:, 1].clip(0, image.shape[0] - 1)
+            on = image[ys, xs] > 0
+            crossings.append(int(np.count_nonzero(on[1:] & ~on[:-1])))
+
+    return np.array(crossings)
@@ -25,12 +25,6 @@ def resize(
     h, w = image.shape[:2]
     aspect = h / w
 
-    # interpolation method based on shrinkage or expansion
-    if width < w or height < h:
-        interpol = cv2.INTER_AREA
-    else:
-        interpol = cv2.INTER_CUBIC
-
     # calculating new dimensions
     if width is not None:
         dim = (width, int(aspect * width))
@@ -39,6 +33,12 @@ def resize(
     else:
         raise ValueError("No width or height provided.")
 
+    # interpolation method based on shrinkage or expansion
+    if dim[0] < w:
+        interpol = cv2.INTER_AREA
+    else:
+        interpol = cv2.INTER_CUBIC
+
     # resizing
     resized = cv2.resize(src=image, dsize=dim, interpolation=interpol)
 
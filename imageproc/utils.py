@@ -76,7 +76,7 @@ def grey_blur_threshold(
     return greyed, blurred, thresh
 
 
-def sort_cells(contours: list) -> list:
+def sort_cells(contours: list, row_size: int = 9) -> list:
     """
     Sorts the cell contours of a sudoku grid such that they are sorted
     left-to-right, top-to-bottom
@@ -84,72 +84,273 @@ def sort_cells(contours: list) -> list:
     Parameters
     ----------
         contours (list): contours to sort
+        row_size (int): number of cells in a row of the grid
 
     Returns
     -------
         sorted_contours (list): a sorted version the original contours
     """
 
-    # number of cells in a standard sudoku row
-    ROW_SIZE = 9
-
-    # sorting contours, by using their centers
-    centers = [imageproc.contours.get_center(c) for c in contours]
-    sorted_centers = [tuple(p) for p in _sort_points(centers, row_size=ROW_SIZE)]
-
-    # tuples representing contour centers are unique
-    # producing list of sorted contour labels (labels are indices)
-    pre_sort_idx = [centers.index(p) for p in sorted_centers]
+    # sorting top-to-bottom by center, then each row left-to-right
+    centers = np.array([imageproc.contours.get_center(c) for c in contours])
+    order = np.argsort(centers[:, 1], kind="stable")
+    for start_idx in range(0, len(order), row_size):
+        row = order[start_idx : start_idx + row_size]
+        order[start_idx : start_idx + row_size] = row[
+            np.argsort(centers[row, 0], kind="stable")
+        ]
 
     # using sorted indices to get contours in sorted order
-    sorted_contours = [contours[idx] for idx in pre_sort_idx]
+    sorted_contours = [contours[idx] for idx in order]
 
     return sorted_contours
 
 
-def extract_cells(image: np.ndarray, bboxes: list) -> Tuple[list, list]:
+def _search_lines(profile: np.ndarray, around: np.ndarray, reach: int) -> np.ndarray:
+    # strongest position of the profile within reach of each expected line
+    offsets = np.arange(-reach, reach + 1)
+    windows = (around[:, None] + offsets[None, :]).clip(0, profile.shape[-1] - 1)
+    best = profile[..., windows].argmax(axis=-1)
+
+    return windows[np.arange(len(around)), best]
+
+
+def find_grid_lines(
+    image: np.ndarray,
+    margin: int = 10,
+    sidelen: int = 500,
+    cells: int = 9,
+    bands: int = 3,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Creates a 28x28 image out of each cell in the sudoku grid
+    Locates the lines of a grid in a top-down view from the row and column
+    projection profiles of the thresholded image. Each line is searched for
+    within a third of a cell of where it would be in a perfectly warped grid,
+    then within a sixth of a cell of there in each band across it, so that
+    cells follow lines that are slightly tilted or curved.
 
     Parameters
     ----------
-        image (np.array): image of sudoku grid
-        bounds (list): boxes of cells, define the cropping area
+        image (np.ndarray): thresholded top-down view, foreground is non-zero
+        margin (int): distance between the edge of the image and the grid
+        sidelen (int): side length of the grid
+        cells (int): number of cells along each side
+        bands (int): number of bands each line is located in separately
 
     Returns
     -------
-        mtx_indices (list): column of row, column index tuples for use in matrix
-        digits (list): openCV images of digits
+        xs (np.ndarray): (bands, cells + 1) x-coordinates of the vertical
+            lines, in each band of rows
+        ys (np.ndarray): (bands, cells + 1) y-coordinates of the horizontal
+            lines, in each band of columns
+        strength (np.ndarray): fraction of the grid side covered by each line,
+            vertical lines first
     """
 
-    # instatiating lists to hold digit locations  and cropped image of the digit
-    mtx_indices = []
-    digit_images = []
+    cell = sidelen / cells
+    expected = np.rint(margin + cell * np.arange(cells + 1)).astype("int")
 
-    # the mount by which to expand or contact cell boundaries by
-    # helps if cells have white boundaries
-    OFFSET = 3
+    # keeping only strokes at least half a cell long, which digits are not
+    inner = image[margin : margin + sidelen, margin : margin + sidelen]
+    kernel = np.ones((int(cell / 2), 1), "uint8")
+    edges = np.linspace(0, sidelen, bands + 1).astype("int")
 
-    for idx, b in enumerate(bboxes):
-        # cropping a cell and resizing
-        cell = image[
-            b[1] + OFFSET : b[1] + b[3] - OFFSET, b[0] + OFFSET : b[0] + b[2] - OFFSET
-        ]
-        cell = cv2.resize(cell, (28, 28), interpolation=cv2.INTER_AREA)
+    lines = []
+    strengths = []
+    # vertical lines first, then horizontal ones as vertical lines of the
+    # transposed grid, which opens and sums faster than along rows
+    for view in (inner, np.ascontiguousarray(inner.T)):
+        strokes = cv2.morphologyEx(view, cv2.MORPH_OPEN, kernel)
+
+        # foreground pixels along each line, per band across the lines
+        profile = np.zeros((bands, sidelen + 2 * margin))
+        for band, (start, end) in enumerate(zip(edges[:-1], edges[1:])):
+            profile[band, margin : margin + sidelen] = cv2.reduce(
+                strokes[start:end], 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S
+            )[0]
+        profile /= strokes.max(initial=1)
+
+        # lines are a few pixels thick and may be slightly tilted
+        profile += np.roll(profile, 1, axis=1) + np.roll(profile, -1, axis=1)
+
+        overall = profile.sum(axis=0)
+        positions = _search_lines(overall, expected, int(cell / 3))
+        strengths.append(overall[positions] / (3 * sidelen))
+
+        # bands where a line is barely visible keep its overall position
+        local = _search_lines(profile, positions, int(cell / 6))
+        support = profile[np.arange(bands)[:, None], local]
+        weak = support < overall[positions] / (2 * bands)
+        lines.append(np.where(weak, positions, local))
+
+    return lines[0], lines[1], np.concatenate(strengths)
+
+
+def grid_cells(xs: np.ndarray, ys: np.ndarray) -> Tuple[list, list]:
+    """
+    Derives the cell boxes and centers of a grid from its lines, ordered
+    left-to-right, top-to-bottom. Each cell is bounded by the lines of the
+    band it lies in.
+
+    Parameters
+    ----------
+        xs (np.ndarray): (bands, n) x-coordinates of the vertical lines
+        ys (np.ndarray): (bands, n) y-coordinates of the horizontal lines
+
+    Returns
+    -------
+        bboxes (list): (x, y, width, height) of every cell
+        centers (list): (x, y) center of every cell
+    """
+
+    xs, ys = np.atleast_2d(xs), np.atleast_2d(ys)
+    cells = xs.shape[1] - 1
+    row, col = np.indices((cells, cells))
+    row_band, col_band = row * len(xs) // cells, col * len(ys) // cells
+
+    x, y = xs[row_band, col], ys[col_band, row]
+    w, h = xs[row_band, col + 1] - x, ys[col_band, row + 1] - y
+
+    bboxes = np.stack([x, y, w, h], axis=-1).reshape((-1, 4))
+    centers = np.stack([x + w // 2, y + h // 2], axis=-1).reshape((-1, 2))
+
+    return [tuple(map(int, b)) for b in bboxes], [tuple(map(int, c)) for c in centers]
+
+
+def extract_cell_batch(
+    image: np.ndarray,
+    bboxes: list,
+    out: np.ndarray | None = None,
+    size: int = 28,
+    offset: int = 3,
+) -> np.ndarray:
+    """
+    Crops every cell of the sudoku grid into a single batch. One remap samples
+    all the cells into a strip of tiles, which is cleaned up in one pass and
+    reshaped into the batch without copying. Tiles are separated by an empty
+    row so that connected components never span two cells.
+
+    Parameters
+    ----------
+        image (np.ndarray): thresholded image of the sudoku grid
+        bboxes (list): (x, y, width, height) boxes of the cells
+        out (np.ndarray): (n, size, size, 1) float32 array to write the cells
+            into, allocated if not given
+        size (int): side length of a cell in the batch
+        offset (int): pixels trimmed off every side of a box, helps if cells
+            have white boundaries
+
+    Returns
+    -------
+        cells (np.ndarray): (n, size, size, 1) cells scaled to [0, 1]
+    """
+
+    boxes = np.asarray(bboxes, dtype="float32").reshape((-1, 4))
+    n = len(boxes)
+    if out is None:
+        out = np.empty((n, size, size, 1), dtype="float32")
+
+    x, y = boxes[:, 0] + offset, boxes[:, 1] + offset
+    w, h = boxes[:, 2] - 2 * offset, boxes[:, 3] - 2 * offset
+
+    # sampling the center of every output pixel, the extra row stays empty
+    t = (np.arange(size, dtype="float32") + 0.5) / size
+    map_x = np.full((n, size + 1, size), -1.0, dtype="float32")
+    map_y = np.full((n, size + 1, size), -1.0, dtype="float32")
+    map_x[:, :size] = (x[:, None] + w[:, None] * t - 0.5)[:, None, :]
+    map_y[:, :size] = (y[:, None] + h[:, None] * t - 0.5)[:, :, None]
+
+    strip = cv2.remap(
+        image,
+        map_x.reshape((-1, size)),
+        map_y.reshape((-1, size)),
+        cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=0,
+    )
+    remove_specks(strip, size * size)
+
+    tiles = strip.reshape((n, size + 1, size))[:, :size]
+    np.multiply(tiles, 1 / 255, out=out[..., 0])
+
+    return out
+
+
+def remove_specks(
+    image: np.ndarray, cell_area: int, max_speck: float = 0.05
+) -> np.ndarray:
+    """
+    Erases, in place, the connected components that are too small to be a
+    digit or part of one. As with contour areas, a component's area is that
+    of the polygon through its boundary pixels, which by Pick's theorem is
+    its pixel count less half its boundary pixels, so thin slivers of grid
+    line count as small.
+
+    Parameters
+    ----------
+        image (np.ndarray): black and white image, e.g. a strip of cells
+        cell_area (int): area of a single cell in pixels
+        max_speck (float): largest area of a speck relative to a cell
+
+    Returns
+    -------
+        image (np.ndarray): the cleaned up image
+    """
 
-        # converting index value to index for 2d array
-        row_idx, col_idx = idx // 9, idx % 9
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(image, connectivity=8)
 
-        # storing results
-        mtx_indices.append((row_idx, col_idx))
-        digit_images.append(cell)
+    # boundary pixels have a background pixel above, below or to either side
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    boundary = (image > 0) & (cv2.erode(image, cross, borderValue=0) == 0)
+    boundaries = np.bincount(labels[boundary], minlength=count)
 
-    return mtx_indices, digit_images
+    # background is label 0 and is never kept
+    area = stats[:, cv2.CC_STAT_AREA] - boundaries / 2 - 1
+    keep = (area >= max_speck * cell_area).astype("uint8")
+    keep[0] = 0
+    image *= keep[labels]
+
+    return image
+
+
+def find_blanks(
+    cells: np.ndarray, max_ink: float = 0.02, max_offset: float = 0.3
+) -> np.ndarray:
+    """
+    Picks out the cells that are empty beyond doubt, without a model: cells
+    with next to no ink, and cells with a little ink far from their middle,
+    which is what is left of a grid line rather than a digit.
+
+    Parameters
+    ----------
+        cells (np.ndarray): (n, h, w, 1) cells scaled to [0, 1]
+        max_ink (float): most ink of an empty cell, relative to its area
+        max_offset (float): distance of the ink from the middle of the cell,
+            relative to its height, past which twice as much ink is allowed
+
+    Returns
+    -------
+        blanks (np.ndarray): (n,) boolean mask of the empty cells
+    """
+
+    height, width = cells.shape[1:3]
+    ink = cells.reshape((len(cells), -1)).mean(axis=1)
+
+    # center of mass of the ink, cells without ink count as centered
+    mass = np.maximum(ink * height * width, 1e-6)
+    rows, cols = np.indices((height, width))
+    center_y = np.einsum("nhw,hw->n", cells[..., 0], rows) / mass
+    center_x = np.einsum("nhw,hw->n", cells[..., 0], cols) / mass
+    offset = np.hypot(center_y - (height - 1) / 2, center_x - (width - 1) / 2)
+    offset = np.where(ink > 0, offset / height, 0.0)
+
+    return (ink <= max_ink) | ((ink <= 2 * max_ink) & (offset > max_offset))
 
 
 def write_text(image, puzzle, solution, centers, mode="solution"):
     """
-    Writes the solved values onto the sudoku image.
+    Writes the solved values onto the sudoku image. Values past 9 are written
+    as letters, A for 10, and text shrinks with the number of cells per row.
 
     Parameters
     ----------
@@ -164,6 +365,9 @@ def write_text(image, puzzle, solution, centers, mode="solution"):
         image (np.ndarray): original image with text annotations
     """
 
+    # text is sized for 9 cells per row
+    shrink = 9 / len(puzzle)
+
     # flattening will make iteration straight forward
     puzzle = puzzle.flatten()
     solution = solution.flatten()
@@ -183,11 +387,15 @@ def write_text(image, puzzle, solution, centers, mode="solution"):
     else:
         raise ValueError("Mode must be either 'solution' or 'starting_values'")
 
+    offset = int(offset * shrink)
+    font_scale *= shrink
+    thickness = max(1, round(thickness * shrink))
+
     # writing text on to image
     for val, c in digits_to_write:
         cv2.putText(
             img=image,
-            text=str(val),
+            text=str(val) if val < 10 else chr(ord("A") + val - 10),
             org=(c[0] - offset, c[1] + offset),
             fontFace=cv2.FONT_HERSHEY_SIMPLEX,
             fontScale=font_scale,
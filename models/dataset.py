@@ -0,0 +1,300 @@
+import json
+import os
+from typing import Iterator, Tuple
+
+import numpy as np
+
+# shape of a cell, as the model sees it without the channel axis
+CELL_SHAPE = (28, 28)
+
+# cells per shard, about 50 MB of uint8 pixels
+SHARD_SIZE = 65536
+
+# file describing the shards of a dataset
+MANIFEST = "manifest.json"
+
+# bumped whenever the layout of the shards changes
+FORMAT_VERSION = 1
+
+# probability of a pixel being ink in a noisy blank cell, see augment
+NOISE = 0.2
+
+
+class ShardWriter:
+    """
+    Streams labelled cells into a directory of uint8 .npy shards, one file
+    of cells and one of labels per shard, so datasets far larger than memory
+    can be written. At most one shard is held in memory. The manifest listing
+    the shards is written on close, and replaced atomically, so a dataset is
+    never read half written.
+
+    Parameters
+    ----------
+        directory (str): directory to write the shards and manifest into,
+            created if needed
+        shard_size (int): cells per shard
+        classes (int): number of classes, 0 standing for blank cells
+        metadata (dict): JSON serializable description of the data, e.g.
+            how it was generated, kept in the manifest
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        shard_size: int = SHARD_SIZE,
+        classes: int = 10,
+        metadata: dict | None = None,
+    ):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.classes = classes
+        self.metadata = metadata or {}
+        self.shards = []
+
+        # cells written so far, including those not flushed yet
+        self.count = 0
+
+        self._cells = np.empty((shard_size, *CELL_SHAPE), dtype="uint8")
+        self._labels = np.empty(shard_size, dtype="uint8")
+        self._filled = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, cells: np.ndarray, labels: np.ndarray):
+        """
+        Parameters
+        ----------
+            cells (np.ndarray): (N, 28, 28) or (N, 28, 28, 1) uint8 cells,
+                ink as 255
+            labels (np.ndarray): (N,) digit of every cell, 0 for blanks
+        """
+
+        cells = np.asarray(cells, dtype="uint8").reshape((-1, *CELL_SHAPE))
+        labels = np.asarray(labels, dtype="uint8").reshape(-1)
+        if len(cells) != len(labels):
+            raise ValueError("There must be one label per cell.")
+
+        start = 0
+        while start < len(cells):
+            n = min(len(cells) - start, self.shard_size - self._filled)
+            self._cells[self._filled : self._filled + n] = cells[start : start + n]
+            self._labels[self._filled : self._filled + n] = labels[start : start + n]
+            self._filled += n
+            self.count += n
+            start += n
+
+            if self._filled == self.shard_size:
+                self._flush()
+
+    def close(self):
+        if self._filled:
+            self._flush()
+
+        manifest = {
+            "format": FORMAT_VERSION,
+            "cell_shape": list(CELL_SHAPE),
+            "classes": self.classes,
+            "count": self.count,
+            "shards": self.shards,
+            "metadata": self.metadata,
+        }
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _flush(self):
+        idx = len(self.shards)
+        shard = {
+            "cells": f"cells-{idx:05d}.npy",
+            "labels": f"labels-{idx:05d}.npy",
+            "count": self._filled,
+        }
+        np.save(
+            os.path.join(self.directory, shard["cells"]), self._cells[: self._filled]
+        )
+        np.save(
+            os.path.join(self.directory, shard["labels"]), self._labels[: self._filled]
+        )
+
+        self.shards.append(shard)
+        self._filled = 0
+
+
+class CellDataset:
+    """
+    Labelled cells written by ShardWriter, possibly to several directories,
+    e.g. a font dataset and generated photo cells. Shards are memory-mapped,
+    so opening a dataset reads nothing but the manifests, and batches only
+    read the cells they hold.
+
+    Parameters
+    ----------
+        directories (str): directories holding a manifest and its shards
+    """
+
+    def __init__(self, *directories: str):
+        self.manifests = []
+        self.cells = []
+        self.labels = []
+        for directory in directories:
+            with open(os.path.join(directory, MANIFEST)) as f:
+                manifest = json.load(f)
+
+            if manifest["format"] != FORMAT_VERSION:
+                raise ValueError(
+                    f"Unsupported dataset format {manifest['format']} in "
+                    f"{directory}, expected {FORMAT_VERSION}."
+                )
+
+            self.manifests.append(manifest)
+            for shard in manifest["shards"]:
+                self.cells.append(
+                    np.load(os.path.join(directory, shard["cells"]), mmap_mode="r")
+                )
+                self.labels.append(
+                    np.load(os.path.join(directory, shard["labels"]), mmap_mode="r")
+                )
+
+        self.classes = max(manifest["classes"] for manifest in self.manifests)
+
+        # index of the first cell of every shard, and one past the last
+        self.offsets = np.cumsum([0] + [len(labels) for labels in self.labels])
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def take(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gathers cells by their index in the dataset, reading each shard once.
+
+        Returns
+        -------
+            cells (np.ndarray): (N, 28, 28) uint8 cells, in the order given
+            labels (np.ndarray): (N,) uint8 labels
+        """
+
+        indices = np.asarray(indices)
+        cells = np.empty((len(indices), *CELL_SHAPE), dtype="uint8")
+        labels = np.empty(len(indices), dtype="uint8")
+
+        shards = np.searchsorted(self.offsets, indices, side="right") - 1
+        for shard in np.unique(shards):
+            where = np.flatnonzero(shards == shard)
+            local = indices[where] - self.offsets[shard]
+
+            # memory-mapped reads are cheapest in file order
+            order = np.argsort(local)
+            cells[where[order]] = self.cells[shard][local[order]]
+            labels[where[order]] = self.labels[shard][local[order]]
+
+        return cells, labels
+
+    def split(self, fractions: tuple, seed: int = 0) -> list:
+        """
+        Splits the dataset at random, e.g. into training and test cells.
+
+        Parameters
+        ----------
+            fractions (tuple): share of the cells in each part but the last,
+                which gets the rest
+            seed (int): seed of the shuffle, so splits are reproducible
+
+        Returns
+        -------
+            parts (list): array of cell indices per part
+        """
+
+        indices = np.random.default_rng(seed).permutation(len(self))
+        bounds = (np.cumsum(fractions) * len(self)).astype(int)
+
+        return np.split(indices, bounds)
+
+    def batches(
+        self,
+        indices: np.ndarray,
+        batch_size: int,
+        rng: np.random.Generator | None = None,
+        **augmentation,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Streams the given cells in batches, shuffled and augmented with
+        augment if a random generator is given. Each pass draws a new order
+        and new augmentations from the generator.
+
+        Parameters
+        ----------
+            indices (np.ndarray): cells to stream, e.g. a part of split
+            batch_size (int): cells per batch, the last batch may be smaller
+            rng (np.random.Generator): random source, None to stream the
+                cells as they are, in order
+            augmentation: keyword arguments of augment
+
+        Returns
+        -------
+            batches (Iterator): (cells, labels) of every batch, as in take
+        """
+
+        if rng is not None:
+            indices = rng.permutation(indices)
+
+        for start in range(0, len(indices), batch_size):
+            cells, labels = self.take(indices[start : start + batch_size])
+            if rng is not None:
+                cells = augment(cells, labels, rng, **augmentation)
+            yield cells, labels
+
+
+def augment(
+    cells: np.ndarray,
+    labels: np.ndarray,
+    rng: np.random.Generator,
+    noisy_blanks: float = 0.5,
+    noise: float = NOISE,
+    shift: int = 2,
+) -> np.ndarray:
+    """
+    Randomly perturbs a batch of cells while it's streamed, instead of
+    storing perturbed copies: blank cells are filled with salt noise, like
+    the specks left after thresholding, and cells are shifted by a few
+    pixels, like digits off the center of their cell.
+
+    Parameters
+    ----------
+        cells (np.ndarray): (N, 28, 28) uint8 cells, not modified
+        labels (np.ndarray): (N,) labels, 0 for blanks
+        rng (np.random.Generator): random source
+        noisy_blanks (float): share of blank cells filled with noise
+        noise (float): probability of a pixel being ink in a noisy cell
+        shift (int): most pixels cells are shifted by along each axis
+
+    Returns
+    -------
+        augmented (np.ndarray): (N, 28, 28) uint8 cells
+    """
+
+    n = len(cells)
+    h, w = CELL_SHAPE
+
+    # shifting by reading each cell through a window moved over its padding
+    if shift:
+        padded = np.pad(cells, ((0, 0), (shift, shift), (shift, shift)))
+        dy, dx = rng.integers(0, 2 * shift + 1, size=(2, n))
+        rows = (np.arange(h)[None, :] + dy[:, None])[:, :, None]
+        cols = (np.arange(w)[None, :] + dx[:, None])[:, None, :]
+        cells = padded[np.arange(n)[:, None, None], rows, cols]
+    else:
+        cells = cells.copy()
+
+    noisy = (labels == 0) & (rng.random(n) < noisy_blanks)
+    if noisy.any():
+        specks = rng.random((int(noisy.sum()), h, w)) < noise
+        cells[noisy] = np.where(specks, 255, cells[noisy]).astype("uint8")
+
+    return cells
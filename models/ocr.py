@@ -0,0 +1,242 @@
+import hashlib
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# directory models are saved in and exported to
+MODEL_DIR = "models/"
+
+# what each backend loads from models/, appended to the name of the model
+MODEL_SUFFIXES = {"keras": "", "tflite": ".tflite", "onnx": ".onnx", "numpy": ".npz"}
+
+
+class KerasBackend:
+    """
+    Runs the saved Keras model. Importing TensorFlow is deferred until the
+    backend is created.
+
+    Parameters
+    ----------
+        name (str): name of the saved model in models/
+    """
+
+    def __init__(self, name: str):
+        from tensorflow.keras.models import load_model
+
+        self.model = load_model(MODEL_DIR + name)
+
+    def predict(self, digits: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict_on_batch(digits))
+
+
+class TFLiteBackend:
+    """
+    Runs a model exported to models/<name>.tflite, using the standalone
+    tflite_runtime package when it is installed. Quantized int8 inputs and
+    outputs are converted transparently.
+
+    Parameters
+    ----------
+        name (str): name of the exported model in models/
+    """
+
+    def __init__(self, name: str):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=MODEL_DIR + name + ".tflite")
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def predict(self, digits: np.ndarray) -> np.ndarray:
+        # the interpreter has a fixed batch size, resized whenever it changes
+        if self.input["shape"][0] != len(digits):
+            self.interpreter.resize_tensor_input(self.input["index"], digits.shape)
+            self.interpreter.allocate_tensors()
+            self.input = self.interpreter.get_input_details()[0]
+            self.output = self.interpreter.get_output_details()[0]
+
+        self.interpreter.set_tensor(self.input["index"], _quantize(digits, self.input))
+        self.interpreter.invoke()
+
+        return _dequantize(
+            self.interpreter.get_tensor(self.output["index"]), self.output
+        )
+
+
+class OnnxBackend:
+    """
+    Runs a model exported to models/<name>.onnx with onnxruntime.
+
+    Parameters
+    ----------
+        name (str): name of the exported model in models/
+    """
+
+    def __init__(self, name: str):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(
+            MODEL_DIR + name + ".onnx", providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, digits: np.ndarray) -> np.ndarray:
+        feed = {self.input_name: digits.astype("float32")}
+        return self.session.run(None, feed)[0]
+
+
+class NumpyBackend:
+    """
+    Pure NumPy forward pass of the digitnet architecture (convolution and
+    pooling blocks followed by a dense softmax layer), using weights exported
+    to models/<name>.npz. Needs nothing beyond NumPy.
+
+    Parameters
+    ----------
+        name (str): name of the exported weights in models/
+    """
+
+    def __init__(self, name: str):
+        with np.load(MODEL_DIR + name + ".npz") as weights:
+            self.weights = {k: weights[k].astype("float32") for k in weights.files}
+
+        self.n_conv = sum(1 for k in self.weights if k.startswith("conv")) // 2
+
+    def predict(self, digits: np.ndarray) -> np.ndarray:
+        x = digits.astype("float32")
+
+        for i in range(self.n_conv):
+            x = _conv2d(
+                x, self.weights[f"conv{i}_kernel"], self.weights[f"conv{i}_bias"]
+            )
+            x = _max_pool(np.maximum(x, 0))
+
+        # dropout is inactive at inference, so the dense layer follows directly
+        logits = x.reshape(len(x), -1) @ self.weights["dense_kernel"]
+        logits += self.weights["dense_bias"]
+
+        return _softmax(logits)
+
+
+def _quantize(values: np.ndarray, details: dict) -> np.ndarray:
+    """
+    Converts float inputs to the tensor's dtype, applying its quantization.
+    """
+
+    scale, zero_point = details["quantization"]
+    if scale == 0:
+        return values.astype(details["dtype"])
+
+    info = np.iinfo(details["dtype"])
+    quantized = np.round(values / scale + zero_point).clip(info.min, info.max)
+
+    return quantized.astype(details["dtype"])
+
+
+def _dequantize(values: np.ndarray, details: dict) -> np.ndarray:
+    """
+    Converts a quantized output tensor back to floats.
+    """
+
+    scale, zero_point = details["quantization"]
+    if scale == 0:
+        return values.astype("float32")
+
+    return (values.astype("float32") - zero_point) * scale
+
+
+def _conv2d(x: np.ndarray, kernel: np.ndarray, bias: np.ndarray) -> np.ndarray:
+    """
+    Valid, stride 1 convolution of (n, h, w, c_in) inputs with a Keras
+    (kh, kw, c_in, c_out) kernel.
+    """
+
+    kh, kw = kernel.shape[:2]
+
+    # windows have shape (n, h - kh + 1, w - kw + 1, c_in, kh, kw)
+    windows = sliding_window_view(x, (kh, kw), axis=(1, 2))
+
+    return np.tensordot(windows, kernel, axes=([4, 5, 3], [0, 1, 2])) + bias
+
+
+def _max_pool(x: np.ndarray) -> np.ndarray:
+    """
+    2x2 max pooling with stride 2, dropping odd trailing rows and columns.
+    """
+
+    n, h, w, c = x.shape
+    x = x[:, : h // 2 * 2, : w // 2 * 2]
+
+    return x.reshape((n, h // 2, 2, w // 2, 2, c)).max(axis=(2, 4))
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+# inference backends selectable by name
+BACKENDS = {
+    "keras": KerasBackend,
+    "tflite": TFLiteBackend,
+    "onnx": OnnxBackend,
+    "numpy": NumpyBackend,
+}
+
+
+def model_fingerprint(name: str, backend: str = "keras") -> str:
+    """
+    Hashes the files a backend loads the model from, so that anything derived
+    from its predictions can tell when the model changed.
+
+    Parameters
+    ----------
+        name (str): name of the model in models/
+        backend (str): one of the keys of BACKENDS
+
+    Returns
+    -------
+        fingerprint (str): hex digest of the backend and model files
+    """
+
+    path = MODEL_DIR + name + MODEL_SUFFIXES[backend]
+    files = [path]
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(root, f) for root, _, names in os.walk(path) for f in names
+        )
+
+    digest = hashlib.sha256(backend.encode())
+    for file in files:
+        digest.update(os.path.relpath(file, MODEL_DIR).encode())
+        with open(file, "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def load_backend(name: str, backend: str = "keras"):
+    """
+    Loads a digit recognition model with the chosen inference backend.
+
+    Parameters
+    ----------
+        name (str): name of the model in models/
+        backend (str): one of the keys of BACKENDS
+
+    Returns
+    -------
+        model: backend with a predict method returning class probabilities
+    """
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend must be one of {', '.join(BACKENDS)}")
+
+    return BACKENDS[backend](name)
@@ -1,72 +1,956 @@
+import functools
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Tuple
+
 import numpy as np
 import pulp as pulp
 
+# status codes mirror pulp's LpStatus so every engine reports the same way
+STATUS_NOT_SOLVED = 0
+STATUS_SOLVED = 1
+STATUS_INFEASIBLE = -1
 
-class SudokuSolver:
-    rows = range(1, 10)
-    cols = range(1, 10)
-    vals = range(1, 10)
+# the solver ran out of its time budget, pulp has no code of its own for it
+# and reports CBC runs stopped on time as not solved
+STATUS_TIMEOUT = -4
 
-    def __init__(self, puzzle):
-        self.problem = pulp.LpProblem("Sudoku", pulp.LpMinimize)
-        self.variables = pulp.LpVariable.dicts(
-            name="var", indices=(self.rows, self.cols, self.vals), cat="Binary"
+# nodes of the first run of BitmaskSolver.solve, each restart allowing this
+# many times more than the previous one
+RESTART_NODES = 100
+RESTART_GROWTH = 1.5
+
+# symbols of the values of a cell, values past 9 are written as letters
+SYMBOLS = "0123456789ABCDEFGHIJKLMNOP"
+
+
+def box_shape(size: int) -> Tuple[int, int]:
+    """
+    Shape of the boxes of a grid with `size` cells per side: as square as
+    possible, with no more rows than columns, e.g. 2x3 boxes for 6x6 grids and
+    4x4 boxes for 16x16 grids.
+
+    Parameters
+    ----------
+        size (int): number of cells along each side of the grid
+
+    Returns
+    -------
+        rows (int): rows of cells in each box
+        cols (int): columns of cells in each box
+    """
+
+    rows = max((r for r in range(1, math.isqrt(size) + 1) if size % r == 0), default=1)
+    if rows == 1 or size >= len(SYMBOLS):
+        raise ValueError(f"Grids of size {size} are not supported")
+
+    return rows, size // rows
+
+
+def grid_string(grid: np.ndarray) -> str:
+    """
+    Writes a grid as a string with one symbol per cell, row by row.
+    """
+
+    return "".join(SYMBOLS[v] for v in np.asarray(grid).flatten().tolist())
+
+
+@functools.lru_cache(maxsize=None)
+def _geometry(size: int) -> tuple:
+    """
+    Bitmask representation of a grid with `size` cells per side.
+
+    Returns
+    -------
+        all_digits (int): bitmask of all digits, bit v set means digit v is
+            available (bit 0 unused)
+        units (list): cells of every unit: rows, then columns, then boxes
+        cell_units (list): indices of the row, column and box unit of every
+            cell
+    """
+
+    rows, cols = box_shape(size)
+    units = (
+        [[r * size + c for c in range(size)] for r in range(size)]
+        + [[r * size + c for r in range(size)] for c in range(size)]
+        + [
+            [(br + r) * size + bc + c for r in range(rows) for c in range(cols)]
+            for br in range(0, size, rows)
+            for bc in range(0, size, cols)
+        ]
+    )
+    cell_units = [
+        (
+            i // size,
+            size + i % size,
+            2 * size + (i // size) // rows * rows + (i % size) // cols,
         )
+        for i in range(size * size)
+    ]
+
+    return (1 << size + 1) - 2, units, cell_units
+
+
+class BaseSolver:
+    """
+    Common interface for sudoku solving engines. Subclasses populate
+    `solution` with an NxN matrix and `status` with one of the STATUS_* codes
+    when `solve` is called.
+
+    Enumerating solutions doesn't depend on the engine, every engine does it
+    with the bitmask search under a budget of search nodes and time.
+    `exhausted` tells whether the last enumeration ran out of budget.
+
+    Parameters
+    ----------
+        puzzle (np.ndarray): NxN matrix of starting values, 0 for empty cells,
+            N being 9 or any other size box_shape supports
+    """
+
+    def __init__(self, puzzle):
         self.puzzle = puzzle
         self.solution = None
+        self.status = STATUS_NOT_SOLVED
+        self.exhausted = False
 
-        # constraint that each cell contains only one digit
-        for r in self.rows:
-            for c in self.cols:
-                self.problem += (
-                    pulp.lpSum([self.variables[r][c][v] for v in self.vals]) == 1
-                )
+    def solve(self, time_budget: float | None = None):
+        """
+        Parameters
+        ----------
+            time_budget (float): seconds the engine may take, after which
+                `status` is STATUS_TIMEOUT, None for no limit
+        """
 
-        for v in self.vals:
-            # constraint the each row contains unique instances of values 1-9
-            for r in self.rows:
-                self.problem += (
-                    pulp.lpSum([self.variables[r][c][v] for c in self.cols]) == 1
-                )
+        raise NotImplementedError
 
-            # constraint the each column contains unique instances of values 1-9
-            for c in self.cols:
-                self.problem += (
-                    pulp.lpSum([self.variables[r][c][v] for r in self.rows]) == 1
-                )
+    def iter_solutions(
+        self, max_nodes: int | None = None, time_budget: float | None = None
+    ):
+        """
+        Yields the solutions of the puzzle as NxN matrices until there are no
+        more or the budget runs out.
+
+        Parameters
+        ----------
+            max_nodes (int): most search nodes visited, None for no limit
+            time_budget (float): seconds the search may take, None for no
+                limit
+        """
+
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        budget = _Budget(max_nodes, deadline)
+        self.exhausted = False
+
+        state = _initial_state(self.puzzle)
+        if state is None:
+            return
+
+        shape = np.shape(self.puzzle)
+        try:
+            for grid in _search(*state, budget):
+                yield np.array([bit.bit_length() - 1 for bit in grid]).reshape(shape)
+        finally:
+            self.exhausted = budget.exhausted
+
+    def count_solutions(
+        self,
+        limit: int = 2,
+        max_nodes: int | None = None,
+        time_budget: float | None = None,
+    ) -> int | None:
+        """
+        Counts the solutions of the puzzle, stopping as soon as `limit` are
+        found, so the default tells unique puzzles apart from the others.
+
+        Parameters
+        ----------
+            limit (int): most solutions counted
+            max_nodes (int): most search nodes visited, None for no limit
+            time_budget (float): seconds the search may take, None for no
+                limit
+
+        Returns
+        -------
+            count (int): number of solutions, at most `limit`, None if the
+                budget ran out first
+        """
+
+        solutions = self.iter_solutions(max_nodes, time_budget)
+        count = sum(1 for _ in itertools.islice(solutions, limit))
+        solutions.close()
+
+        if count < limit and self.exhausted:
+            return None
+
+        return count
+
+
+class SudokuSolver(BaseSolver):
+    """
+    Integer programming formulation of sudoku, solved with CBC through PuLP.
+
+    The structural constraints are the same for every puzzle of a size, so
+    the model is built once per process and size and shared. Each puzzle only
+    fixes the lower bound of its given digits' variables for the duration of
+    its solve.
+    """
+
+    def __init__(self, puzzle):
+        super().__init__(puzzle)
+        self.size = len(puzzle)
+        self.problem, self.variables, self._flat_variables = _structural_model(
+            self.size
+        )
+
+        # variables of the starting values, which cannot change
+        self.givens = [
+            self.variables[r + 1][c + 1][self.puzzle[r, c]]
+            for r, c in zip(*np.nonzero(self.puzzle))
+        ]
+
+    def solve(self, time_budget: float | None = None):
+        # the shared model can only hold one puzzle's givens at a time
+        with _CBC_LOCK:
+            for var in self.givens:
+                var.lowBound = 1
+
+            # solving
+            try:
+                self.problem.solve(pulp.PULP_CBC_CMD(msg=0, timeLimit=time_budget))
+                self.status = self.problem.status
+                if time_budget is not None and self.status == STATUS_NOT_SOLVED:
+                    self.status = STATUS_TIMEOUT
+                values = np.array([var.varValue or 0 for var in self._flat_variables])
+            finally:
+                for var in self.givens:
+                    var.lowBound = 0
+
+        # solution attribute is NxN matrix representing sudoku grid
+        values = values.reshape((self.size, self.size, self.size))
+        self.solution = np.where(values.max(axis=2) > 0.5, values.argmax(axis=2) + 1, 0)
+
+
+# guards the shared CBC model while a puzzle's givens are applied to it
+_CBC_LOCK = threading.Lock()
 
-        # constraint that each 3x3 section contains unique instances of values 1-9
-        for r_shift in [0, 3, 6]:
-            for c_shift in [0, 3, 6]:
-                for v in self.vals:
-                    self.problem += (
-                        pulp.lpSum(
-                            [
-                                self.variables[r + r_shift][c + c_shift][v]
-                                for r in range(1, 4)
-                                for c in range(1, 4)
-                            ]
-                        )
-                        == 1
+
+@functools.lru_cache(maxsize=None)
+def _structural_model(size: int = 9) -> Tuple[pulp.LpProblem, dict, list]:
+    """
+    Builds the puzzle independent part of the integer program.
+
+    Parameters
+    ----------
+        size (int): number of cells along each side of the grid
+
+    Returns
+    -------
+        problem (pulp.LpProblem): model holding the structural constraints
+        variables (dict): binary variables indexed by row, column and value,
+            all counted from 1
+        flat_variables (list): the same variables in row, column, value order
+    """
+
+    rows = range(1, size + 1)
+    cols = range(1, size + 1)
+    vals = range(1, size + 1)
+    box_rows, box_cols = box_shape(size)
+
+    problem = pulp.LpProblem("Sudoku", pulp.LpMinimize)
+    variables = pulp.LpVariable.dicts(
+        name="var", indices=(rows, cols, vals), cat="Binary"
+    )
+
+    # constraint that each cell contains only one digit
+    for r in rows:
+        for c in cols:
+            problem += pulp.lpSum([variables[r][c][v] for v in vals]) == 1
+
+    for v in vals:
+        # constraint the each row contains unique instances of values 1-N
+        for r in rows:
+            problem += pulp.lpSum([variables[r][c][v] for c in cols]) == 1
+
+        # constraint the each column contains unique instances of values 1-N
+        for c in cols:
+            problem += pulp.lpSum([variables[r][c][v] for r in rows]) == 1
+
+    # constraint that each box contains unique instances of values 1-N
+    for r_shift in range(0, size, box_rows):
+        for c_shift in range(0, size, box_cols):
+            for v in vals:
+                problem += (
+                    pulp.lpSum(
+                        [
+                            variables[r + r_shift][c + c_shift][v]
+                            for r in range(1, box_rows + 1)
+                            for c in range(1, box_cols + 1)
+                        ]
                     )
+                    == 1
+                )
+
+    flat_variables = [variables[r][c][v] for r in rows for c in cols for v in vals]
+
+    return problem, variables, flat_variables
+
+
+class BitmaskSolver(BaseSolver):
+    """
+    In-process constraint propagation solver. Every row, column and box keeps a
+    bitmask of the digits it already holds, naked and hidden singles are filled
+    in until nothing changes, and the remaining cells are searched by
+    backtracking on the cell with the fewest candidates.
+
+    A wrong guess early on can leave the search in a subtree with no solution
+    that takes orders of magnitude longer to exhaust than the rest of the
+    search, mostly on large grids. Runs are therefore cut off after
+    RESTART_NODES nodes and restarted with the candidates tried in a new
+    random order, each run allowed RESTART_GROWTH times more nodes than the
+    last, so the search still completes eventually. The random orders are
+    seeded, so solving is reproducible.
+    """
+
+    def solve(self, time_budget: float | None = None):
+        self.solution = np.zeros(np.shape(self.puzzle), dtype="int")
+        self.exhausted = False
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+
+        # any conflict among the starting values means there is no solution
+        state = _initial_state(self.puzzle)
+        grid, rng, max_nodes = None, None, RESTART_NODES
+        while state is not None:
+            budget = _Budget(max_nodes, deadline)
+            grid = next(_search(*state, budget, rng), None)
+            if grid is not None or not budget.exhausted:
+                break
+
+            if deadline is not None and time.perf_counter() > deadline:
+                self.status, self.exhausted = STATUS_TIMEOUT, True
+                return
+
+            rng = random.Random(max_nodes)
+            max_nodes = int(max_nodes * RESTART_GROWTH)
+
+        if grid is None:
+            self.status = STATUS_INFEASIBLE
+        else:
+            self.status = STATUS_SOLVED
+            digits = [bit.bit_length() - 1 for bit in grid]
+            self.solution[:] = np.array(digits).reshape(self.solution.shape)
+
+
+def _initial_state(puzzle: np.ndarray) -> tuple | None:
+    """
+    Converts a puzzle into the bitmask representation used by the search.
+
+    Parameters
+    ----------
+        puzzle (np.ndarray): NxN matrix of starting values, 0 for empty cells
+
+    Returns
+    -------
+        grid (list): N*N cell bitmasks, 0 for empty cells
+        used (list): 3*N unit bitmasks of the digits already placed
+        geometry (tuple): units of the grid, see _geometry
+        (None is returned if the starting values conflict)
+    """
+
+    puzzle = np.asarray(puzzle)
+    size = len(puzzle)
+    geometry = _geometry(size)
+    grid = [0] * size**2
+    used = [0] * 3 * size
+
+    for cell, val in enumerate(puzzle.flatten().tolist()):
+        if val > size or val != 0 and not _place(grid, used, geometry, cell, 1 << val):
+            return None
+
+    return grid, used, geometry
+
+
+def _place(grid: list, used: list, geometry: tuple, cell: int, bit: int) -> bool:
+    """
+    Writes a digit into a cell, returning False if one of its units already
+    holds that digit.
+    """
+
+    r, c, b = geometry[2][cell]
+    if (used[r] | used[c] | used[b]) & bit:
+        return False
+
+    grid[cell] = bit
+    used[r] |= bit
+    used[c] |= bit
+    used[b] |= bit
+
+    return True
+
+
+def _propagate(grid: list, used: list, geometry: tuple) -> bool:
+    """
+    Repeatedly fills naked singles (cells with one candidate) and hidden singles
+    (digits with one possible cell in a unit). Modifies the state in place.
+
+    Returns
+    -------
+        consistent (bool): False if a contradiction was reached
+    """
+
+    all_digits, units, cell_units = geometry
+
+    while True:
+        progress = False
+        cands = [0] * len(grid)
+
+        # naked singles
+        for cell in range(len(grid)):
+            if grid[cell]:
+                continue
+
+            r, c, b = cell_units[cell]
+            cand = all_digits & ~(used[r] | used[c] | used[b])
+            if not cand:
+                return False
+
+            if cand & (cand - 1) == 0:
+                _place(grid, used, geometry, cell, cand)
+                progress = True
+            else:
+                cands[cell] = cand
+
+        # candidates are stale once anything was placed
+        if progress:
+            continue
+
+        # hidden singles
+        for u, unit in enumerate(units):
+            once = twice = 0
+            for cell in unit:
+                twice |= once & cands[cell]
+                once |= cands[cell]
+
+            # a digit that is neither placed nor possible anywhere in the unit
+            if once | used[u] != all_digits:
+                return False
+
+            singles = once & ~twice
+            while singles:
+                bit = singles & -singles
+                singles ^= bit
+
+                cell = next(cell for cell in unit if cands[cell] & bit)
+                if grid[cell] == bit:
+                    continue
+                if grid[cell] or not _place(grid, used, geometry, cell, bit):
+                    return False
+                progress = True
+
+        if not progress:
+            return True
+
+
+class _Budget:
+    """
+    Search nodes and time a search may spend. The clock is only read every
+    few nodes to keep the overhead negligible.
+    """
+
+    def __init__(self, max_nodes: int | None = None, deadline: float | None = None):
+        self.max_nodes = max_nodes
+        self.deadline = deadline
+        self.nodes = 0
+        self.exhausted = False
+
+    def spend(self) -> bool:
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            self.exhausted = True
+        elif self.deadline is not None and self.nodes % 16 == 0:
+            self.exhausted = time.perf_counter() > self.deadline
+
+        return not self.exhausted
+
+
+def _search(
+    grid: list,
+    used: list,
+    geometry: tuple,
+    budget: _Budget | None = None,
+    rng: random.Random | None = None,
+):
+    """
+    Depth-first search over the cell with the fewest candidates, propagating
+    after every guess. Yields every solved grid reachable from the state,
+    until the budget, if any, runs out. Candidates are tried lowest first, or
+    in an order drawn from `rng` if given.
+    """
+
+    if budget is not None and not budget.spend():
+        return
+
+    if not _propagate(grid, used, geometry):
+        return
+
+    # minimum remaining values: the most constrained cell is branched on, and
+    # among those the one whose units hold the most digits, where a wrong
+    # guess is refuted soonest
+    all_digits, _, cell_units = geometry
+    filled = [mask.bit_count() for mask in used]
+    best_cell, best_cand, best_count, best_degree = None, 0, len(used), -1
+    for cell in range(len(grid)):
+        if grid[cell]:
+            continue
+
+        r, c, b = cell_units[cell]
+        cand = all_digits & ~(used[r] | used[c] | used[b])
+        count = cand.bit_count()
+        if count > best_count:
+            continue
+
+        degree = filled[r] + filled[c] + filled[b]
+        if count < best_count or degree > best_degree:
+            best_cell, best_cand, best_count, best_degree = cell, cand, count, degree
+
+    if best_cell is None:
+        yield grid
+        return
+
+    bits = []
+    while best_cand:
+        bit = best_cand & -best_cand
+        best_cand ^= bit
+        bits.append(bit)
+
+    if rng is not None:
+        rng.shuffle(bits)
+
+    for bit in bits:
+        branch_grid, branch_used = grid.copy(), used.copy()
+        _place(branch_grid, branch_used, geometry, best_cell, bit)
+        yield from _search(branch_grid, branch_used, geometry, budget, rng)
+
+
+def solve_batch(
+    puzzles: np.ndarray, time_budget: float | None = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Solves many puzzles at once. Constraint propagation runs on a candidate
+    tensor for the whole batch, and only the grids that propagation cannot
+    finish are handed to a per-grid BitmaskSolver.
+
+    Parameters
+    ----------
+        puzzles (np.ndarray): (N, S, S) array of starting values, 0 for empty
+            cells, S being the size of the grids
+        time_budget (float): seconds the search may take per grid left
+            unfinished by propagation, None for no limit
+
+    Returns
+    -------
+        solutions (np.ndarray): (N, S, S) array of solved grids, zeros where no
+            solution exists
+        status (np.ndarray): (N,) array of STATUS_* codes
+    """
+
+    puzzles = np.asarray(puzzles)
+    if puzzles.ndim != 3 or puzzles.shape[1] != puzzles.shape[2]:
+        raise ValueError("Puzzles must have shape (N, S, S)")
+
+    size = puzzles.shape[1]
+    all_digits = _geometry(size)[0]
+    dtype = "uint16" if size < 16 else "uint32"
+
+    # the digit axis of the (N, S, S, S) candidate tensor is packed into bits
+    # out of range values are left without candidates, making them infeasible
+    in_range = (puzzles > 0) & (puzzles <= size)
+    givens = np.where(in_range, np.left_shift(1, puzzles.clip(0, size)), 0)
+    candidates = np.where(puzzles == 0, all_digits, givens).astype(dtype)
+
+    # propagating until the candidates of every grid stop changing
+    active = np.arange(len(puzzles))
+    while len(active):
+        before = candidates[active]
+        after = _propagate_batch(before)
+        changed = (before != after).any(axis=(1, 2))
+        candidates[active] = after
+        active = active[changed]
+
+    # a cell without candidates or a digit fixed twice in a unit is infeasible
+    single = _is_single(candidates)
+    fixed = np.where(single, candidates, 0).astype(dtype)
+    duplicated = np.zeros(len(puzzles), dtype="bool")
+    for unit in _unit_views(fixed):
+        _, twice = _once_twice(unit)
+        duplicated |= (twice != 0).any(axis=1)
+    infeasible = (candidates == 0).any(axis=(1, 2)) | duplicated
+    solved = single.all(axis=(1, 2)) & ~infeasible
+
+    # the digit of a single candidate is the exponent of its bit
+    values = np.where(fixed != 0, np.frexp(fixed)[1] - 1, 0)
+    solutions = np.where(solved[:, None, None], values, 0)
+    status = np.where(solved, STATUS_SOLVED, STATUS_INFEASIBLE)
+
+    # falling back to search for the grids propagation could not finish
+    for idx in np.flatnonzero(~solved & ~infeasible):
+        solver = BitmaskSolver(values[idx])
+        solver.solve(time_budget)
+        solutions[idx] = solver.solution
+        status[idx] = solver.status
+
+    return solutions, status
+
+
+def _is_single(candidates: np.ndarray) -> np.ndarray:
+    """
+    Indicates which cells of a candidate tensor have exactly one candidate.
+    """
+
+    return (candidates != 0) & (candidates & (candidates - 1) == 0)
+
+
+def _box_view(grids: np.ndarray) -> np.ndarray:
+    """
+    Reshapes an (N, S, S) array to (N, bands, box rows, stacks, box columns)
+    so that axes 1 and 3 index the box and axes 2 and 4 the cell within it.
+    """
+
+    rows, cols = box_shape(grids.shape[-1])
+
+    return grids.reshape((len(grids), cols, rows, rows, cols))
+
+
+def _unit_views(grids: np.ndarray) -> list:
+    """
+    Rearranges an (N, S, S) array into rows, columns and boxes, each of shape
+    (N, S units, S cells).
+    """
+
+    boxes = _box_view(grids).transpose(0, 1, 3, 2, 4).reshape(grids.shape)
+
+    return [grids, grids.transpose(0, 2, 1), boxes]
+
+
+def _once_twice(units: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Accumulates the candidate bitmasks of every unit.
+
+    Returns
+    -------
+        once (np.ndarray): (N, S) digits possible in at least one cell
+        twice (np.ndarray): (N, S) digits possible in at least two cells
+    """
+
+    once = np.zeros(units.shape[:2], dtype=units.dtype)
+    twice = once.copy()
+    for cell in range(units.shape[2]):
+        twice |= once & units[:, :, cell]
+        once |= units[:, :, cell]
+
+    return once, twice
+
+
+def _to_cells(rows: np.ndarray, cols: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    Combines per-unit (N, S) bitmasks into an (N, S, S) array holding, for
+    every cell, the union of the bitmasks of its row, column and box.
+    """
+
+    box_rows, box_cols = box_shape(rows.shape[1])
+    cells = rows[:, :, None] | cols[:, None, :]
+    _box_view(cells)[...] |= boxes.reshape((len(rows), box_cols, 1, box_rows, 1))
+
+    return cells
+
+
+def _propagate_batch(candidates: np.ndarray) -> np.ndarray:
+    """
+    Performs one round of vectorized elimination on an (N, S, S) tensor of
+    candidate bitmasks: digits of solved cells are removed from their peers,
+    and digits with a single possible cell in a row, column or box are fixed
+    there.
+    """
+
+    # digits already fixed in the row, column and box of every cell
+    single = _is_single(candidates)
+    fixed = np.where(single, candidates, 0).astype(candidates.dtype)
+    seen = _to_cells(*[np.bitwise_or.reduce(u, axis=2) for u in _unit_views(fixed)])
+    candidates = np.where(single, candidates, candidates & ~seen)
+
+    # digits that can only go in one cell of a unit
+    unique = [
+        once & ~twice for once, twice in map(_once_twice, _unit_views(candidates))
+    ]
+    hidden = candidates & _to_cells(*unique)
+
+    return np.where(hidden != 0, hidden, candidates).astype(candidates.dtype)
+
+
+@dataclass(frozen=True)
+class Transform:
+    """
+    Sudoku symmetry mapping a grid to its canonical form: an optional
+    transposition, then a permutation of the rows and columns, then a
+    relabeling of the digits.
+
+    Parameters
+    ----------
+        transpose (bool): whether the grid is transposed first
+        rows (np.ndarray): row of the grid each canonical row is taken from
+        cols (np.ndarray): column of the grid each canonical column is taken
+            from
+        digits (np.ndarray): canonical label of every digit, 0 maps to 0
+    """
+
+    transpose: bool
+    rows: np.ndarray
+    cols: np.ndarray
+    digits: np.ndarray
+
+    def apply(self, grid: np.ndarray) -> np.ndarray:
+        grid = np.asarray(grid)
+        if self.transpose:
+            grid = grid.T
+
+        return self.digits[grid[np.ix_(self.rows, self.cols)]]
+
+    def invert(self, grid: np.ndarray) -> np.ndarray:
+        original = np.empty(np.shape(grid), dtype="int")
+        original[np.ix_(self.rows, self.cols)] = np.argsort(self.digits)[grid]
+
+        return original.T if self.transpose else original
+
+
+def canonical_form(
+    puzzle: np.ndarray, max_orders: int = 4
+) -> Tuple[np.ndarray, Transform]:
+    """
+    Maps a puzzle to a canonical representative of all the puzzles it is
+    equivalent to under digit relabeling, row and column permutations within
+    bands and stacks, band and stack permutations and transposition, so
+    equivalent puzzles can share a solution.
+
+    Bands, then rows within bands, are sorted by invariants of their givens:
+    how many there are, how full their columns are and how frequent their
+    digits are. Only lines these invariants cannot tell apart are permuted,
+    and digits are relabeled in order of first appearance. Of the resulting
+    grids, in both orientations if boxes are square, the lexicographically
+    smallest is canonical.
+    For very symmetric puzzles the ties are cut off after `max_orders` line
+    orders per axis, so some equivalent puzzles may map to different forms.
+    The transform is always exact.
+
+    Parameters
+    ----------
+        puzzle (np.ndarray): NxN matrix of starting values, 0 for empty cells
+        max_orders (int): most row orders and column orders tried per
+            orientation
+
+    Returns
+    -------
+        canonical (np.ndarray): NxN canonical puzzle
+        transform (Transform): maps the puzzle and its solutions to the
+            canonical form and back
+    """
+
+    puzzle = np.asarray(puzzle).astype("int")
+    size = len(puzzle)
+    box_rows, box_cols = box_shape(size)
+    frequency = np.bincount(puzzle.ravel(), minlength=size + 1)
+    frequency[0] = 0
+
+    # transposed candidates are the transposes of the others
+    rows = np.array(_line_orders(puzzle, frequency, max_orders, box_rows))
+    cols = np.array(_line_orders(puzzle.T, frequency, max_orders, box_cols))
+    grids = puzzle[rows[:, None, :, None], cols[None, :, None, :]]
+    grids = grids.reshape((-1, size, size))
+    if box_rows == box_cols:
+        grids = np.concatenate([grids, grids.transpose((0, 2, 1))])
+    grids = grids.reshape((len(grids), -1))
+
+    # digits are labeled by first appearance, absent ones after the rest
+    present = grids[:, :, None] == np.arange(1, size + 1)
+    absent = size**2 + np.arange(size)
+    first = np.where(present.any(axis=1), present.argmax(axis=1), absent)
+    labels = np.zeros((len(grids), size + 1), dtype="int")
+    labels[:, 1:] = first.argsort(axis=1).argsort(axis=1) + 1
+    grids = np.take_along_axis(labels, grids, axis=1).astype("uint8")
+
+    best = min(range(len(grids)), key=lambda k: grids[k].tobytes())
+    transpose = best >= len(rows) * len(cols)
+    r, c = divmod(best % (len(rows) * len(cols)), len(cols))
+    order = (cols[c], rows[r]) if transpose else (rows[r], cols[c])
+    transform = Transform(bool(transpose), *order, labels[best])
+
+    return grids[best].reshape((size, size)).astype("int"), transform
+
+
+def _line_orders(
+    grid: np.ndarray, frequency: np.ndarray, max_orders: int, band: int = 3
+) -> list:
+    """
+    Row orders of a grid sorted by invariants of the rows and their bands,
+    with every permutation of rows or bands that tie.
+    """
+
+    # per row: its number of givens, then the sorted fullness of their
+    # columns and the sorted frequency of their digits, as comparable bytes
+    filled = grid > 0
+    fullness = np.where(filled, filled.sum(axis=0), 0)
+    features = np.concatenate(
+        [filled.sum(axis=1, keepdims=True), fullness, frequency[grid]], axis=1
+    )
+    features[:, 1 : len(grid) + 1].sort(axis=1)
+    features[:, len(grid) + 1 :].sort(axis=1)
+    keys = [row.tobytes() for row in features.astype("uint8")]
+
+    def tied_orders(items, key):
+        # sorting, then permuting every run of equal keys
+        items = sorted(items, key=key)
+        runs = [list(g) for _, g in itertools.groupby(items, key=key)]
+        for order in itertools.product(*map(itertools.permutations, runs)):
+            yield [item for run in order for item in run]
+
+    bands = [tuple(range(start, start + band)) for start in range(0, len(grid), band)]
+    band_orders = tied_orders(bands, lambda band: sorted(keys[r] for r in band))
+    row_orders = (
+        itertools.product(*(tied_orders(band, keys.__getitem__) for band in order))
+        for order in band_orders
+    )
+    orders = itertools.chain.from_iterable(row_orders)
+
+    return [sum(map(list, order), []) for order in itertools.islice(orders, max_orders)]
+
+
+def repair(
+    puzzle: np.ndarray,
+    probabilities: np.ndarray,
+    max_changes: int = 3,
+    max_alternatives: int = 24,
+    time_budget: float = 0.05,
+    smoothing: float = 0.05,
+    unique: bool = True,
+) -> Tuple[np.ndarray, np.ndarray, int, list]:
+    """
+    Looks for the most probable consistent reading of an infeasible puzzle.
+    Every cell can be read as any of its other classes at a cost of the drop
+    in log-probability. Sets of at most `max_changes` of the cheapest
+    alternatives are tried in order of increasing total cost, and the first
+    set that makes the puzzle solvable wins.
+
+    The search stops once `time_budget` is spent, so the worst case only
+    depends on the budget. Each attempt is checked with the bitmask engine.
+
+    Parameters
+    ----------
+        puzzle (np.ndarray): NxN matrix of recognized digits, 0 for blanks
+        probabilities (np.ndarray): (N*N, classes) class probabilities of the
+            cells, class 0 being a blank, classes past N are never read
+        max_changes (int): most cells read differently
+        max_alternatives (int): cheapest alternative readings considered
+        time_budget (float): seconds the search may take
+        smoothing (float): share of each cell's probability spread evenly
+            over its classes, so readings the model rules out entirely still
+            have a finite cost
+        unique (bool): whether a repair must have a single solution, readings
+            leaving the puzzle ambiguous being skipped
+
+    Returns
+    -------
+        puzzle (np.ndarray): repaired puzzle, the given one if no repair was
+            found
+        solution (np.ndarray): NxN matrix of the solved puzzle, zeros if no
+            repair was found
+        status (int): STATUS_SOLVED or STATUS_INFEASIBLE
+        corrections (list): (row, col, read, digit) of every changed cell
+    """
+
+    deadline = time.perf_counter() + time_budget
+    shape = np.shape(puzzle)
+    flat = np.asarray(puzzle).astype("int").flatten()
+    cells, classes = len(flat), shape[0] + 1
+
+    # cost of reading each cell as each class instead of what was read
+    probabilities = np.asarray(probabilities, dtype="float64").reshape((cells, -1))
+    probabilities = probabilities[:, :classes]
+    logp = np.log((1 - smoothing) * probabilities + smoothing / classes)
+    cost = logp[np.arange(cells), flat][:, None] - logp
+    cost[np.arange(cells), flat] = np.inf
+
+    cheapest = np.argsort(cost, axis=None)[:max_alternatives]
+    alternatives = [
+        (float(cost.flat[i]), *divmod(int(i), classes))
+        for i in cheapest
+        if np.isfinite(cost.flat[i])
+    ]
+
+    # best-first over increasing index tuples: a tuple is followed by itself
+    # with the last index moved on and with the next index appended, which
+    # visits every set once, cheapest first as the costs are sorted
+    queue = [(alternatives[0][0], (0,))] if alternatives else []
+    while queue and time.perf_counter() < deadline:
+        total, combo = heapq.heappop(queue)
+        last = combo[-1]
+        if last + 1 < len(alternatives):
+            step = alternatives[last + 1][0]
+            moved = combo[:-1] + (last + 1,)
+            heapq.heappush(queue, (total - alternatives[last][0] + step, moved))
+            if len(combo) < max_changes:
+                heapq.heappush(queue, (total + step, combo + (last + 1,)))
+
+        changes = [alternatives[i][1:] for i in combo]
+        if len({cell for cell, _ in changes}) < len(changes):
+            continue
+
+        attempt = flat.copy()
+        for cell, digit in changes:
+            attempt[cell] = digit
+
+        # a search cut short can't tell a unique solution from the first one
+        state = _initial_state(attempt.reshape(shape))
+        budget = _Budget(None, deadline)
+        solutions = [] if state is None else _search(*state, budget)
+        grids = list(itertools.islice(solutions, 2 if unique else 1))
+        if len(grids) == 1 and not (unique and budget.exhausted):
+            grid = grids[0]
+            solution = np.array([bit.bit_length() - 1 for bit in grid])
+            corrections = [
+                (*divmod(cell, shape[0]), int(flat[cell]), digit)
+                for cell, digit in sorted(changes)
+            ]
+            return (
+                attempt.reshape(shape),
+                solution.reshape(shape),
+                STATUS_SOLVED,
+                corrections,
+            )
+
+    return flat.reshape(shape), np.zeros(shape, dtype="int"), STATUS_INFEASIBLE, []
+
+
+# engines selectable by name
+SOLVERS = {"bitmask": BitmaskSolver, "cbc": SudokuSolver}
+
+
+def get_solver(name: str) -> type:
+    """
+    Looks up a solver engine by name.
+
+    Parameters
+    ----------
+        name (str): one of the keys of SOLVERS
+
+    Returns
+    -------
+        solver (type): solver class, instantiated with a puzzle
+    """
+
+    if name not in SOLVERS:
+        raise ValueError(f"Solver must be one of {', '.join(SOLVERS)}")
 
-        # constraint that we cannot change the starting values
-        for r in self.rows:
-            for c in self.cols:
-                if self.puzzle[r - 1, c - 1] != 0:
-                    self.problem += self.variables[r][c][self.puzzle[r - 1, c - 1]] == 1
-
-    def solve(self):
-        # solving
-        self.problem.solve(pulp.PULP_CBC_CMD(msg=0))
-
-        # solution attribute is 9x9 matrix representing sudoku grid
-        self.solution = np.zeros((9, 9), dtype="int")
-
-        # populating solution matrix
-        for r in self.rows:
-            for c in self.cols:
-                for v in self.vals:
-                    vars_val = pulp.value(self.variables[r][c][v])
-                    if vars_val == 1:
-                        self.solution[r - 1, c - 1] = v
+    return SOLVERS[name]
@@ -0,0 +1,389 @@
+import asyncio
+import contextlib
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import models.solver
+import pipeline.batch
+import pipeline.batching
+import pipeline.cache
+import pipeline.core
+import pipeline.profiling
+
+
+class _Stage:
+    """
+    Bounds how many images are in a stage at once, running or queued for its
+    executor. Images beyond the limit wait for a slot, which holds them back
+    in the previous stage and eventually in the caller.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.waiting = 0
+        self.active = 0
+        self.done = 0
+        self._slots = asyncio.Semaphore(limit)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.done += 1
+            self._slots.release()
+
+    def metrics(self) -> dict:
+        return {
+            "limit": self.limit,
+            "waiting": self.waiting,
+            "active": self.active,
+            "done": self.done,
+        }
+
+
+def _init_thread():
+    # one OpenCV thread per worker, parallelism comes from the pool
+    cv2.setNumThreads(1)
+
+
+def _decode_detect(data: bytes, **kwargs) -> pipeline.core.GridResult:
+    """
+    Decodes an image and runs pipeline.batch.detect_image on it, in a worker
+    thread. OpenCV releases the GIL while it works.
+
+    Raises
+    ------
+        ValueError: if the bytes can't be decoded
+    """
+
+    profiler = pipeline.profiling.Profiler()
+    with profiler.stage("read"):
+        image = pipeline.core.decode_image(data)
+
+    if image is None:
+        raise ValueError("could not decode image")
+
+    return pipeline.batch.detect_image(image, profiler, **kwargs)
+
+
+def _lookup_image(cache: pipeline.cache.ResultCache, data: bytes) -> tuple:
+    """
+    Hashes an image and looks it up in the images level of the cache, in a
+    worker thread, as either can block on a large image or a shared SQLite
+    file.
+
+    Returns
+    -------
+        key (str): key of the image, see pipeline.cache.image_key
+        record (dict): cached result of the image, None on a miss
+    """
+
+    key = pipeline.cache.image_key(data)
+
+    return key, cache.get("images", key)
+
+
+def _lookup_solution(cache: pipeline.cache.ResultCache, puzzle: np.ndarray) -> tuple:
+    """
+    Canonicalizes a recognized grid and looks its solution up in the grids
+    level of the cache, in a worker thread.
+
+    Returns
+    -------
+        key (str): canonical key of the grid, see pipeline.cache.grid_key
+        transform (Transform): transform of the grid to its canonical form
+        cached (tuple): solution and status, None on a miss
+    """
+
+    key, transform = pipeline.cache.grid_key(puzzle)
+    solution, status = cache.get_solution(key, transform)
+
+    return key, transform, None if solution is None else (solution, status)
+
+
+def _solve(
+    result: pipeline.core.GridResult,
+    solver: str,
+    cached: tuple | None,
+    solve_budget: float,
+    max_corrections: int,
+    repair_budget: float,
+    uniqueness_nodes: int,
+    uniqueness_budget: float,
+) -> tuple:
+    """
+    Solves a recognized grid, repairing it if it's infeasible and checking
+    that its solution is unique otherwise. Runs in a worker process, on a
+    result holding no images.
+
+    Returns
+    -------
+        result (GridResult): the result, solved, with its own profile
+        solved (tuple): solution and status straight from the solver, for
+            the cache, None if they came from it or the solver gave up
+    """
+
+    if cached is None:
+        with result.profile.stage("solve"):
+            solved = pipeline.core.solve_puzzle(
+                result.puzzle, solver, time_budget=solve_budget
+            )
+        result.solution, result.status = solved
+        if result.status == models.solver.STATUS_TIMEOUT:
+            solved = None
+    else:
+        solved = None
+        result.solution, result.status = cached
+
+    if result.status == models.solver.STATUS_INFEASIBLE:
+        pipeline.core.repair_puzzle(result, max_corrections, repair_budget)
+    elif result.solved:
+        pipeline.core.check_uniqueness(result, uniqueness_nodes, uniqueness_budget)
+
+    return result, solved
+
+
+class AsyncPipeline:
+    """
+    Runs the pipeline on many images at once from asyncio code, overlapping
+    their stages: while one image is classified, others are decoded and
+    searched and others solved.
+
+    Decoding, grid detection and cropping run on a pool of threads (OpenCV
+    releases the GIL), the cells of concurrent images are classified together
+    by a BatchingPredictor, and puzzles are solved, repaired and checked for
+    uniqueness in a pool of processes. Each stage admits a bounded number of
+    images, running or queued, and images beyond that wait for a slot, so a
+    slow stage holds the earlier ones back instead of piling up work. At
+    most `max_in_flight` images are processed at once, later calls to
+    solve_image wait their turn. Cache lookups and stores run on the threads
+    as well, as they may wait on a SQLite file shared with other processes.
+
+    Parameters
+    ----------
+        model: digit classifier with a Keras-like predict method
+        solver (str): name of the solving engine, see models.solver.SOLVERS
+        detect_workers (int): threads decoding and searching images,
+            defaults to the CPU count
+        detect_queue (int): images waiting for a detection thread
+        max_batch_size (int): maximum number of cells per predict call
+        max_wait (float): seconds an image waits for others to join its batch
+        ocr_queue (int): images waiting for classification
+        solve_processes (int): processes solving puzzles, 0 to solve them in
+            the detection threads
+        solve_queue (int): puzzles waiting for a solving process
+        max_in_flight (int): images processed at once, defaults to the sum
+            of the stage limits
+        max_candidates (int): most grid candidates warped per image
+        cell_mode (str): how cells are located, see pipeline.core.CELL_MODES
+        blank_threshold (float): most ink of a cell skipping the model
+        cache (ResultCache): cache of results by image and solutions by grid
+        solve_budget (float): seconds the solver may spend per puzzle
+        max_corrections (int): most misread cells corrected per puzzle
+        repair_budget (float): seconds spent looking for corrections
+        uniqueness_nodes (int): most search nodes visited looking for a
+            second solution
+        uniqueness_budget (float): seconds spent looking for a second solution
+        size (int): number of cells per side of the grids searched for
+    """
+
+    def __init__(
+        self,
+        model,
+        solver: str = "bitmask",
+        detect_workers: int | None = None,
+        detect_queue: int = 8,
+        max_batch_size: int = 512,
+        max_wait: float = 0.005,
+        ocr_queue: int = 64,
+        solve_processes: int = 1,
+        solve_queue: int = 16,
+        max_in_flight: int | None = None,
+        max_candidates: int = pipeline.core.MAX_CANDIDATES,
+        cell_mode: str = "contours",
+        blank_threshold: float = pipeline.core.BLANK_THRESHOLD,
+        cache: pipeline.cache.ResultCache | None = None,
+        solve_budget: float = pipeline.core.SOLVE_BUDGET,
+        max_corrections: int = pipeline.core.MAX_CORRECTIONS,
+        repair_budget: float = pipeline.core.REPAIR_BUDGET,
+        uniqueness_nodes: int = pipeline.core.UNIQUENESS_NODES,
+        uniqueness_budget: float = pipeline.core.UNIQUENESS_BUDGET,
+        size: int = pipeline.core.GRID_SIZE,
+    ):
+        detect_workers = detect_workers or os.cpu_count()
+
+        self.solver = solver
+        self.cache = cache
+        self.detect_options = {
+            "max_candidates": max_candidates,
+            "cell_mode": cell_mode,
+            "blank_threshold": blank_threshold,
+            "size": size,
+        }
+        self.solve_options = {
+            "solve_budget": solve_budget,
+            "max_corrections": max_corrections,
+            "repair_budget": repair_budget,
+            "uniqueness_nodes": uniqueness_nodes,
+            "uniqueness_budget": uniqueness_budget,
+        }
+
+        self.stages = {
+            "detect": _Stage(detect_workers + detect_queue),
+            "ocr": _Stage(ocr_queue),
+            "solve": _Stage(max(solve_processes, 1) + solve_queue),
+        }
+        limit = max_in_flight or sum(s.limit for s in self.stages.values())
+        self._admission = _Stage(limit)
+
+        self._threads = ThreadPoolExecutor(detect_workers, initializer=_init_thread)
+        # no more requests than the stage admits can reach the predictor, so
+        # submitting never blocks the event loop
+        self.model = pipeline.batching.BatchingPredictor(
+            model, max_batch_size, max_wait, max_queue=ocr_queue
+        )
+
+        # spawned, so workers don't inherit the model or the threads
+        self._processes = None
+        if solve_processes > 0:
+            self._processes = ProcessPoolExecutor(
+                solve_processes, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    async def solve_image(self, data: bytes) -> pipeline.core.GridResult:
+        """
+        Recognizes and solves the grid in an encoded image.
+
+        Parameters
+        ----------
+            data (bytes): encoded image, e.g. the contents of a JPEG file
+
+        Returns
+        -------
+            result (GridResult): outcome of every stage that was reached,
+                without images
+
+        Raises
+        ------
+            ValueError: if the image can't be decoded
+        """
+
+        # the cache is only touched from the threads, where waiting on a
+        # query or commit doesn't hold up the event loop
+        loop = asyncio.get_running_loop()
+        async with self._admission.slot():
+            key = None
+            if self.cache is not None:
+                key, record = await loop.run_in_executor(
+                    self._threads, _lookup_image, self.cache, data
+                )
+                if record is not None:
+                    return pipeline.core.GridResult.from_dict(record)
+
+            async with self.stages["detect"].slot():
+                result = await loop.run_in_executor(
+                    self._threads,
+                    lambda: _decode_detect(data, **self.detect_options),
+                )
+
+            if result.found:
+                async with self.stages["ocr"].slot():
+                    await self._read(result)
+
+                async with self.stages["solve"].slot():
+                    await self._solve(result, loop)
+
+            result.digits = result.blanks = None
+            result.probabilities = result.ink = None
+
+            if key is not None:
+                await loop.run_in_executor(
+                    self._threads, self.cache.put, "images", key, result.to_dict()
+                )
+
+        pipeline.profiling.emit(result.profile)
+
+        return result
+
+    async def _read(self, result: pipeline.core.GridResult):
+        # blank cells never reach the model, see pipeline.core.screen_blanks
+        size = result.size
+        probabilities = np.zeros((size * size, size + 1), dtype="float32")
+        probabilities[result.blanks, 0] = 1.0
+
+        if len(result.digits):
+            start = time.perf_counter()
+            predicted = await asyncio.wrap_future(self.model.submit(result.digits))
+            result.profile.add("predict", time.perf_counter() - start)
+            probabilities[~result.blanks] = pipeline.core.read_classes(predicted, size)
+
+        result.probabilities = probabilities
+        result.puzzle = probabilities.argmax(axis=1).reshape((size, size))
+
+    async def _solve(self, result: pipeline.core.GridResult, loop):
+        cached = key = None
+        if self.cache is not None:
+            key, transform, cached = await loop.run_in_executor(
+                self._threads, _lookup_solution, self.cache, result.puzzle
+            )
+
+        # only what solving needs is sent to the process
+        light = pipeline.core.GridResult(
+            image=None,
+            size=result.size,
+            puzzle=result.puzzle,
+            probabilities=result.probabilities,
+            ink=result.ink,
+        )
+        solve = functools.partial(
+            _solve, light, self.solver, cached, **self.solve_options
+        )
+        executor = self._threads if self._processes is None else self._processes
+        solved, raw = await loop.run_in_executor(executor, solve)
+
+        if raw is not None and self.cache is not None:
+            await loop.run_in_executor(
+                self._threads, self.cache.put_solution, key, transform, *raw
+            )
+
+        result.puzzle, result.solution = solved.puzzle, solved.solution
+        result.status, result.unique = solved.status, solved.unique
+        result.corrections = solved.corrections
+        result.profile.merge(solved.profile)
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": self._admission.metrics(),
+            "stages": {name: stage.metrics() for name, stage in self.stages.items()},
+            "ocr_batching": self.model.metrics(),
+            "cache": {} if self.cache is None else self.cache.metrics(),
+        }
+
+    def close(self):
+        self._threads.shutdown(wait=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
+        self.model.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    async def __aenter__(self) -> "AsyncPipeline":
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
@@ -0,0 +1,447 @@
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from typing import Iterable, Iterator
+
+import cv2
+import numpy as np
+
+import models.solver
+import pipeline.cache
+import pipeline.core
+import pipeline.profiling
+
+# file extensions picked up when a directory is given
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+# status of images whose worker failed, beyond the solver's own codes
+STATUS_ERROR = -5
+
+
+def expand_inputs(sources: Iterable[str]) -> Iterator[str]:
+    """
+    Lazily turns directories, glob patterns, image files and text files listing
+    one image path per line into image paths.
+
+    Parameters
+    ----------
+        sources (Iterable[str]): inputs given on the command line
+
+    Returns
+    -------
+        paths (Iterator[str]): image paths, in the order they were given
+    """
+
+    for source in sources:
+        if os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(source, name)
+        elif source.endswith(".txt"):
+            with open(source) as f:
+                yield from (line.strip() for line in f if line.strip())
+        elif glob.has_magic(source):
+            yield from sorted(glob.glob(source, recursive=True))
+        else:
+            yield source
+
+
+def detect_image(
+    image: np.ndarray | None,
+    profiler: pipeline.profiling.Profiler,
+    max_candidates: int = pipeline.core.MAX_CANDIDATES,
+    cell_mode: str = "contours",
+    blank_threshold: float = pipeline.core.BLANK_THRESHOLD,
+    size: int = pipeline.core.GRID_SIZE,
+    path: str | None = None,
+) -> pipeline.core.GridResult:
+    """
+    Runs every stage up to digit classification on a decoded image, leaving
+    out the model so that cells of several images can be classified together.
+    The images are dropped from the result and only the cells are kept, so
+    it's cheap to send to another process.
+
+    Parameters
+    ----------
+        image (np.ndarray): original BGR image, None if it couldn't be read
+        profiler (Profiler): profile of the image, e.g. with the time it took
+            to read it
+        max_candidates (int): most grid candidates to warp
+        cell_mode (str): how cells are located, see pipeline.core.CELL_MODES
+        blank_threshold (float): most ink of a cell skipping the model, see
+            pipeline.core.screen_blanks
+        size (int): number of cells per side of the grid searched for
+        path (str): file the image was read from, if any
+
+    Returns
+    -------
+        result (GridResult): result with the mask of empty cells in `blanks`
+            and the other cells in `digits`, if a grid was found
+    """
+
+    if image is None:
+        result = pipeline.core.GridResult(
+            image=None, size=size, path=path, profile=profiler
+        )
+    else:
+        resized, scale, thresh = pipeline.core.preprocess(image, profiler)
+        result = pipeline.core.GridResult(
+            image=resized,
+            source=image,
+            scale=scale,
+            size=size,
+            path=path,
+            profile=profiler,
+        )
+        pipeline.core.find_grid(resized, thresh, result, max_candidates, cell_mode)
+
+    if result.found:
+        digits = pipeline.core.extract_digits(result)
+        blanks = pipeline.core.screen_blanks(result, digits, blank_threshold)
+
+        # only the cells left for the model are sent back
+        result.digits = digits[~blanks]
+
+    result.image = result.source = result.roi = result.roi_thresh = None
+    result.cell_contours = []
+
+    return result
+
+
+def detect(
+    path: str,
+    max_candidates: int = pipeline.core.MAX_CANDIDATES,
+    cell_mode: str = "contours",
+    blank_threshold: float = pipeline.core.BLANK_THRESHOLD,
+    size: int = pipeline.core.GRID_SIZE,
+) -> pipeline.core.GridResult:
+    """
+    Reads an image file and runs detect_image on it. Meant for worker
+    processes.
+
+    Parameters
+    ----------
+        path (str): path of the image
+        (the other parameters are those of detect_image)
+    """
+
+    profiler = pipeline.profiling.Profiler()
+    with profiler.stage("read"):
+        image = cv2.imread(path)
+
+    return detect_image(
+        image,
+        profiler,
+        max_candidates=max_candidates,
+        cell_mode=cell_mode,
+        blank_threshold=blank_threshold,
+        size=size,
+        path=path,
+    )
+
+
+def _init_worker():
+    # one thread per process, parallelism comes from the pool
+    cv2.setNumThreads(1)
+
+
+class _Ready:
+    # stands in for the AsyncResult of an image that needs no worker
+    def __init__(self, result: pipeline.core.GridResult):
+        self.result = result
+
+    def get(self) -> pipeline.core.GridResult:
+        return self.result
+
+
+class BatchRunner:
+    """
+    Streams image files through a pool of worker processes that preprocess,
+    detect and crop the grids. Cells of several images are classified with
+    one model call and solved in the main process, where the model lives.
+
+    The pool is started on creation, before the model is loaded, so workers
+    never inherit the model. At most `max_in_flight` images are queued or
+    being processed, which bounds memory regardless of the number of inputs.
+    The profile of every image is handed to the pipeline.profiling hooks.
+
+    With a cache, images are hashed in the main process first and those
+    already seen are answered from the cache without reaching a worker.
+    Solutions of recognized grids are looked up before solving.
+
+    Parameters
+    ----------
+        processes (int): number of worker processes, defaults to the CPU count
+        max_in_flight (int): images submitted but not yet written out
+        ocr_batch_size (int): images whose cells share a model call
+        max_candidates (int): most grid candidates warped per image
+        cell_mode (str): how cells are located, see pipeline.core.CELL_MODES
+        blank_threshold (float): most ink of a cell skipping the model
+        cache (ResultCache): cache of results by image and solutions by grid
+        solve_budget (float): seconds the solver may spend per puzzle
+        max_corrections (int): most misread cells corrected per puzzle
+        repair_budget (float): seconds spent looking for corrections per puzzle
+        uniqueness_nodes (int): most search nodes visited looking for a
+            second solution per puzzle
+        uniqueness_budget (float): seconds spent looking for a second
+            solution per puzzle
+        size (int): number of cells per side of the grids searched for
+    """
+
+    def __init__(
+        self,
+        processes: int | None = None,
+        max_in_flight: int | None = None,
+        ocr_batch_size: int = 16,
+        max_candidates: int = pipeline.core.MAX_CANDIDATES,
+        cell_mode: str = "contours",
+        blank_threshold: float = pipeline.core.BLANK_THRESHOLD,
+        cache: pipeline.cache.ResultCache | None = None,
+        solve_budget: float = pipeline.core.SOLVE_BUDGET,
+        max_corrections: int = pipeline.core.MAX_CORRECTIONS,
+        repair_budget: float = pipeline.core.REPAIR_BUDGET,
+        uniqueness_nodes: int = pipeline.core.UNIQUENESS_NODES,
+        uniqueness_budget: float = pipeline.core.UNIQUENESS_BUDGET,
+        size: int = pipeline.core.GRID_SIZE,
+    ):
+        self.processes = processes or os.cpu_count()
+        self.max_in_flight = max_in_flight or 4 * self.processes
+        self.ocr_batch_size = ocr_batch_size
+        self.max_candidates = max_candidates
+        self.cell_mode = cell_mode
+        self.blank_threshold = blank_threshold
+        self.cache = cache
+        self.solve_budget = solve_budget
+        self.max_corrections = max_corrections
+        self.repair_budget = repair_budget
+        self.uniqueness_nodes = uniqueness_nodes
+        self.uniqueness_budget = uniqueness_budget
+        self.size = size
+        self.pool = multiprocessing.Pool(self.processes, initializer=_init_worker)
+
+    def run(self, paths: Iterable[str], model, writer, solver: str = "bitmask") -> int:
+        """
+        Processes every image and writes one record per image as soon as its
+        batch is done, in input order. Images whose worker raised are
+        reported on stderr and written with status STATUS_ERROR.
+
+        Parameters
+        ----------
+            paths (Iterable[str]): image paths, consumed lazily
+            model: digit classifier with a Keras-like predict method
+            writer (ResultWriter): destination of the records
+            solver (str): name of the solving engine, see models.solver.SOLVERS
+
+        Returns
+        -------
+            count (int): number of images processed
+        """
+
+        paths = iter(paths)
+        pending = deque()
+        ready = []
+        count = 0
+
+        while True:
+            # keeping the pool busy without reading ahead of the bound
+            while len(pending) + len(ready) < self.max_in_flight:
+                path = next(paths, None)
+                if path is None:
+                    break
+                pending.append((path, *self._submit(path)))
+
+            if not pending:
+                break
+
+            path, key, handle = pending.popleft()
+            try:
+                result = handle.get()
+            except Exception as e:
+                # one failing image doesn't take the rest of the run down
+                print(f"{path}: {e!r}", file=sys.stderr)
+                key = None
+                result = pipeline.core.GridResult(
+                    image=None, size=self.size, path=path, status=STATUS_ERROR
+                )
+            ready.append((key, result))
+            if len(ready) >= self.ocr_batch_size or not pending:
+                results = self._finish([r for _, r in ready], model, solver)
+                for (key, _), result in zip(ready, results):
+                    if key is not None:
+                        self.cache.put("images", key, result.to_dict())
+                    writer.write(result)
+                count += len(ready)
+                ready = []
+
+        return count
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _submit(self, path: str) -> tuple:
+        """
+        Answers an image from the cache or hands it to a worker.
+
+        Returns
+        -------
+            key (str): image key to store the result under, None if there is
+                no cache, the image was cached or couldn't be read
+            handle: AsyncResult-like object to get the result from
+        """
+
+        key = None
+        if self.cache is not None:
+            try:
+                with open(path, "rb") as f:
+                    key = pipeline.cache.image_key(f.read())
+            except OSError:
+                pass
+
+        if key is not None:
+            record = self.cache.get("images", key)
+            if record is not None:
+                result = pipeline.core.GridResult.from_dict(record)
+                result.path = path
+                return None, _Ready(result)
+
+        options = {
+            "max_candidates": self.max_candidates,
+            "cell_mode": self.cell_mode,
+            "blank_threshold": self.blank_threshold,
+            "size": self.size,
+        }
+
+        return key, self.pool.apply_async(detect, (path,), options)
+
+    def _finish(self, results: list, model, solver: str) -> list:
+        """
+        Classifies the cells of every found grid in one call, except those
+        found empty already, then solves, repairing infeasible puzzles and
+        checking that solutions are unique. Cached results are passed through.
+        """
+
+        found = [r for r in results if r.found and r.digits is not None]
+        if not found:
+            for result in results:
+                pipeline.profiling.emit(result.profile)
+            return results
+
+        start = time.perf_counter()
+        size = self.size
+        probabilities = np.zeros((len(found), size * size, size + 1), dtype="float32")
+        pending = ~np.stack([r.blanks for r in found])
+        probabilities[~pending, 0] = 1.0
+        if pending.any():
+            cells = np.concatenate([r.digits for r in found])
+            predicted = model.predict(cells)
+            probabilities[pending] = pipeline.core.read_classes(predicted, size)
+        puzzles = probabilities.argmax(axis=2).reshape((len(found), size, size))
+        ocr_time = (time.perf_counter() - start) / len(found)
+
+        start = time.perf_counter()
+        solutions, status = pipeline.core.solve_puzzles(
+            puzzles, solver, self.cache, self.solve_budget
+        )
+        solve_time = (time.perf_counter() - start) / len(found)
+
+        # shared model and solver time is split evenly between the images
+        for result, puzzle, solution, code in zip(found, puzzles, solutions, status):
+            result.puzzle, result.solution, result.status = puzzle, solution, code
+            result.profile.add("predict", ocr_time)
+            result.profile.add("solve", solve_time)
+            result.digits = result.blanks = None
+
+        for result, cells in zip(found, probabilities):
+            if result.status == models.solver.STATUS_INFEASIBLE:
+                result.probabilities = cells
+                pipeline.core.repair_puzzle(
+                    result, self.max_corrections, self.repair_budget
+                )
+            elif result.solved:
+                pipeline.core.check_uniqueness(
+                    result, self.uniqueness_nodes, self.uniqueness_budget
+                )
+            result.probabilities = result.ink = None
+
+        for result in results:
+            pipeline.profiling.emit(result.profile)
+
+        return results
+
+
+def _record(result: pipeline.core.GridResult) -> dict:
+    """
+    Flattens a result into an output record with grids as strings of one
+    symbol per cell (see models.solver.grid_string), timings in milliseconds
+    and the candidate counters.
+    """
+
+    def as_string(grid):
+        return "" if grid is None else models.solver.grid_string(grid)
+
+    record = {
+        "image": result.path,
+        "found": result.found,
+        "status": int(result.status),
+        "unique": result.unique,
+        "grid": as_string(result.puzzle),
+        "solution": as_string(result.solution if result.solved else None),
+        "corrections": " ".join(
+            f"r{row + 1}c{col + 1}:{read}>{digit}"
+            for row, col, read, digit in result.corrections
+        ),
+    }
+    timings = result.profile.timings
+    for stage in pipeline.profiling.STAGES:
+        record[stage + "_ms"] = round(timings.get(stage, 0.0) * 1000, 3)
+    for name in pipeline.profiling.COUNTERS:
+        record[name] = result.profile.counters.get(name, 0)
+
+    return record
+
+
+class ResultWriter:
+    """
+    Writes one record per image as JSON lines or CSV, flushing after every
+    record so partial output is usable while a batch is running.
+
+    Parameters
+    ----------
+        path (str): output file, "-" for standard output
+        fmt (str): "jsonl" or "csv", guessed from the extension if None
+    """
+
+    def __init__(self, path: str = "-", fmt: str | None = None):
+        if fmt is None:
+            fmt = "csv" if path.endswith(".csv") else "jsonl"
+        if fmt not in ("jsonl", "csv"):
+            raise ValueError("Format must be either 'jsonl' or 'csv'")
+
+        self.fmt = fmt
+        self.file = sys.stdout if path == "-" else open(path, "w", newline="")
+        self.csv = None
+
+    def write(self, result: pipeline.core.GridResult):
+        record = _record(result)
+
+        if self.fmt == "jsonl":
+            self.file.write(json.dumps(record) + "\n")
+        else:
+            if self.csv is None:
+                self.csv = csv.DictWriter(self.file, fieldnames=list(record))
+                self.csv.writeheader()
+            self.csv.writerow(record)
+
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
@@ -0,0 +1,173 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BatchingPredictor:
+    """
+    Collects cell tensors from many concurrent callers and classifies them with
+    a single predict call. A batch is run once it holds `max_batch_size` cells
+    or `max_wait` seconds have passed since its first request, and the
+    predictions are scattered back to each caller.
+
+    The predictor has the same predict method as the model it wraps, so it can
+    be used in its place.
+
+    Parameters
+    ----------
+        model: digit classifier with a Keras-like predict method
+        max_batch_size (int): maximum number of cells per predict call
+        max_wait (float): seconds a request waits for others to join its batch
+        max_queue (int): requests allowed to wait, callers block beyond that
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_size: int = 512,
+        max_wait: float = 0.005,
+        max_queue: int = 64,
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._carry = None
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "cells": 0,
+            "batches": 0,
+            "largest_batch": 0,
+            "max_queue_depth": 0,
+        }
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, digits: np.ndarray) -> Future:
+        """
+        Queues cells for classification.
+
+        Parameters
+        ----------
+            digits (np.ndarray): (n, 28, 28, 1) array of cells
+
+        Returns
+        -------
+            future (Future): resolves to the (n, classes) predictions
+        """
+
+        future = Future()
+        self._queue.put((digits, future))
+
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["max_queue_depth"] = max(
+                self._counters["max_queue_depth"], self._queue.qsize()
+            )
+
+        return future
+
+    def predict(self, digits: np.ndarray) -> np.ndarray:
+        return self.submit(digits).result()
+
+    def close(self):
+        """
+        Stops the batching thread once the queued requests are done.
+        """
+
+        self._queue.put(None)
+        self._thread.join()
+
+    def metrics(self) -> dict:
+        """
+        Returns
+        -------
+            metrics (dict): configuration, counters and the current queue depth
+        """
+
+        with self._lock:
+            metrics = dict(self._counters)
+
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["mean_batch_size"] = metrics["cells"] / max(metrics["batches"], 1)
+        metrics["max_batch_size"] = self.max_batch_size
+        metrics["max_wait"] = self.max_wait
+        metrics["max_queue"] = self.max_queue
+
+        return metrics
+
+    def _next_batch(self) -> list | None:
+        """
+        Blocks for the first request, then gathers more until the batch is
+        full or the wait is over. A request that would overflow the batch is
+        carried over to the next one.
+        """
+
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        elif self._stopping:
+            return None
+        else:
+            first = self._queue.get()
+            if first is None:
+                return None
+
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+
+            # the stop signal is remembered so the loop ends after this batch,
+            # putting it back could block on a full queue
+            if item is None:
+                self._stopping = True
+                break
+
+            if size + len(item[0]) > self.max_batch_size:
+                self._carry = item
+                break
+
+            batch.append(item)
+            size += len(item[0])
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            digits, futures = zip(*batch)
+            sizes = [len(d) for d in digits]
+
+            try:
+                preds = self.model.predict(np.concatenate(digits))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            # scattering the predictions back to each request
+            for future, pred in zip(futures, np.split(preds, np.cumsum(sizes)[:-1])):
+                future.set_result(pred)
+
+            with self._lock:
+                self._counters["batches"] += 1
+                self._counters["cells"] += sum(sizes)
+                self._counters["largest_batch"] = max(
+                    self._counters["largest_batch"], sum(sizes)
+                )
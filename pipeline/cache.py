@@ -0,0 +1,244 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+
+import models.solver
+
+# levels of the cache: full results by image, solutions by recognized grid
+LEVELS = ("images", "grids")
+
+# bumped whenever the pipeline changes in a way that changes its results
+CACHE_VERSION = 3
+
+# seconds an entry of the database may go unused before it's pruned
+MAX_AGE = 30 * 24 * 3600.0
+
+
+def fingerprint(**params) -> str:
+    """
+    Identifies everything cached results depend on, e.g. the model and the
+    pipeline parameters. Results are only shared between identical
+    fingerprints.
+    """
+
+    params["cache_version"] = CACHE_VERSION
+    text = json.dumps(params, sort_keys=True, default=str)
+
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def image_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def grid_key(puzzle: np.ndarray) -> Tuple[str, models.solver.Transform]:
+    """
+    Keys a recognized grid by its canonical form, so that puzzles which are
+    relabeled, permuted or transposed variants of each other share a
+    solution.
+
+    Returns
+    -------
+        key (str): canonical grid as a string of N*N symbols, see
+            models.solver.grid_string
+        transform (Transform): maps solutions to the canonical form and back
+    """
+
+    canonical, transform = models.solver.canonical_form(puzzle)
+
+    return models.solver.grid_string(canonical), transform
+
+
+class ResultCache:
+    """
+    Two-level content-addressed cache in front of the pipeline. The first
+    level maps the hash of an encoded image to the full result, the second
+    maps the canonical form of a recognized grid to its solution so that a
+    puzzle seen in another picture, possibly transformed, isn't solved again.
+
+    Each level is an in-memory LRU of at most `max_entries` entries, backed by
+    a SQLite database if a path is given, which processes can share. Keys are
+    scoped by a fingerprint per level, so changing the model or the pipeline
+    parameters invalidates the cache, while processes configured differently
+    can share a database without clobbering each other's entries. Entries of
+    the database not used for `max_age` seconds, whatever their fingerprint,
+    are pruned when it's opened.
+
+    Parameters
+    ----------
+        image_fingerprint (str): what full results depend on, see fingerprint
+        grid_fingerprint (str): what solutions depend on, i.e. the solver
+        max_entries (int): most entries kept in memory per level
+        path (str): SQLite database to share entries through, None for none
+        max_age (float): seconds a database entry may go unused before it's
+            pruned, None to keep entries forever
+    """
+
+    def __init__(
+        self,
+        image_fingerprint: str,
+        grid_fingerprint: str,
+        max_entries: int = 1024,
+        path: str | None = None,
+        max_age: float | None = MAX_AGE,
+    ):
+        self.fingerprints = {"images": image_fingerprint, "grids": grid_fingerprint}
+        self.max_entries = max_entries
+        self.path = path
+
+        self._entries = {level: OrderedDict() for level in LEVELS}
+        self._counters = {
+            f"{level}_{k}": 0 for level in LEVELS for k in ("hits", "misses")
+        }
+        self._lock = threading.Lock()
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            with self._db:
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS entries (level TEXT, "
+                    "fingerprint TEXT, key TEXT, value TEXT, used REAL, "
+                    "PRIMARY KEY (level, fingerprint, key))"
+                )
+            if max_age is not None:
+                self.prune(max_age)
+
+    def get(self, level: str, key: str):
+        """
+        Parameters
+        ----------
+            level (str): one of LEVELS
+            key (str): image_key or grid_key
+
+        Returns
+        -------
+            value: cached JSON value, None on a miss
+        """
+
+        with self._lock:
+            entries = self._entries[level]
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT value FROM entries WHERE level = ? AND fingerprint = ? "
+                    "AND key = ?",
+                    (level, self.fingerprints[level], key),
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(level, key, value)
+                    with self._db:
+                        self._db.execute(
+                            "UPDATE entries SET used = ? WHERE level = ? "
+                            "AND fingerprint = ? AND key = ?",
+                            (time.time(), level, self.fingerprints[level], key),
+                        )
+
+            self._counters[f"{level}_{'misses' if value is None else 'hits'}"] += 1
+
+        return value
+
+    def put(self, level: str, key: str, value):
+        """
+        Stores a JSON serializable value in memory, and in the database if
+        there is one.
+        """
+
+        with self._lock:
+            self._remember(level, key, value)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                        (
+                            level,
+                            self.fingerprints[level],
+                            key,
+                            json.dumps(value),
+                            time.time(),
+                        ),
+                    )
+
+    def prune(self, max_age: float) -> int:
+        """
+        Deletes the entries of the database, of any fingerprint, that weren't
+        stored or read from it in the last `max_age` seconds. Entries kept in
+        memory are left alone.
+
+        Returns
+        -------
+            pruned (int): number of entries deleted
+        """
+
+        if self._db is None:
+            return 0
+
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "DELETE FROM entries WHERE used < ?", (time.time() - max_age,)
+            )
+
+        return cursor.rowcount
+
+    def get_solution(self, key: str, transform: models.solver.Transform) -> tuple:
+        """
+        Looks a grid up in the grids level.
+
+        Parameters
+        ----------
+            key (str): canonical key of the grid, see grid_key
+            transform (Transform): transform of the grid, see grid_key
+
+        Returns
+        -------
+            solution (np.ndarray): solution of the grid, None on a miss
+            status (int): solver status, None on a miss
+        """
+
+        cached = self.get("grids", key)
+        if cached is None:
+            return None, None
+
+        return transform.invert(np.array(cached["solution"])), cached["status"]
+
+    def put_solution(
+        self,
+        key: str,
+        transform: models.solver.Transform,
+        solution: np.ndarray,
+        status: int,
+    ):
+        # solutions are stored in canonical form
+        value = {"solution": transform.apply(solution).tolist(), "status": int(status)}
+        self.put("grids", key, value)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            metrics = dict(self._counters)
+            for level in LEVELS:
+                metrics[f"{level}_entries"] = len(self._entries[level])
+
+        return metrics
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, level: str, key: str, value):
+        # least recently used entries go first
+        entries = self._entries[level]
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
@@ -0,0 +1,1312 @@
+import time
+from dataclasses import dataclass, field
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+import imageproc.contours
+import imageproc.transforms
+import imageproc.utils
+import models.ocr
+import models.solver
+import pipeline.cache
+import pipeline.profiling
+
+# width images are resized to before searching for the grid, only the
+# corners are located at this level, candidates are warped from the original
+DETECT_WIDTH = 350
+
+# width frames are tracked at, see pipeline.video.GridTracker
+IMAGE_WIDTH = 700
+
+# most grid candidates warped and searched for cells per image
+MAX_CANDIDATES = 8
+
+# smallest candidate area, relative to the image, that can hold a readable grid
+MIN_GRID_AREA = 0.005
+
+# side in pixels a cell needs on the level searched for its grid to be found,
+# finer levels are searched for grids smaller than that, see find_grids
+MIN_DETECT_CELL = 6
+
+# geometry of the top-down view candidates are warped to, see
+# imageproc.transforms.top_down_view
+VIEW_MARGIN = 10
+VIEW_SIDE = 500
+
+# half side of the window candidate corners are refined in, relative to a
+# cell of the pyramid level they're warped from, see _refine_corners
+CORNER_WINDOW = 0.1
+
+# corners of the grid in the top-down view, in imageproc.utils._sort_points
+# order
+VIEW_CORNERS = np.array(
+    [
+        [VIEW_MARGIN, VIEW_MARGIN],
+        [VIEW_MARGIN + VIEW_SIDE, VIEW_MARGIN],
+        [VIEW_MARGIN, VIEW_MARGIN + VIEW_SIDE],
+        [VIEW_MARGIN + VIEW_SIDE, VIEW_MARGIN + VIEW_SIDE],
+    ],
+    dtype="float32",
+)
+
+# cells per side of the grids searched for by default, other sizes are
+# supported as long as models.solver.box_shape can split them into boxes
+GRID_SIZE = 9
+
+# ways of locating the cells in the top-down view of a candidate
+CELL_MODES = ("contours", "projection")
+
+# fraction of the grid side a line must cover to count as a grid line
+MIN_LINE_STRENGTH = 0.2
+
+# allowed deviation of line spacing from a perfectly warped grid, relative
+LINE_SPACING_TOLERANCE = 0.25
+
+# pixels trimmed off cells located by projection so they exclude the lines
+LINE_INSET = 2
+
+# most ink, relative to the cell area, of a cell taken as empty without the
+# model, see imageproc.utils.find_blanks
+BLANK_THRESHOLD = 0.02
+
+# seconds the solver may spend on a puzzle before giving up on it with
+# models.solver.STATUS_TIMEOUT, so one pathological grid can't hold a worker
+SOLVE_BUDGET = 1.0
+
+# most cells read differently to make an infeasible puzzle solvable
+MAX_CORRECTIONS = 3
+
+# seconds spent looking for corrections, bounding the worst case latency
+REPAIR_BUDGET = 0.05
+
+# search nodes and seconds spent making sure a solution is the only one
+UNIQUENESS_NODES = 10000
+UNIQUENESS_BUDGET = 0.02
+
+
+@dataclass
+class GridResult:
+    """
+    Outcome of running the pipeline on a single image. Coordinates of the grid
+    corners refer to the original image, cell geometry refers to the top-down
+    view of the grid.
+
+    Attributes
+    ----------
+        image (np.ndarray): resized image the grid was searched for in
+        source (np.ndarray): original image candidates are warped from, the
+            resized image is warped if None
+        scale (float): factor converting resized coordinates to original ones
+        size (int): number of cells per side of the grid
+        found (bool): whether a grid with size x size cells was found
+        corners (np.ndarray): grid corners in the original image, sorted
+            left-to-right, top-to-bottom
+        roi (np.ndarray): top-down view of the grid (or best candidate)
+        roi_thresh (np.ndarray): thresholded top-down view
+        cell_contours (list): cell contours found in the top-down view
+        cell_centers (list): centers of the sorted cells
+        cell_bboxes (list): bounding boxes of the sorted cells
+        puzzle (np.ndarray): NxN matrix of recognized digits
+        solution (np.ndarray): NxN matrix of the solved puzzle
+        status (int): solver status, one of models.solver.STATUS_*
+        unique (bool): whether the solution is the only one, None if unknown
+        path (str): file the image was read from, if any
+        digits (np.ndarray): (N*N, 28, 28, 1) cells awaiting classification
+        blanks (np.ndarray): (N*N,) mask of the cells found empty without the
+            model
+        ink (np.ndarray): (N*N,) share of each cell covered by ink
+        probabilities (np.ndarray): (N*N, N+1) class probabilities of the
+            cells
+        corrections (list): (row, col, read, digit) of every cell whose
+            reading was changed to make the puzzle solvable
+        profile (Profiler): time spent in each stage and candidate counts
+    """
+
+    image: np.ndarray
+    source: np.ndarray | None = None
+    scale: float = 1.0
+    size: int = GRID_SIZE
+    found: bool = False
+    corners: np.ndarray | None = None
+    roi: np.ndarray | None = None
+    roi_thresh: np.ndarray | None = None
+    cell_contours: list = field(default_factory=list)
+    cell_centers: list = field(default_factory=list)
+    cell_bboxes: list = field(default_factory=list)
+    puzzle: np.ndarray | None = None
+    solution: np.ndarray | None = None
+    status: int = models.solver.STATUS_NOT_SOLVED
+    unique: bool | None = None
+    path: str | None = None
+    digits: np.ndarray | None = None
+    blanks: np.ndarray | None = None
+    ink: np.ndarray | None = None
+    probabilities: np.ndarray | None = None
+    corrections: list = field(default_factory=list)
+    profile: pipeline.profiling.Profiler = field(
+        default_factory=pipeline.profiling.Profiler
+    )
+
+    @property
+    def solved(self) -> bool:
+        return self.status == models.solver.STATUS_SOLVED
+
+    def to_dict(self) -> dict:
+        """
+        Converts the result into JSON serializable types, leaving out images.
+        """
+
+        def as_list(array):
+            return None if array is None else np.asarray(array).tolist()
+
+        return {
+            "size": self.size,
+            "found": self.found,
+            "solved": self.solved,
+            "status": int(self.status),
+            "unique": self.unique,
+            "grid": as_list(self.puzzle),
+            "solution": as_list(self.solution),
+            "corners": as_list(self.corners),
+            "cell_centers": [list(map(int, c)) for c in self.cell_centers],
+            "cell_bboxes": [list(map(int, b)) for b in self.cell_bboxes],
+            "corrections": [
+                dict(zip(("row", "col", "read", "digit"), map(int, c)))
+                for c in self.corrections
+            ],
+            "profile": self.profile.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, record: dict) -> "GridResult":
+        """
+        Rebuilds a result from the output of to_dict, e.g. a cached one,
+        without images and with a fresh profile.
+        """
+
+        def as_array(values):
+            return None if values is None else np.array(values)
+
+        return cls(
+            image=None,
+            size=record.get("size", GRID_SIZE),
+            found=record["found"],
+            status=record["status"],
+            unique=record.get("unique"),
+            puzzle=as_array(record["grid"]),
+            solution=as_array(record["solution"]),
+            corners=as_array(record["corners"]),
+            cell_centers=[tuple(c) for c in record["cell_centers"]],
+            cell_bboxes=[tuple(b) for b in record["cell_bboxes"]],
+            corrections=[
+                (c["row"], c["col"], c["read"], c["digit"])
+                for c in record.get("corrections", [])
+            ],
+        )
+
+
+def load_model(name: str, backend: str = "keras"):
+    """
+    Loads a digit recognition model. TensorFlow is only imported by the keras
+    backend (and the tflite backend without tflite_runtime installed).
+
+    Parameters
+    ----------
+        name (str): name of the model in models/
+        backend (str): inference backend, see models.ocr.BACKENDS
+
+    Returns
+    -------
+        model: backend with a predict method returning class probabilities
+    """
+
+    return models.ocr.load_backend(name, backend)
+
+
+def decode_image(data: bytes) -> np.ndarray | None:
+    """
+    Decodes encoded image bytes (e.g. the contents of a jpg file).
+
+    Parameters
+    ----------
+        data (bytes): encoded image
+
+    Returns
+    -------
+        image (np.ndarray): BGR image, None if the bytes could not be decoded
+    """
+
+    if not data:
+        return None
+
+    return cv2.imdecode(np.frombuffer(data, dtype="uint8"), cv2.IMREAD_COLOR)
+
+
+def preprocess(
+    image: np.ndarray, profiler: pipeline.profiling.Profiler | None = None
+) -> Tuple[np.ndarray, float, np.ndarray]:
+    """
+    Resizes an image and thresholds it for the grid search. The grid only
+    has to be located at this size, it's read from the original image.
+
+    Parameters
+    ----------
+        image (np.ndarray): original BGR image
+        profiler (Profiler): records the time of each step, if given
+
+    Returns
+    -------
+        resized (np.ndarray): image resized to DETECT_WIDTH, maintaining aspect
+        scale (float): factor converting resized coordinates to original ones
+        thresh (np.ndarray): thresholded version of the resized image
+    """
+
+    if profiler is None:
+        profiler = pipeline.profiling.Profiler()
+
+    # resizing image, maintaining aspect ratio
+    with profiler.stage("resize"):
+        resized = imageproc.transforms.resize(image, width=DETECT_WIDTH)
+    scale = image.shape[1] / resized.shape[1]
+
+    return resized, scale, _threshold(resized, profiler)
+
+
+def _threshold(image: np.ndarray, profiler: pipeline.profiling.Profiler) -> np.ndarray:
+    # binarizing an image the grids are searched for in
+    with profiler.stage("threshold"):
+        _, _, thresh = imageproc.utils.grey_blur_threshold(
+            image, (5, 5), cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 5, 2
+        )
+
+    return thresh
+
+
+def rank_candidates(
+    thresh: np.ndarray, quad_contours: list, quad_corners: list, size: int = GRID_SIZE
+) -> list:
+    """
+    Scores quadrilaterals by how much they look like a sudoku grid, without
+    warping them: area, convexity, squareness of the corners and the number
+    of lines crossed by scanlines through the interior. Candidates too small
+    to hold a readable grid, or that aren't convex, are left out.
+
+    Parameters
+    ----------
+        thresh (np.ndarray): thresholded version of the resized image
+        quad_contours (list): quadrilateral contours
+        quad_corners (list): corners of the contour approximations
+        size (int): number of cells per side of the grid
+
+    Returns
+    -------
+        order (list): indices of the remaining candidates, best first
+    """
+
+    # foreground runs expected along a scanline across the inner lines
+    expected = size - 1
+    image_area = thresh.shape[0] * thresh.shape[1]
+
+    # lines only need to be told apart, half resolution is plenty
+    small = cv2.resize(thresh, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+
+    scores = {}
+    for idx, (contour, corners) in enumerate(zip(quad_contours, quad_corners)):
+        area = cv2.contourArea(contour)
+        if area / image_area < MIN_GRID_AREA or not cv2.isContourConvex(corners):
+            continue
+
+        convexity = area / max(cv2.contourArea(cv2.convexHull(contour)), 1.0)
+        squareness = imageproc.contours.quad_squareness(corners)
+
+        sorted_corners = imageproc.utils._sort_points(corners.reshape((4, 2)), 2)
+        crossings = np.median(
+            imageproc.contours.line_crossings(small, sorted_corners / 2)
+        )
+
+        # too few lines is a plain box, far too many is more likely text
+        lines = min(crossings / expected, 4 * expected / max(crossings, 1))
+        lines = float(np.clip(lines, 0.1, 1.0))
+
+        scores[idx] = np.sqrt(area / image_area) * convexity * squareness * lines
+
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _is_redundant(corners: np.ndarray, rejected: list) -> bool:
+    """
+    Whether a candidate covers the same region as an already rejected one:
+    its corners lie within the rejected quad, or within a few pixels of it,
+    and it spans most of its area (e.g. the inner edge of the same border).
+    """
+
+    area = cv2.contourArea(corners)
+    for other in rejected:
+        inside = all(
+            cv2.pointPolygonTest(other, (float(x), float(y)), True) > -3
+            for x, y in corners.reshape((4, 2))
+        )
+        if inside and area > 0.8 * cv2.contourArea(other):
+            return True
+
+    return False
+
+
+def _overlaps(corners: np.ndarray, grids: list) -> bool:
+    """
+    Whether a candidate shares more than a sliver of its area with a grid that
+    was already found, e.g. the frame around a grid or a box inside of it.
+    """
+
+    quad = corners.reshape((4, 2)).astype("float32")
+    area = cv2.contourArea(quad)
+    for other in grids:
+        other = other.reshape((4, 2)).astype("float32")
+        shared, _ = cv2.intersectConvexConvex(quad, other)
+        if shared > 0.1 * min(area, cv2.contourArea(other)):
+            return True
+
+    return False
+
+
+class _Pyramid:
+    """
+    Gaussian pyramid of the original image, finest level first, that
+    candidates are warped from. Levels and their grey versions are only built
+    when a candidate needs them.
+    """
+
+    def __init__(self, image: np.ndarray):
+        self.levels = [image]
+        self.greys = {}
+
+    def level(self, side: float) -> int:
+        """
+        Picks the coarsest level on which a grid `side` pixels wide in the
+        original image spans at least half of the top-down view. The warp
+        then magnifies the grid less than twice and never shrinks it, which
+        would alias thin lines away. Small grids are warped from the original
+        image.
+        """
+
+        level = 0
+        while side / 2 ** (level + 1) >= VIEW_SIDE / 2:
+            level += 1
+            if level == len(self.levels):
+                self.levels.append(cv2.pyrDown(self.levels[-1]))
+
+        return level
+
+    def image(self, level: int) -> np.ndarray:
+        while len(self.levels) <= level:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+
+        return self.levels[level]
+
+    def scale(self, level: int) -> float:
+        # factor converting coordinates of the level to original ones
+        return self.levels[0].shape[1] / self.levels[level].shape[1]
+
+    def grey(self, level: int) -> np.ndarray:
+        if level not in self.greys:
+            self.greys[level] = cv2.cvtColor(self.levels[level], cv2.COLOR_BGR2GRAY)
+
+        return self.greys[level]
+
+
+def _refine_corners(grey: np.ndarray, corners: np.ndarray, size: int) -> np.ndarray:
+    """
+    Moves corners located on a coarse level to subpixel accuracy on a finer
+    one, within a window of a fraction of a cell around each corner.
+
+    Parameters
+    ----------
+        grey (np.ndarray): grey level the corners are refined on
+        corners (np.ndarray): (4, 2) corners, in coordinates of that level
+        size (int): number of cells per side of the grid
+
+    Returns
+    -------
+        refined (np.ndarray): (4, 2) float32 corners
+    """
+
+    cell = np.sqrt(cv2.contourArea(corners.astype("float32"))) / size
+    half = int(np.clip(CORNER_WINDOW * cell, 2, 15))
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.05)
+
+    refined = cv2.cornerSubPix(
+        grey,
+        corners.reshape((4, 1, 2)).astype("float32"),
+        (half, half),
+        (-1, -1),
+        criteria,
+    )
+
+    return refined.reshape((4, 2))
+
+
+def _warp_candidate(
+    pyramid: _Pyramid, corners: np.ndarray, size: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Refines the corners of a candidate on the pyramid level it's warped from
+    and warps it into the top-down view, in a single warp.
+
+    Parameters
+    ----------
+        pyramid (_Pyramid): pyramid of the original image
+        corners (np.ndarray): (4, 2) corners, in original coordinates
+        size (int): number of cells per side of the grid
+
+    Returns
+    -------
+        roi (np.ndarray): top-down view of the candidate
+        corners (np.ndarray): (4, 2) refined corners, in original coordinates
+    """
+
+    side = np.sqrt(cv2.contourArea(corners.astype("float32")))
+    level = pyramid.level(side)
+    scale = pyramid.scale(level)
+
+    points = _refine_corners(pyramid.grey(level), corners / scale, size)
+    roi = imageproc.transforms.top_down_view(
+        pyramid.levels[level], points, VIEW_MARGIN, VIEW_SIDE
+    )
+
+    return roi, points * scale
+
+
+def _contour_cells(roi_thresh: np.ndarray, size: int) -> Tuple[int, bool, tuple]:
+    """
+    Locates cells as quadrilateral contours of cell size, the grid is found
+    if there are exactly size * size of them. Cells are sorted later, and only if the
+    grid was found.
+
+    Returns
+    -------
+        count (int): number of cells found
+        found (bool): whether the candidate is a grid
+        cells (tuple): cell contours, boxes and centers (the latter empty)
+    """
+
+    # area bounds are relative to the view, which is split into more cells
+    cells = size * size
+    bounds = (0.0035 * 81 / cells, 0.02 * 81 / cells)
+    cell_contours, _ = imageproc.contours.find_quadrilaterals(
+        roi_thresh, mode=cv2.RETR_LIST, error=0.02, bounds=bounds
+    )
+
+    # if every cell is found, we assume we found the board
+    return len(cell_contours), len(cell_contours) == cells, (cell_contours, [], [])
+
+
+def _project_cells(roi_thresh: np.ndarray, size: int) -> Tuple[int, bool, tuple]:
+    """
+    Locates the size + 1 horizontal and vertical grid lines from projection
+    profiles of the top-down view, which gives every cell directly and
+    tolerates a few broken cell borders. The grid is found if every line is
+    strong enough and the lines are evenly spaced.
+
+    Returns
+    -------
+        count (int): number of grid lines found
+        found (bool): whether the candidate is a grid
+        cells (tuple): cell contours, boxes and centers, sorted
+    """
+
+    xs, ys, strength = imageproc.utils.find_grid_lines(roi_thresh, cells=size)
+
+    lines = np.concatenate([xs, ys])
+    cell = (lines[:, -1] - lines[:, 0]).mean() / size
+    spacing = np.diff(lines, axis=1)
+    even = np.all(np.abs(spacing - cell) <= LINE_SPACING_TOLERANCE * cell)
+    count = int(np.count_nonzero(strength >= MIN_LINE_STRENGTH))
+
+    # trimming the lines off the cells
+    bboxes, centers = imageproc.utils.grid_cells(xs, ys)
+    bboxes = [
+        (x + LINE_INSET, y + LINE_INSET, w - 2 * LINE_INSET, h - 2 * LINE_INSET)
+        for x, y, w, h in bboxes
+    ]
+    contours = [
+        np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]]).reshape((4, 1, 2))
+        for x, y, w, h in bboxes
+    ]
+
+    return count, bool(even and count == len(strength)), (contours, bboxes, centers)
+
+
+def _search_grids(
+    image: np.ndarray,
+    thresh: np.ndarray,
+    result: GridResult,
+    max_grids: int | None,
+    max_candidates: int | None,
+    cell_mode: str,
+    nested: bool = False,
+    found: list | None = None,
+    rejected: list | None = None,
+    pyramid: _Pyramid | None = None,
+) -> list:
+    """
+    Warps the best ranked candidates and locates the cells inside of them,
+    until `max_grids` grids were found or `max_candidates` candidates were
+    rejected. Candidates overlapping a grid found already are skipped, and so
+    are those covering the same region as a rejected one. The candidate with
+    the most cells is recorded on the result, so there is something to show
+    if no grid is found.
+
+    Grids found and candidates rejected by earlier searches of the same image
+    can be given in `found` and `rejected`, with corners in original
+    coordinates. Candidates rejected by this search are added to `rejected`.
+
+    Only outermost quadrilaterals are candidates, unless `nested` is set,
+    e.g. for grids inside the border of a page.
+
+    Candidates are located on the resized image and warped from the original
+    one (see _warp_candidate), or from the resized image if the result has no
+    source. A pyramid of the original image may be given to share its levels
+    between searches.
+
+    Returns
+    -------
+        grids (list): (corners, roi, roi_thresh, cells) of every grid, in the
+            order they were found, corners in original coordinates
+    """
+
+    profiler = result.profile
+    size = result.size
+
+    # factors converting resized coordinates to those of the warped image
+    # and to original ones, the image searched may be any resized version of
+    # the source
+    source = image if result.source is None else result.source
+    to_source = source.shape[1] / image.shape[1]
+    to_original = result.scale if result.source is None else to_source
+    pyramid = _Pyramid(source) if pyramid is None else pyramid
+
+    # outside edge of sudoku grid will likely be quadrilateral contour, cells
+    # are too small to be candidates so they are dropped right away
+    with profiler.stage("find_quadrilaterals"):
+        if nested:
+            quad_contours, quad_corners = imageproc.contours.find_quadrilaterals(
+                thresh, cv2.RETR_TREE, 0.01, (MIN_GRID_AREA, 1.0)
+            )
+        else:
+            quad_contours, quad_corners = imageproc.contours.find_quadrilaterals(
+                thresh, cv2.RETR_EXTERNAL, 0.01
+            )
+    profiler.count("quad_candidates", len(quad_contours))
+
+    # scoring candidates so the grid is likely among the first few warped
+    with profiler.stage("rank_candidates"):
+        order = rank_candidates(thresh, quad_contours, quad_corners, size)
+    profiler.count("candidates_ranked", len(order))
+
+    best_count = -1
+    earlier = [(c / to_original).astype("float32") for c in rejected or []]
+    located = [corners / to_original for corners in found or []]
+    skipped = []
+    grids = []
+    for idx in order:
+        if max_candidates is not None and len(skipped) >= max_candidates:
+            break
+
+        # skipping what is effectively a candidate that was already searched
+        if _is_redundant(quad_corners[idx], earlier + skipped) or _overlaps(
+            quad_corners[idx], located
+        ):
+            profiler.count("candidates_pruned")
+            continue
+
+        # getting top-down-view of potential grid
+        with profiler.stage("top_down_view"):
+            roi, corners = _warp_candidate(
+                pyramid, quad_corners[idx].reshape((4, 2)) * to_source, size
+            )
+            corners *= to_original / to_source
+        profiler.count("candidates_warped")
+
+        # preprocessing image
+        with profiler.stage("roi_threshold"):
+            _, _, roi_thresh = imageproc.utils.grey_blur_threshold(
+                roi,
+                (3, 3),
+                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                cv2.THRESH_BINARY_INV,
+                57,
+                5,
+            )
+
+        # locating the cells in the top-down view
+        with profiler.stage("find_cells"):
+            if cell_mode == "projection":
+                count, found, cells = _project_cells(roi_thresh, size)
+            else:
+                count, found, cells = _contour_cells(roi_thresh, size)
+
+        # keeping the candidate with the most cells in case no grid is found
+        if count > best_count:
+            best_count = count
+            _record_candidate(result, corners, roi, roi_thresh, cells)
+
+        if not found:
+            skipped.append(quad_corners[idx])
+            if rejected is not None:
+                rejected.append(quad_corners[idx].reshape((4, 2)) * to_original)
+            continue
+
+        located.append(quad_corners[idx])
+        grids.append((corners, roi, roi_thresh, cells))
+        if max_grids is not None and len(grids) >= max_grids:
+            break
+
+    return grids
+
+
+def _record_candidate(
+    result: GridResult,
+    corners: np.ndarray,
+    roi: np.ndarray,
+    roi_thresh: np.ndarray,
+    cells: tuple,
+):
+    # corners refer to the original image, the rest to the top-down view
+    result.corners = imageproc.utils._sort_points(corners, row_size=2)
+    result.roi, result.roi_thresh = roi, roi_thresh
+    result.cell_contours, result.cell_bboxes, result.cell_centers = cells
+
+
+def find_grid(
+    image: np.ndarray,
+    thresh: np.ndarray,
+    result: GridResult,
+    max_candidates: int = MAX_CANDIDATES,
+    cell_mode: str = "contours",
+) -> bool:
+    """
+    Searches for the sudoku grid by ranking quadrilaterals with
+    rank_candidates, then warping the best ones into a top-down view and
+    locating the cells inside of them, either as cell contours or from the
+    grid lines (see CELL_MODES). The search stops at the first grid or after
+    `max_candidates` warps. The grid, or the candidate with the most cells
+    (or grid lines) if none qualifies, is recorded on the result.
+
+    Parameters
+    ----------
+        image (np.ndarray): resized image
+        thresh (np.ndarray): thresholded version of the resized image
+        result (GridResult): result to record the grid on, sized to the
+            grid searched for
+        max_candidates (int): most candidates to warp, None for no limit
+        cell_mode (str): "contours" or "projection"
+
+    Returns
+    -------
+        found (bool): whether a grid with every cell was found
+    """
+
+    grids = _search_grids(image, thresh, result, 1, max_candidates, cell_mode)
+    if grids:
+        _record_candidate(result, *grids[0])
+        result.found = True
+
+    return result.found
+
+
+def _finest_width(source: np.ndarray, size: int) -> int:
+    """
+    Width of the level on which the smallest grid a candidate may be (see
+    MIN_GRID_AREA) has cells of MIN_DETECT_CELL pixels, at most that of the
+    source.
+    """
+
+    h, w = source.shape[:2]
+    side = np.sqrt(MIN_GRID_AREA * h / w)
+
+    return int(min(np.ceil(MIN_DETECT_CELL * size / side), w))
+
+
+def find_grids(
+    image: np.ndarray,
+    thresh: np.ndarray,
+    result: GridResult,
+    max_grids: int | None = None,
+    max_candidates: int = MAX_CANDIDATES,
+    cell_mode: str = "contours",
+) -> list:
+    """
+    Searches for every grid in an image, e.g. a newspaper page or a scan of a
+    puzzle book, from the same quadrilaterals find_grid ranks. Candidates are
+    warped best first as in find_grid, but the search goes on after a grid is
+    found, skipping candidates that overlap it, until `max_grids` grids were
+    found or `max_candidates` candidates didn't hold a grid. Quadrilaterals
+    inside of others are candidates too, as the page or the layout usually
+    frames the grids.
+
+    Parameters
+    ----------
+        image (np.ndarray): resized image
+        thresh (np.ndarray): thresholded version of the resized image
+        result (GridResult): result of the whole image, sized to the grids
+            searched for, the best candidate is recorded on it if no grid is
+            found
+        max_grids (int): most grids to find, None for no limit
+        max_candidates (int): most candidates without a grid to warp, None
+            for no limit
+        cell_mode (str): "contours" or "projection"
+
+    Returns
+    -------
+        grids (list): a found GridResult per grid, with its quadrilateral in
+            `corners`, in reading order. Grids share the profile of the image.
+    """
+
+    source = image if result.source is None else result.source
+    pyramid = _Pyramid(source)
+    rejected = []
+    located = _search_grids(
+        image,
+        thresh,
+        result,
+        max_grids,
+        max_candidates,
+        cell_mode,
+        nested=True,
+        rejected=rejected,
+        pyramid=pyramid,
+    )
+
+    # grids too small to be made out on the resized image are searched for on
+    # the levels of the pyramid at least twice as wide, coarsest first, up to
+    # one on which the smallest candidate has cells of MIN_DETECT_CELL pixels
+    finest = _finest_width(source, result.size)
+    coarsest = int(np.log2(source.shape[1] / image.shape[1])) - 1
+    for level in range(coarsest, -1, -1):
+        if max_grids is not None and len(located) >= max_grids:
+            break
+
+        with result.profile.stage("resize"):
+            level_image = pyramid.image(level)
+        located += _search_grids(
+            level_image,
+            _threshold(level_image, result.profile),
+            result,
+            None if max_grids is None else max_grids - len(located),
+            max_candidates,
+            cell_mode,
+            nested=True,
+            found=[corners for corners, *_ in located],
+            rejected=rejected,
+            pyramid=pyramid,
+        )
+        if level_image.shape[1] >= finest:
+            break
+
+    grids = []
+    for grid in located:
+        found = GridResult(
+            image=result.image,
+            source=result.source,
+            scale=result.scale,
+            size=result.size,
+            found=True,
+            path=result.path,
+            profile=result.profile,
+        )
+        _record_candidate(found, *grid)
+        grids.append(found)
+
+    result.found = bool(grids)
+
+    # rows of grids top-to-bottom, a grid centered above the bottom of the
+    # first grid of a row is in that row, rows are read left-to-right
+    rows = []
+    for grid in sorted(grids, key=lambda g: g.corners[:, 1].mean()):
+        if rows and grid.corners[:, 1].mean() < rows[-1][0].corners[:, 1].max():
+            rows[-1].append(grid)
+        else:
+            rows.append([grid])
+
+    return [
+        g for row in rows for g in sorted(row, key=lambda g: g.corners[:, 0].mean())
+    ]
+
+
+def extract_digits(result: GridResult, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Sorts the cells of a found grid, unless they were located in order, and
+    crops them into model inputs.
+
+    Parameters
+    ----------
+        result (GridResult): result of a found grid, cell geometry is recorded
+        out (np.ndarray): (N*N, 28, 28, 1) float32 array to write the cells
+            into, e.g. a slice of a larger batch, allocated if not given
+
+    Returns
+    -------
+        digits (np.ndarray): (N*N, 28, 28, 1) float32 array of cells scaled to
+            [0, 1]
+    """
+
+    profiler = result.profile
+
+    # have to know cell order to transcribe to matrix for solving
+    if not result.cell_bboxes:
+        with profiler.stage("sort_cells"):
+            sorted_cells = imageproc.utils.sort_cells(result.cell_contours, result.size)
+
+            # cell centours for image annotation, boxes for cropping
+            result.cell_centers = [
+                imageproc.contours.get_center(c) for c in sorted_cells
+            ]
+            result.cell_bboxes = [cv2.boundingRect(c) for c in sorted_cells]
+
+    # cropping all cells at once and cleaning up noise
+    with profiler.stage("extract_cells"):
+        return imageproc.utils.extract_cell_batch(
+            result.roi_thresh, result.cell_bboxes, out
+        )
+
+
+def screen_blanks(
+    result: GridResult, digits: np.ndarray, blank_threshold: float = BLANK_THRESHOLD
+) -> np.ndarray:
+    """
+    Finds the cells that are empty beyond doubt, so they can skip the model.
+    The mask and the ink of every cell are recorded on the result, and the
+    number of cells skipped and left for the model is counted in its profile.
+
+    Parameters
+    ----------
+        result (GridResult): result of a found grid
+        digits (np.ndarray): (N*N, 28, 28, 1) cells from extract_digits
+        blank_threshold (float): most ink of an empty cell, relative to its
+            area, negative to send every cell to the model
+
+    Returns
+    -------
+        blanks (np.ndarray): (N*N,) boolean mask of the empty cells
+    """
+
+    with result.profile.stage("screen_blanks"):
+        result.blanks = imageproc.utils.find_blanks(digits, blank_threshold)
+        result.ink = digits.reshape((len(digits), -1)).mean(axis=1)
+
+    skipped = int(result.blanks.sum())
+    result.profile.count("blank_cells", skipped)
+    result.profile.count("classified_cells", len(digits) - skipped)
+
+    return result.blanks
+
+
+def read_digits(
+    result: GridResult, model, blank_threshold: float = BLANK_THRESHOLD
+) -> np.ndarray:
+    """
+    Crops the cells of a found grid and classifies their digits. Cells that
+    are empty beyond doubt are set to 0 without going through the model. The
+    class probabilities of every cell are kept in the result for repair_puzzle.
+
+    A grid of N cells per side needs a model with at least N + 1 classes,
+    further classes are ignored.
+
+    Parameters
+    ----------
+        result (GridResult): result of a found grid, cell geometry is recorded
+        model: digit classifier with a Keras-like predict method
+        blank_threshold (float): see screen_blanks
+
+    Returns
+    -------
+        puzzle (np.ndarray): NxN matrix of recognized digits, 0 for blanks
+    """
+
+    return read_grids([result], model, blank_threshold)[0]
+
+
+def read_grids(results: list, model, blank_threshold: float = BLANK_THRESHOLD) -> list:
+    """
+    Reads the digits of several found grids like read_digits, classifying
+    the cells of all of them with a single model call. The time of the call
+    is split evenly between the profiles of the grids, grids sharing a
+    profile (see find_grids) count once.
+
+    Parameters
+    ----------
+        results (list): GridResults of found grids
+        model: digit classifier with a Keras-like predict method
+        blank_threshold (float): see screen_blanks
+
+    Returns
+    -------
+        puzzles (list): NxN matrix of recognized digits of every grid
+    """
+
+    # cropping every grid into one batch
+    bounds = np.cumsum([0] + [r.size**2 for r in results])
+    digits = np.empty((bounds[-1], 28, 28, 1), dtype="float32")
+    for result, start, end in zip(results, bounds[:-1], bounds[1:]):
+        extract_digits(result, digits[start:end])
+        screen_blanks(result, digits[start:end], blank_threshold)
+
+    # predicting the contents of the remaining cells with the model
+    blanks = np.concatenate([r.blanks for r in results])
+    start = time.perf_counter()
+    predicted = model.predict(digits[~blanks]) if not blanks.all() else None
+    elapsed = time.perf_counter() - start
+
+    profiles = list({id(r.profile): r.profile for r in results}.values())
+    for profile in profiles:
+        profile.add("predict", elapsed / len(profiles))
+
+    puzzles = []
+    offset = 0
+    for result in results:
+        size, pending = result.size, ~result.blanks
+        result.probabilities = np.zeros((size**2, size + 1), dtype="float32")
+        result.probabilities[~pending, 0] = 1.0
+        if pending.any():
+            cells = predicted[offset : offset + pending.sum()]
+            result.probabilities[pending] = read_classes(cells, size)
+            offset += pending.sum()
+        puzzles.append(result.probabilities.argmax(axis=1).reshape((size, size)))
+
+    return puzzles
+
+
+def read_classes(probabilities: np.ndarray, size: int) -> np.ndarray:
+    """
+    Keeps the classes of the values a grid of `size` cells per side can hold.
+
+    Raises
+    ------
+        ValueError: if the model can't tell apart every value of the grid
+    """
+
+    if probabilities.shape[-1] < size + 1:
+        raise ValueError(
+            "a model with %d classes can't read %dx%d grids"
+            % (probabilities.shape[-1], size, size)
+        )
+
+    return probabilities[..., : size + 1]
+
+
+def repair_puzzle(
+    result: GridResult,
+    max_corrections: int = MAX_CORRECTIONS,
+    time_budget: float = REPAIR_BUDGET,
+) -> bool:
+    """
+    Rereads the least certain cells of an infeasible puzzle, most probable
+    readings first, until the puzzle can be solved or the time budget is
+    spent. See models.solver.repair.
+
+    The model is confident about noise it takes for a digit as often as not,
+    but such cells hold much less ink than real digits. Cells read as digits
+    are taken to be blank with a probability of at least how much less ink
+    they hold than the median digit of the puzzle.
+
+    Parameters
+    ----------
+        result (GridResult): result of an infeasible puzzle with the class
+            probabilities of its cells, updated in place when repaired
+        max_corrections (int): most cells read differently
+        time_budget (float): seconds to spend, 0 to not repair at all
+
+    Returns
+    -------
+        repaired (bool): whether the puzzle was made solvable
+    """
+
+    if time_budget <= 0 or max_corrections <= 0 or result.probabilities is None:
+        return False
+
+    with result.profile.stage("repair"):
+        probabilities = result.probabilities
+        read = result.puzzle.flatten() > 0
+        if result.ink is not None and read.any():
+            faint = np.clip(1 - result.ink / np.median(result.ink[read]), 0, 1)
+            probabilities = probabilities.copy()
+            probabilities[read, 0] = np.maximum(probabilities[read, 0], faint[read])
+
+        puzzle, solution, status, corrections = models.solver.repair(
+            result.puzzle,
+            probabilities,
+            max_corrections,
+            time_budget=time_budget,
+        )
+
+    if status != models.solver.STATUS_SOLVED:
+        return False
+
+    result.puzzle, result.solution, result.status = puzzle, solution, status
+    result.corrections = corrections
+    result.unique = True
+    result.profile.count("corrected_cells", len(corrections))
+
+    return True
+
+
+def solve_puzzle(
+    puzzle: np.ndarray,
+    solver: str = "bitmask",
+    cache: pipeline.cache.ResultCache | None = None,
+    time_budget: float | None = SOLVE_BUDGET,
+) -> Tuple[np.ndarray | None, int]:
+    """
+    Solves a recognized grid, unless its solution is in the grid level of the
+    cache. Grids the solver gives up on are not cached, a larger budget may
+    still solve them.
+
+    Parameters
+    ----------
+        puzzle (np.ndarray): NxN matrix of recognized digits, 0 for blanks
+        solver (str): name of the solving engine, see models.solver.SOLVERS
+        cache (ResultCache): cache to look the grid up in and store it to
+        time_budget (float): seconds the solver may take before giving up
+            with STATUS_TIMEOUT, None for no limit
+
+    Returns
+    -------
+        solution (np.ndarray): NxN matrix of the solved puzzle
+        status (int): solver status, one of models.solver.STATUS_*
+    """
+
+    if cache is not None:
+        key, transform = pipeline.cache.grid_key(puzzle)
+        solution, status = cache.get_solution(key, transform)
+        if solution is not None:
+            return solution, status
+
+    engine = models.solver.get_solver(solver)(puzzle)
+    engine.solve(time_budget)
+
+    if cache is not None and engine.status != models.solver.STATUS_TIMEOUT:
+        cache.put_solution(key, transform, engine.solution, engine.status)
+
+    return engine.solution, engine.status
+
+
+def solve_puzzles(
+    puzzles: np.ndarray,
+    solver: str = "bitmask",
+    cache: pipeline.cache.ResultCache | None = None,
+    time_budget: float | None = SOLVE_BUDGET,
+) -> Tuple[list, list]:
+    """
+    Solves several recognized grids, all at once with the bitmask engine (see
+    models.solver.solve_batch), unless their solutions are cached.
+
+    Parameters
+    ----------
+        puzzles (np.ndarray): (n, N, N) array of recognized digits
+        solver (str): name of the solving engine, see models.solver.SOLVERS
+        cache (ResultCache): cache to look the grids up in and store them to
+        time_budget (float): seconds the solver may take per grid, see
+            solve_puzzle
+
+    Returns
+    -------
+        solutions (list): NxN solution of every grid
+        status (list): solver status of every grid
+    """
+
+    if solver != "bitmask":
+        solved = [solve_puzzle(p, solver, cache, time_budget) for p in puzzles]
+        return [s for s, _ in solved], [c for _, c in solved]
+
+    solutions, status = [None] * len(puzzles), [None] * len(puzzles)
+    keys = [None] * len(puzzles)
+    if cache is not None:
+        for idx, puzzle in enumerate(puzzles):
+            keys[idx] = pipeline.cache.grid_key(puzzle)
+            solutions[idx], status[idx] = cache.get_solution(*keys[idx])
+
+    todo = [idx for idx, solution in enumerate(solutions) if solution is None]
+    if todo:
+        solved, codes = models.solver.solve_batch(puzzles[todo], time_budget)
+        for idx, solution, code in zip(todo, solved, codes):
+            solutions[idx], status[idx] = solution, int(code)
+            if cache is not None and code != models.solver.STATUS_TIMEOUT:
+                cache.put_solution(*keys[idx], solution, code)
+
+    return solutions, status
+
+
+def check_uniqueness(
+    result: GridResult,
+    max_nodes: int = UNIQUENESS_NODES,
+    time_budget: float = UNIQUENESS_BUDGET,
+) -> bool | None:
+    """
+    Searches for a second solution of a solved puzzle. Proper puzzles have
+    exactly one, so another one usually means a digit was missed. Puzzles
+    found ambiguous are counted in the profile.
+
+    Parameters
+    ----------
+        result (GridResult): result of a solved puzzle, `unique` is set
+        max_nodes (int): most search nodes visited
+        time_budget (float): seconds to spend, 0 to not check at all
+
+    Returns
+    -------
+        unique (bool): whether the solution is the only one, None if the
+            budget ran out first
+    """
+
+    if time_budget <= 0 or max_nodes <= 0:
+        return None
+
+    with result.profile.stage("uniqueness"):
+        engine = models.solver.BitmaskSolver(result.puzzle)
+        count = engine.count_solutions(2, max_nodes, time_budget)
+
+    result.unique = None if count is None else count == 1
+    if result.unique is False:
+        result.profile.count("ambiguous_grids")
+
+    return result.unique
+
+
+def process_image(
+    image: np.ndarray,
+    model,
+    solver: str = "bitmask",
+    profiler: pipeline.profiling.Profiler | None = None,
+    max_candidates: int = MAX_CANDIDATES,
+    cell_mode: str = "contours",
+    blank_threshold: float = BLANK_THRESHOLD,
+    cache: pipeline.cache.ResultCache | None = None,
+    solve_budget: float = SOLVE_BUDGET,
+    max_corrections: int = MAX_CORRECTIONS,
+    repair_budget: float = REPAIR_BUDGET,
+    uniqueness_nodes: int = UNIQUENESS_NODES,
+    uniqueness_budget: float = UNIQUENESS_BUDGET,
+    size: int = GRID_SIZE,
+) -> GridResult:
+    """
+    Runs the full pipeline on an image: grid detection, digit recognition and
+    solving. The profile of the image is handed to the hooks registered with
+    pipeline.profiling.add_hook.
+
+    Parameters
+    ----------
+        image (np.ndarray): original BGR image
+        model: digit classifier with a Keras-like predict method
+        solver (str): name of the solving engine, see models.solver.SOLVERS
+        profiler (Profiler): profile to continue, e.g. with the time it took
+            to read the image
+        max_candidates (int): most grid candidates to warp, see find_grid
+        cell_mode (str): how cells are located, one of CELL_MODES
+        blank_threshold (float): most ink of a cell skipping the model, see
+            screen_blanks
+        cache (ResultCache): cache of solutions by recognized grid, if any
+        solve_budget (float): seconds the solver may spend, see solve_puzzle
+        max_corrections (int): most misread cells corrected, see
+            repair_puzzle
+        repair_budget (float): seconds spent looking for corrections
+        uniqueness_nodes (int): most search nodes visited looking for a
+            second solution, see check_uniqueness
+        uniqueness_budget (float): seconds spent looking for a second
+            solution
+        size (int): number of cells per side of the grid searched for
+
+    Returns
+    -------
+        result (GridResult): outcome of every stage that was reached
+    """
+
+    if profiler is None:
+        profiler = pipeline.profiling.Profiler()
+
+    resized, scale, thresh = preprocess(image, profiler)
+    result = GridResult(
+        image=resized, source=image, scale=scale, size=size, profile=profiler
+    )
+
+    if find_grid(resized, thresh, result, max_candidates, cell_mode):
+        result.puzzle = read_digits(result, model, blank_threshold)
+
+        with profiler.stage("solve"):
+            result.solution, result.status = solve_puzzle(
+                result.puzzle, solver, cache, solve_budget
+            )
+
+        if result.status == models.solver.STATUS_INFEASIBLE:
+            repair_puzzle(result, max_corrections, repair_budget)
+        elif result.solved:
+            check_uniqueness(result, uniqueness_nodes, uniqueness_budget)
+
+    pipeline.profiling.emit(profiler)
+
+    return result
+
+
+def process_grids(
+    image: np.ndarray,
+    model,
+    solver: str = "bitmask",
+    profiler: pipeline.profiling.Profiler | None = None,
+    max_candidates: int = MAX_CANDIDATES,
+    cell_mode: str = "contours",
+    blank_threshold: float = BLANK_THRESHOLD,
+    cache: pipeline.cache.ResultCache | None = None,
+    solve_budget: float = SOLVE_BUDGET,
+    max_corrections: int = MAX_CORRECTIONS,
+    repair_budget: float = REPAIR_BUDGET,
+    uniqueness_nodes: int = UNIQUENESS_NODES,
+    uniqueness_budget: float = UNIQUENESS_BUDGET,
+    size: int = GRID_SIZE,
+    max_grids: int | None = None,
+) -> list:
+    """
+    Runs the full pipeline on an image holding several grids, e.g. a
+    newspaper page. The image is preprocessed and its quadrilaterals found
+    once, the cells of every grid are classified with one model call and the
+    grids are solved together. The profile of the image, shared by its grids,
+    is handed to the pipeline.profiling hooks once.
+
+    Parameters
+    ----------
+        max_grids (int): most grids to solve, None for every grid found, see
+            find_grids
+        (the other parameters are those of process_image)
+
+    Returns
+    -------
+        grids (list): a GridResult per grid found, in reading order
+    """
+
+    if profiler is None:
+        profiler = pipeline.profiling.Profiler()
+
+    resized, scale, thresh = preprocess(image, profiler)
+    result = GridResult(
+        image=resized, source=image, scale=scale, size=size, profile=profiler
+    )
+
+    grids = find_grids(resized, thresh, result, max_grids, max_candidates, cell_mode)
+    if grids:
+        puzzles = read_grids(grids, model, blank_threshold)
+
+        with profiler.stage("solve"):
+            solutions, status = solve_puzzles(
+                np.array(puzzles), solver, cache, solve_budget
+            )
+
+        for grid, puzzle, solution, code in zip(grids, puzzles, solutions, status):
+            grid.puzzle, grid.solution, grid.status = puzzle, solution, code
+            if grid.status == models.solver.STATUS_INFEASIBLE:
+                repair_puzzle(grid, max_corrections, repair_budget)
+            elif grid.solved:
+                check_uniqueness(grid, uniqueness_nodes, uniqueness_budget)
+
+    pipeline.profiling.emit(profiler)
+
+    return grids
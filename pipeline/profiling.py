@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# stages of the pipeline in the order they run
+STAGES = (
+    "read",
+    "resize",
+    "threshold",
+    "find_quadrilaterals",
+    "rank_candidates",
+    "top_down_view",
+    "roi_threshold",
+    "find_cells",
+    "sort_cells",
+    "extract_cells",
+    "screen_blanks",
+    "predict",
+    "solve",
+    "repair",
+    "uniqueness",
+)
+
+# counters recorded along the way
+COUNTERS = (
+    "quad_candidates",
+    "candidates_ranked",
+    "candidates_pruned",
+    "candidates_warped",
+    "blank_cells",
+    "classified_cells",
+    "corrected_cells",
+    "ambiguous_grids",
+)
+
+# hooks called with the profile of every image that went through the pipeline
+_hooks = []
+
+
+class Profiler:
+    """
+    Records the wall time and number of calls of each pipeline stage, along
+    with counters such as the number of grid candidates that were warped.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.calls = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times the enclosed block as one call of a stage.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float, calls: int = 1):
+        """
+        Records time spent in a stage that was measured elsewhere, e.g. a
+        share of a model call made for several images.
+        """
+
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other: "Profiler"):
+        """
+        Adds the timings, calls and counters of another profile to this one.
+        """
+
+        for name, seconds in other.timings.items():
+            self.add(name, seconds, other.calls.get(name, 0))
+        for name, n in other.counters.items():
+            self.count(name, n)
+
+    def to_dict(self) -> dict:
+        """
+        Returns
+        -------
+            record (dict): timings in milliseconds, calls and counters
+        """
+
+        return {
+            "timings_ms": {k: round(v * 1000, 3) for k, v in self.timings.items()},
+            "calls": dict(self.calls),
+            "counters": dict(self.counters),
+        }
+
+    def report(self) -> str:
+        """
+        Formats a breakdown of the time spent in each stage as a table.
+        """
+
+        total = sum(self.timings.values())
+        names = [s for s in STAGES if s in self.timings]
+        names += [s for s in self.timings if s not in STAGES]
+
+        lines = [f"{'stage':<20}{'calls':>8}{'ms':>12}{'share':>8}"]
+        for name in names:
+            seconds = self.timings[name]
+            lines.append(
+                f"{name:<20}{self.calls[name]:>8}{seconds * 1000:>12.2f}"
+                f"{seconds / (total or 1.0):>8.1%}"
+            )
+        lines.append(f"{'total':<20}{'':>8}{total * 1000:>12.2f}")
+        lines += [f"{name:<20}{n:>8}" for name, n in self.counters.items()]
+
+        return "\n".join(lines)
+
+
+def add_hook(hook):
+    """
+    Registers a callable that receives the Profiler of every image processed
+    from now on.
+    """
+
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def emit(profiler: Profiler):
+    """
+    Hands the profile of a processed image to every registered hook.
+    """
+
+    for hook in _hooks:
+        hook(profiler)
+
+
+class PrometheusExporter:
+    """
+    Profiling hook that accumulates the profiles of all images and renders
+    them in the Prometheus text exposition format. If a path is given, the
+    file is rewritten after every image, e.g. for node_exporter's textfile
+    collector.
+
+    Parameters
+    ----------
+        path (str): file to keep up to date, None to only render on demand
+        prefix (str): prefix of every metric name
+    """
+
+    def __init__(self, path: str | None = None, prefix: str = "sudoku"):
+        self.path = path
+        self.prefix = prefix
+        self.images = 0
+        self.totals = Profiler()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def __call__(self, profiler: Profiler):
+        with self._lock:
+            self.images += 1
+            self.totals.merge(profiler)
+
+        if self.path is not None:
+            self.write()
+
+    def render(self, gauges: dict | None = None) -> str:
+        """
+        Parameters
+        ----------
+            gauges (dict): extra numeric values to export as gauges
+
+        Returns
+        -------
+            text (str): metrics in the Prometheus text exposition format
+        """
+
+        p = self.prefix
+
+        with self._lock:
+            lines = [
+                f"# HELP {p}_images_total Images processed.",
+                f"# TYPE {p}_images_total counter",
+                f"{p}_images_total {self.images}",
+                f"# HELP {p}_stage_seconds_total Time spent in each stage.",
+                f"# TYPE {p}_stage_seconds_total counter",
+            ]
+            lines += [
+                f'{p}_stage_seconds_total{{stage="{k}"}} {v:.6f}'
+                for k, v in self.totals.timings.items()
+            ]
+            lines += [
+                f"# HELP {p}_stage_calls_total Calls of each stage.",
+                f"# TYPE {p}_stage_calls_total counter",
+            ]
+            lines += [
+                f'{p}_stage_calls_total{{stage="{k}"}} {v}'
+                for k, v in self.totals.calls.items()
+            ]
+            for name, n in self.totals.counters.items():
+                lines += [f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {n}"]
+
+        for name, value in (gauges or {}).items():
+            lines += [f"# TYPE {p}_{name} gauge", f"{p}_{name} {value}"]
+
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        # replacing the file at once so scrapers never see it half written,
+        # one thread at a time and from a temporary file of this process, so
+        # concurrent writers never replace each other's file or leave an
+        # older rendering over a newer one
+        with self._write_lock:
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                f.write(self.render())
+            os.replace(temp_path, self.path)
@@ -0,0 +1,352 @@
+import json
+import os
+import socketserver
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pipeline.batching
+import pipeline.cache
+import pipeline.core
+import pipeline.profiling
+
+# threads answering requests beyond capacity with a 503
+REJECT_WORKERS = 2
+
+# seconds a rejected client gets to send its request and read the 503
+REJECT_TIMEOUT = 1.0
+
+
+class PooledServerMixIn:
+    """
+    Handles requests on a fixed pool of worker threads. At most `queue_size`
+    requests wait for a free worker, anything beyond that is rejected with a
+    503 so that latency stays bounded. Rejections are answered by a few
+    threads of their own, with a short socket timeout, and connections
+    arriving while those are busy too are closed without a response.
+    """
+
+    def __init__(self, *args, workers: int = 4, queue_size: int = 16, **kwargs):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._reject_pool = ThreadPoolExecutor(max_workers=REJECT_WORKERS)
+        self._reject_slots = threading.BoundedSemaphore(REJECT_WORKERS + queue_size)
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        if self._slots.acquire(blocking=False):
+            self._pool.submit(self._process_request_pooled, request, client_address)
+        elif self._reject_slots.acquire(blocking=False):
+            # rejecting off the accept loop, the request still has to be read
+            self._reject_pool.submit(self._reject_request, request, client_address)
+        else:
+            self.shutdown_request(request)
+
+    def _reject_request(self, request, client_address):
+        try:
+            request.settimeout(REJECT_TIMEOUT)
+            BusyRequestHandler(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._reject_slots.release()
+
+    def _process_request_pooled(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+        self._reject_pool.shutdown(wait=True)
+
+
+class SudokuHTTPServer(PooledServerMixIn, HTTPServer):
+    pass
+
+
+class SudokuUnixServer(PooledServerMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+class SudokuRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /solve with encoded image bytes as the body returns the recognized
+    grid, its solution, the grid geometry and the stage timings as JSON.
+    GET /health reports whether the server is up, GET /metrics returns the
+    pipeline metrics and GET /metrics/prometheus the same in the Prometheus
+    text format.
+    """
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self._send_json(200, self.server.process.metrics())
+        elif self.path == "/metrics/prometheus":
+            body = self.server.process.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/solve":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length)
+
+        key, result = self.server.process.lookup(data)
+        if result is not None:
+            self._send_json(200, result.to_dict())
+            return
+
+        profiler = pipeline.profiling.Profiler()
+        with profiler.stage("read"):
+            image = pipeline.core.decode_image(data)
+        if image is None:
+            self._send_json(400, {"error": "could not decode image"})
+            return
+
+        try:
+            result = self.server.process(image, profiler, key)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+
+        self._send_json(200, result.to_dict())
+
+    def address_string(self) -> str:
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _send_json(self, code: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class BusyRequestHandler(SudokuRequestHandler):
+    """
+    Answers any request with a 503 when the server is at capacity.
+    """
+
+    def do_GET(self):
+        self._send_json(503, {"error": "server busy"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send_json(503, {"error": "server busy"})
+
+
+class Pipeline:
+    """
+    Holds everything that is expensive to set up, so each request only pays
+    for detection, recognition and solving.
+
+    Cells of concurrent requests are classified together by a
+    BatchingPredictor, which is also the only thread to use the model. Stage
+    timings of every request are accumulated by a PrometheusExporter hook.
+    With a cache, images that were already solved are answered from it and
+    solutions of recognized grids are reused.
+
+    Parameters
+    ----------
+        model: digit classifier with a Keras-like predict method
+        solver (str): name of the solving engine, see models.solver.SOLVERS
+        max_batch_size (int): maximum number of cells per predict call
+        max_wait (float): seconds a request waits for others to join its batch
+        max_queue (int): requests allowed to wait for classification
+        max_candidates (int): most grid candidates warped per image
+        cell_mode (str): how cells are located, see pipeline.core.CELL_MODES
+        blank_threshold (float): most ink of a cell skipping the model
+        cache (ResultCache): cache of results by image and solutions by grid
+        solve_budget (float): seconds the solver may spend per puzzle
+        max_corrections (int): most misread cells corrected per puzzle
+        repair_budget (float): seconds spent looking for corrections
+        uniqueness_nodes (int): most search nodes visited looking for a
+            second solution
+        uniqueness_budget (float): seconds spent looking for a second solution
+        size (int): number of cells per side of the grids searched for
+    """
+
+    def __init__(
+        self,
+        model,
+        solver: str = "bitmask",
+        max_batch_size: int = 512,
+        max_wait: float = 0.005,
+        max_queue: int = 64,
+        max_candidates: int = pipeline.core.MAX_CANDIDATES,
+        cell_mode: str = "contours",
+        blank_threshold: float = pipeline.core.BLANK_THRESHOLD,
+        cache: pipeline.cache.ResultCache | None = None,
+        solve_budget: float = pipeline.core.SOLVE_BUDGET,
+        max_corrections: int = pipeline.core.MAX_CORRECTIONS,
+        repair_budget: float = pipeline.core.REPAIR_BUDGET,
+        uniqueness_nodes: int = pipeline.core.UNIQUENESS_NODES,
+        uniqueness_budget: float = pipeline.core.UNIQUENESS_BUDGET,
+        size: int = pipeline.core.GRID_SIZE,
+    ):
+        self.model = pipeline.batching.BatchingPredictor(
+            model, max_batch_size, max_wait, max_queue
+        )
+        self.solver = solver
+        self.max_candidates = max_candidates
+        self.cell_mode = cell_mode
+        self.blank_threshold = blank_threshold
+        self.cache = cache
+        self.solve_budget = solve_budget
+        self.max_corrections = max_corrections
+        self.repair_budget = repair_budget
+        self.uniqueness_nodes = uniqueness_nodes
+        self.uniqueness_budget = uniqueness_budget
+        self.size = size
+        self.exporter = pipeline.profiling.PrometheusExporter()
+        pipeline.profiling.add_hook(self.exporter)
+
+    def __call__(self, image, profiler=None, key: str | None = None):
+        result = pipeline.core.process_image(
+            image,
+            self.model,
+            solver=self.solver,
+            profiler=profiler,
+            max_candidates=self.max_candidates,
+            cell_mode=self.cell_mode,
+            blank_threshold=self.blank_threshold,
+            cache=self.cache,
+            solve_budget=self.solve_budget,
+            max_corrections=self.max_corrections,
+            repair_budget=self.repair_budget,
+            uniqueness_nodes=self.uniqueness_nodes,
+            uniqueness_budget=self.uniqueness_budget,
+            size=self.size,
+        )
+
+        if key is not None:
+            self.cache.put("images", key, result.to_dict())
+
+        return result
+
+    def lookup(self, data: bytes) -> tuple:
+        """
+        Looks encoded image bytes up in the cache.
+
+        Returns
+        -------
+            key (str): key to store the result of the image under, None
+                without a cache
+            result (GridResult): cached result, None on a miss
+        """
+
+        if self.cache is None:
+            return None, None
+
+        key = pipeline.cache.image_key(data)
+        record = self.cache.get("images", key)
+
+        if record is None:
+            return key, None
+
+        return key, pipeline.core.GridResult.from_dict(record)
+
+    def metrics(self) -> dict:
+        return {
+            "images": self.exporter.images,
+            "blank_threshold": self.blank_threshold,
+            "stages": self.exporter.totals.to_dict(),
+            "ocr_batching": self.model.metrics(),
+            "cache": {} if self.cache is None else self.cache.metrics(),
+        }
+
+    def prometheus(self) -> str:
+        batching = self.model.metrics()
+        gauges = {"ocr_batching_" + k: v for k, v in batching.items()}
+        gauges["blank_threshold"] = self.blank_threshold
+        if self.cache is not None:
+            gauges.update({"cache_" + k: v for k, v in self.cache.metrics().items()})
+
+        return self.exporter.render(gauges)
+
+    def close(self):
+        pipeline.profiling.remove_hook(self.exporter)
+        self.model.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def make_server(
+    pipe: Pipeline,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    socket_path: str | None = None,
+    workers: int = 4,
+    queue_size: int = 16,
+):
+    """
+    Creates a server for the pipeline, listening on a unix socket if a path is
+    given and on TCP otherwise.
+
+    Parameters
+    ----------
+        pipe (Pipeline): pipeline every request is run through
+        host (str): address to listen on
+        port (int): TCP port to listen on
+        socket_path (str): path of a unix socket to listen on instead
+        workers (int): number of requests processed concurrently
+        queue_size (int): number of requests allowed to wait for a worker
+
+    Returns
+    -------
+        server (socketserver.BaseServer): server, not yet serving
+    """
+
+    pool = {"workers": workers, "queue_size": queue_size}
+
+    if socket_path is None:
+        server = SudokuHTTPServer((host, port), SudokuRequestHandler, **pool)
+    else:
+        # clearing a socket left behind by a previous run
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)
+        server = SudokuUnixServer(socket_path, SudokuRequestHandler, **pool)
+
+    server.process = pipe
+
+    return server
+
+
+def serve(pipe: Pipeline, **kwargs):
+    """
+    Serves the pipeline until interrupted. Keyword arguments are passed to
+    make_server.
+    """
+
+    server = make_server(pipe, **kwargs)
+    address = kwargs.get("socket_path") or "http://%s:%d" % server.server_address[:2]
+    print("Serving on", address)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pipe.close()
@@ -0,0 +1,215 @@
+import cv2
+import numpy as np
+
+import imageproc.utils
+import pipeline.core
+
+
+def annotate(result: pipeline.core.GridResult) -> np.ndarray | None:
+    """
+    Draws the outcome of the pipeline onto the top-down view of the grid: the
+    solved digits if the puzzle was solved, the recognized digits if it wasn't,
+    and the cell contours of the best candidate if no grid was found.
+
+    Parameters
+    ----------
+        result (GridResult): result of pipeline.core.process_image
+
+    Returns
+    -------
+        annotated (np.ndarray): annotated copy of the top-down view, None if
+            there was no grid candidate at all
+    """
+
+    if result.roi is None:
+        return None
+
+    if not result.found:
+        return cv2.drawContours(
+            result.roi.copy(), result.cell_contours, -1, (0, 255, 0), 2
+        )
+
+    mode = "solution" if result.solved else "starting_values"
+
+    return imageproc.utils.write_text(
+        result.roi.copy(), result.puzzle, result.solution, result.cell_centers, mode
+    )
+
+
+def draw_grid(
+    image: np.ndarray,
+    result: pipeline.core.GridResult,
+    corners: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Draws the outline of a found grid and its solved digits, or the
+    recognized ones if it wasn't solved, onto the image the grid was found in,
+    in perspective.
+
+    Parameters
+    ----------
+        image (np.ndarray): BGR image, drawn on in place
+        result (GridResult): result of a found grid
+        corners (np.ndarray): where the grid is in the image if not at
+            `result.corners`, e.g. after it moved in a video
+
+    Returns
+    -------
+        image (np.ndarray): the annotated image
+    """
+
+    corners = result.corners if corners is None else corners
+    corners = np.asarray(corners, dtype="float32")
+    color = (0, 255, 0) if result.solved else (0, 0, 255)
+    cv2.polylines(image, [corners[[0, 1, 3, 2]].astype("int32")], True, color, 2)
+
+    if not result.cell_centers or result.puzzle is None:
+        return image
+
+    # cell centers of the top-down view, moved into the image
+    homography = cv2.getPerspectiveTransform(pipeline.core.VIEW_CORNERS, corners)
+    centers = np.array(result.cell_centers, dtype="float32").reshape((-1, 1, 2))
+    centers = cv2.perspectiveTransform(centers, homography).reshape((-1, 2))
+
+    # text is sized to the cells as they appear in the image
+    cell = np.linalg.norm(corners[1] - corners[0]) / result.size
+    font_scale = cell / 45
+    thickness = max(1, int(cell / 15))
+
+    puzzle = result.puzzle.flatten()
+    values = result.solution.flatten() if result.solved else puzzle
+    for given, value, (x, y) in zip(puzzle, values, centers):
+        if value == 0 or (result.solved and given != 0):
+            continue
+        text = str(value) if value < 10 else chr(ord("A") + value - 10)
+        (w, h), _ = cv2.getTextSize(
+            text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness
+        )
+        cv2.putText(
+            image,
+            text,
+            (int(x - w / 2), int(y + h / 2)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            font_scale,
+            (255, 0, 0),
+            thickness,
+        )
+
+    return image
+
+
+def annotate_grids(image: np.ndarray, results: list) -> np.ndarray:
+    """
+    Draws every grid of pipeline.core.process_grids onto a copy of the
+    original image, see draw_grid.
+    """
+
+    annotated = image.copy()
+    for result in results:
+        draw_grid(annotated, result)
+
+    return annotated
+
+
+def render(result: pipeline.core.GridResult) -> dict:
+    """
+    Produces the images shown for a result, keyed by window name.
+    """
+
+    annotated = annotate(result)
+    if annotated is None:
+        return {}
+
+    if not result.found:
+        return {
+            "Region of Interest": result.roi,
+            "Region of Interest - Thresholded": result.roi_thresh,
+            "Region of Interest - Contours": annotated,
+        }
+
+    if not result.solved:
+        return {"Thresholded": result.roi_thresh, "Predicted Digits": annotated}
+
+    return {"Original Image": result.image, "Solved Puzzle": annotated}
+
+
+class DisplaySink:
+    """
+    Shows the result in windows and waits for a key press. Every grid of an
+    image is shown at once by `grids`.
+    """
+
+    def __call__(self, result: pipeline.core.GridResult):
+        windows = render(result)
+        for name, image in windows.items():
+            cv2.imshow(name, image)
+
+        if windows:
+            cv2.waitKey()
+
+    def grids(self, image: np.ndarray, results: list):
+        cv2.imshow("Solved Puzzles", annotate_grids(image, results))
+        cv2.waitKey()
+
+
+class FileSink:
+    """
+    Writes the annotated top-down view to an image file, or the original image
+    with every grid drawn on it for `grids`.
+
+    Parameters
+    ----------
+        path (str): file to write, its extension decides the format
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __call__(self, result: pipeline.core.GridResult):
+        annotated = annotate(result)
+        if annotated is not None:
+            cv2.imwrite(self.path, annotated)
+
+    def grids(self, image: np.ndarray, results: list):
+        cv2.imwrite(self.path, annotate_grids(image, results))
+
+
+class NullSink:
+    """
+    Discards the result, nothing is drawn.
+    """
+
+    def __call__(self, result: pipeline.core.GridResult):
+        pass
+
+    def grids(self, image: np.ndarray, results: list):
+        pass
+
+
+# visualization sinks selectable by name
+SINKS = {"display": DisplaySink, "file": FileSink, "none": NullSink}
+
+
+def get_sink(name: str, path: str | None = None):
+    """
+    Creates a visualization sink by name.
+
+    Parameters
+    ----------
+        name (str): one of the keys of SINKS
+        path (str): output file of the file sink
+
+    Returns
+    -------
+        sink: callable taking a GridResult
+    """
+
+    if name not in SINKS:
+        raise ValueError(f"Sink must be one of {', '.join(SINKS)}")
+
+    if name == "file":
+        if path is None:
+            raise ValueError("The file sink needs an output path")
+        return FileSink(path)
+
+    return SINKS[name]()
@@ -0,0 +1,415 @@
+import time
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+
+import imageproc.transforms
+import imageproc.utils
+import pipeline.core
+import pipeline.profiling
+import pipeline.sinks
+
+# pyramidal Lucas-Kanade parameters, the window is in tracking pixels
+FLOW_WINDOW = (21, 21)
+FLOW_LEVELS = 3
+
+# most forward-backward error, in tracking pixels, of a point still tracked
+MAX_FLOW_ERROR = 1.0
+
+# share of the grid line crossings that must be tracked to keep the grid
+MIN_TRACKED = 0.5
+
+# frames between checks that the digits of a tracked grid are unchanged
+VERIFY_INTERVAL = 15
+
+# share of the cell side trimmed off every side of a cell when checking for
+# digits, so grid lines that are a little off don't count as ink
+VERIFY_INSET = 0.15
+
+# share of the ink of the median digit a cell must gain or lose to count as
+# changed, noise and print-through from the back of the page are much fainter
+MIN_INK_CHANGE = 0.5
+
+# most cells that may change before the grid is taken as changed
+MAX_CHANGED_CELLS = 2
+
+# frames between full searches while no grid is tracked
+SEARCH_INTERVAL = 1
+
+
+@dataclass
+class FrameResult:
+    """
+    Outcome of a single video frame.
+
+    Attributes
+    ----------
+        index (int): position of the frame in the stream
+        tracked (bool): whether the grid was followed from the previous frame
+        searched (bool): whether the full pipeline ran on the frame, which
+            hands the profile to the pipeline.profiling hooks itself
+        corners (np.ndarray): grid corners in the frame, sorted left-to-right,
+            top-to-bottom, None if there is no grid
+        grid (GridResult): result of the full search the grid was found by,
+            holding the digits and the solution, None if there is no grid
+        profile (Profiler): time spent on the frame in each stage
+    """
+
+    index: int
+    tracked: bool = False
+    searched: bool = False
+    corners: np.ndarray | None = None
+    grid: pipeline.core.GridResult | None = None
+    profile: pipeline.profiling.Profiler = field(
+        default_factory=pipeline.profiling.Profiler
+    )
+
+    @property
+    def found(self) -> bool:
+        return self.corners is not None
+
+
+class GridTracker:
+    """
+    Follows a grid through the frames of a video so the full search runs only
+    when needed. Once a grid is found, the crossings of its lines are tracked
+    with pyramidal Lucas-Kanade optical flow, and the homography between the
+    top-down view and the frame is refitted to the points that survive a
+    forward-backward check. The grid is lost, and searched for again, when
+    too few points survive or the fitted grid is implausible.
+
+    The digits and the solution of a tracked grid are reused. Every
+    `verify_interval` frames, the grid is warped with the tracked corners and
+    the ink in the middle of its cells measured. If more than a couple of
+    cells gained or lost about half a digit of ink since the grid was read,
+    the grid is searched for again, e.g. because the page was swapped in
+    place.
+
+    Parameters
+    ----------
+        process: callable running the full pipeline on a frame, with the
+            signature of pipeline.core.process_image once bound to a model
+        size (int): number of cells per side of the grid
+        track_width (int): width frames are resized to for tracking
+        verify_interval (int): frames between checks of the digits, 0 to
+            never check
+        search_interval (int): frames between full searches while no grid
+            is tracked
+    """
+
+    def __init__(
+        self,
+        process,
+        size: int = pipeline.core.GRID_SIZE,
+        track_width: int = pipeline.core.IMAGE_WIDTH,
+        verify_interval: int = VERIFY_INTERVAL,
+        search_interval: int = SEARCH_INTERVAL,
+    ):
+        self.process = process
+        self.size = size
+        self.track_width = track_width
+        self.verify_interval = verify_interval
+        self.search_interval = search_interval
+
+        # grid line crossings in the top-down view, tracked between frames
+        ticks = (
+            pipeline.core.VIEW_MARGIN
+            + pipeline.core.VIEW_SIDE * np.arange(size + 1) / size
+        )
+        self.view_points = np.stack(np.meshgrid(ticks, ticks), axis=-1)
+        self.view_points = self.view_points.reshape((-1, 1, 2)).astype("float32")
+
+        self.frames = 0
+        self.searches = 0
+        self.losses = 0
+        self._reset()
+
+    def __call__(self, frame: np.ndarray) -> FrameResult:
+        """
+        Parameters
+        ----------
+            frame (np.ndarray): BGR frame
+
+        Returns
+        -------
+            result (FrameResult): grid of the frame, if any
+        """
+
+        result = FrameResult(index=self.frames)
+        profiler = result.profile
+        self.frames += 1
+
+        with profiler.stage("track"):
+            scale = min(1.0, self.track_width / frame.shape[1])
+            grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if scale < 1.0:
+                grey = cv2.resize(
+                    grey, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+                )
+
+            tracked = self.grid is not None and self._track(grey, scale)
+
+        if tracked and self.verify_interval and result.index >= self._verify_at:
+            with profiler.stage("verify"):
+                tracked = self._unchanged(frame)
+            self._verify_at = result.index + self.verify_interval
+
+        if self.grid is not None and not tracked:
+            self.losses += 1
+            self._reset()
+
+        result.tracked = tracked
+        if not tracked and result.index >= self._search_at:
+            result.searched = True
+            self._search(frame, scale, profiler)
+            self._search_at = result.index + self.search_interval
+
+        self._grey = grey
+        if self.grid is not None:
+            result.grid = self.grid
+            result.corners = self._corners(self.homography)
+
+        return result
+
+    def _reset(self):
+        self.grid = None
+        self.homography = None
+        self._points = None
+        self._grey = None
+        self._ink_read = None
+        self._ink_step = None
+        self._search_at = 0
+        self._verify_at = 0
+
+    def _search(self, frame: np.ndarray, scale: float, profiler):
+        """
+        Runs the full pipeline on a frame and starts tracking the grid it
+        finds, if any.
+        """
+
+        self.searches += 1
+        grid = self.process(frame, profiler=profiler)
+        if not grid.found:
+            return
+
+        corners = grid.corners.astype("float32")
+
+        self.grid = grid
+        self.homography = cv2.getPerspectiveTransform(
+            pipeline.core.VIEW_CORNERS, corners
+        )
+        self._points = self._project(scale)
+        self._ink_read = self._ink(grid.roi_thresh)
+        digits = self._ink_read[grid.puzzle.flatten() > 0]
+        self._ink_step = MIN_INK_CHANGE * np.median(digits) if len(digits) else 1.0
+        self._verify_at = self.frames - 1 + self.verify_interval
+
+    def _track(self, grey: np.ndarray, scale: float) -> bool:
+        """
+        Moves the grid points from the previous frame to this one and refits
+        the homography to those tracked reliably.
+
+        Returns
+        -------
+            tracked (bool): whether the grid is still followed
+        """
+
+        flow = {"winSize": FLOW_WINDOW, "maxLevel": FLOW_LEVELS}
+        points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self._grey, grey, self._points, None, **flow
+        )
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(
+            grey, self._grey, points, None, **flow
+        )
+
+        # points that don't flow back to where they came from drifted
+        error = np.linalg.norm((back - self._points).reshape((-1, 2)), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1)
+        good &= error < MAX_FLOW_ERROR
+        if good.sum() < MIN_TRACKED * len(good):
+            return False
+
+        homography, inliers = cv2.findHomography(
+            self.view_points[good], points[good] / scale, cv2.RANSAC, 3.0 / scale
+        )
+        if homography is None or inliers.sum() < MIN_TRACKED * len(good):
+            return False
+
+        corners = self._corners(homography)[[0, 1, 3, 2]].reshape((4, 1, 2))
+        area = cv2.contourArea(corners) * scale**2
+        if not cv2.isContourConvex(corners) or (
+            area < pipeline.core.MIN_GRID_AREA * grey.shape[0] * grey.shape[1]
+        ):
+            return False
+
+        # points that were dropped are put back where the grid says they are
+        self.homography = homography
+        self._points = self._project(scale)
+
+        return True
+
+    def _unchanged(self, frame: np.ndarray) -> bool:
+        """
+        Warps the tracked grid and checks that its cells hold ink where they
+        did when the grid was read.
+        """
+
+        roi = imageproc.transforms.top_down_view(
+            frame,
+            self._corners(self.homography),
+            pipeline.core.VIEW_MARGIN,
+            pipeline.core.VIEW_SIDE,
+        )
+        _, _, roi_thresh = imageproc.utils.grey_blur_threshold(
+            roi, (3, 3), cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 57, 5
+        )
+
+        # a cell or two may flicker with glare, a new page changes many
+        change = np.abs(self._ink(roi_thresh) - self._ink_read)
+        changed = np.count_nonzero(change > self._ink_step)
+
+        return changed <= MAX_CHANGED_CELLS
+
+    def _ink(self, roi_thresh: np.ndarray) -> np.ndarray:
+        # share of every cell covered by ink, away from the cell borders
+        inset = int(VERIFY_INSET * pipeline.core.VIEW_SIDE / self.size)
+        digits = imageproc.utils.extract_cell_batch(
+            roi_thresh, self.grid.cell_bboxes, offset=inset
+        )
+
+        return digits.reshape((len(digits), -1)).mean(axis=1)
+
+    def _project(self, scale: float) -> np.ndarray:
+        # grid points in tracking pixels
+        points = cv2.perspectiveTransform(self.view_points, self.homography)
+
+        return (points * scale).astype("float32")
+
+    def _corners(self, homography: np.ndarray) -> np.ndarray:
+        # corners of the grid in the frame
+        corners = cv2.perspectiveTransform(
+            pipeline.core.VIEW_CORNERS[:, None], homography
+        )
+
+        return corners.reshape((4, 2))
+
+
+def overlay(frame: np.ndarray, result: FrameResult) -> np.ndarray:
+    """
+    Draws the grid of a frame onto it, see pipeline.sinks.draw_grid.
+    """
+
+    if not result.found:
+        return frame
+
+    return pipeline.sinks.draw_grid(frame, result.grid, result.corners)
+
+
+def open_capture(source: str) -> cv2.VideoCapture:
+    """
+    Opens a video file, or a camera if the source is a device index or a
+    device path such as /dev/video0.
+
+    Raises
+    ------
+        ValueError: if the source can't be opened
+    """
+
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source: {source}")
+
+    return capture
+
+
+def run(capture: cv2.VideoCapture, tracker: GridTracker, sink=None) -> dict:
+    """
+    Feeds every frame of a capture through the tracker until the stream ends
+    or the sink asks to stop. The profile of every frame is handed to the
+    pipeline.profiling hooks.
+
+    Parameters
+    ----------
+        capture (cv2.VideoCapture): stream of frames
+        tracker (GridTracker): tracker to run on each frame
+        sink: callable taking the frame and its FrameResult, returning False
+            to stop, e.g. VideoDisplaySink, None to only track
+
+    Returns
+    -------
+        stats (dict): frames processed, full searches, grids lost and the
+            average frames per second, excluding decoding
+    """
+
+    elapsed = 0.0
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+
+        start = time.perf_counter()
+        result = tracker(frame)
+        keep_going = True
+        if sink is not None:
+            with result.profile.stage("overlay"):
+                keep_going = sink(frame, result)
+        elapsed += time.perf_counter() - start
+
+        # searched frames were handed over by the pipeline already
+        if not result.searched:
+            pipeline.profiling.emit(result.profile)
+
+        if not keep_going:
+            break
+
+    return {
+        "frames": tracker.frames,
+        "searches": tracker.searches,
+        "lost": tracker.losses,
+        "fps": round(tracker.frames / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+class VideoDisplaySink:
+    """
+    Shows the annotated frames in a window, stopping when q is pressed.
+    """
+
+    def __call__(self, frame: np.ndarray, result: FrameResult) -> bool:
+        cv2.imshow("Sudoku", overlay(frame, result))
+
+        return cv2.waitKey(1) & 0xFF != ord("q")
+
+
+class VideoFileSink:
+    """
+    Writes the annotated frames to a video file, opened on the first frame.
+
+    Parameters
+    ----------
+        path (str): file to write
+        fps (float): frame rate of the output
+        fourcc (str): codec of the output, MJPG fits .avi files
+    """
+
+    def __init__(self, path: str, fps: float = 25.0, fourcc: str = "MJPG"):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self.writer = None
+
+    def __call__(self, frame: np.ndarray, result: FrameResult) -> bool:
+        if self.writer is None:
+            height, width = frame.shape[:2]
+            code = cv2.VideoWriter_fourcc(*self.fourcc)
+            self.writer = cv2.VideoWriter(self.path, code, self.fps, (width, height))
+
+        self.writer.write(overlay(frame, result))
+
+        return True
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
@@ -1,34 +1,27 @@
 import numpy as np
 import pandas as pd
 
+import models.dataset
+
 N_RECORDS = 1495
-N_FEATURES = 28 * 28
-P = 0.20  # probability of noise pixel
-BLACK_PIXEL = 255
-WHITE_PIXEL = 0
+SOURCE = "data/training/TMNIST_raw.csv"
+OUTPUT = "data/training/tmnist"
 
-# reading in data
-digits = pd.read_csv("data/training/TMNIST_raw.csv").drop(columns="names")
+# reading in data, pixels straight into uint8
+digits = pd.read_csv(SOURCE, usecols=lambda column: column != "names", dtype="uint8")
 
 # dropping zeros to be replaced with blank cells
 digits = digits[digits["labels"] != 0]
+labels = digits["labels"].to_numpy()
+cells = digits.drop(columns="labels").to_numpy().reshape((-1, 28, 28))
 
-# creating dataframe of blank cells, will be label 0
-# 1 column for the label (0), rest for features
-records_for_blanks = [[0] * N_RECORDS for _ in range(N_FEATURES + 1)]
-data_dict = dict(zip(digits.columns.tolist(), records_for_blanks))
-blank_cells = pd.DataFrame(data_dict, columns=digits.columns)
-
-# mask that determines which pixels will be noise pixels
-mask = np.random.binomial(1, P, size=(N_RECORDS, N_FEATURES)).astype(bool)
-cell_values = np.where(mask, BLACK_PIXEL, WHITE_PIXEL)
-cell_labels = np.zeros((N_RECORDS, 1))
-noisy_cells = pd.DataFrame(
-    np.concatenate((cell_labels, cell_values), axis=1), columns=digits.columns
-)
+# blank cells are label 0, half of them get noise while training, see
+# models.dataset.augment
+blanks = np.zeros((2 * N_RECORDS, 28, 28), dtype="uint8")
 
-# combining original data set with dummy dataset
-result = pd.concat([digits, blank_cells, noisy_cells], ignore_index=True)
+# writing uint8 shards and their manifest
+with models.dataset.ShardWriter(OUTPUT, metadata={"source": SOURCE}) as writer:
+    writer.write(cells, labels)
+    writer.write(blanks, np.zeros(len(blanks), dtype="uint8"))
 
-# writing file
-result.to_csv("data/training/TMNIST_processed.csv", index=False)
+print(f"Wrote {writer.count} cells to {OUTPUT}")
@@ -0,0 +1,165 @@
+import argparse
+import glob
+import sys
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Conv2D, Dense
+from tensorflow.keras.models import load_model
+
+import models.ocr
+import pipeline.core
+
+# constants
+OPSET = 13
+PUZZLES = "data/puzzles/*.jpg"
+FORMATS = ("tflite", "onnx", "numpy")
+
+
+def puzzle_cells() -> np.ndarray:
+    """
+    Collects the cells of every grid found in the sample puzzles, used for
+    calibrating quantization and checking the exported model.
+    """
+
+    cells = []
+    for path in sorted(glob.glob(PUZZLES)):
+        image = cv2.imread(path)
+        resized, scale, thresh = pipeline.core.preprocess(image)
+        result = pipeline.core.GridResult(image=resized, source=image, scale=scale)
+        if pipeline.core.find_grid(resized, thresh, result):
+            cells.append(pipeline.core.extract_digits(result))
+
+    return np.concatenate(cells).astype("float32")
+
+
+def export_tflite(model, path: str, cells: np.ndarray, quantize: bool = False):
+    """
+    Converts a Keras model to TFLite, with int8 weights, activations, inputs
+    and outputs if `quantize` is set, calibrated on `cells`.
+    """
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize:
+
+        def representative_dataset():
+            for cell in cells:
+                yield [cell[None]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, path: str, cells: np.ndarray, quantize: bool = False):
+    """
+    Converts a Keras model to ONNX with tf2onnx, statically quantized to int8
+    if `quantize` is set, calibrated on `cells`.
+    """
+
+    import tf2onnx
+
+    signature = [tf.TensorSpec((None,) + model.input_shape[1:], tf.float32)]
+    model_proto, _ = tf2onnx.convert.from_keras(
+        model, signature, opset=OPSET, output_path=path
+    )
+
+    if quantize:
+        from onnxruntime import quantization
+
+        class CellReader(quantization.CalibrationDataReader):
+            def __init__(self):
+                self.input_name = model_proto.graph.input[0].name
+                self.cells = iter(cells)
+
+            def get_next(self):
+                cell = next(self.cells, None)
+                return None if cell is None else {self.input_name: cell[None]}
+
+        # static QDQ quantization, the CPU runtime lacks integer convolutions
+        quantization.quantize_static(
+            path,
+            path,
+            CellReader(),
+            quant_format=quantization.QuantFormat.QDQ,
+            activation_type=quantization.QuantType.QInt8,
+            weight_type=quantization.QuantType.QInt8,
+        )
+
+
+def export_numpy(model, path: str):
+    """
+    Saves the weights of a digitnet-like Keras model for the numpy backend.
+    """
+
+    # weights are saved in layer order, which is all the numpy backend needs
+    conv_layers = [layer for layer in model.layers if isinstance(layer, Conv2D)]
+    dense_layer = [layer for layer in model.layers if isinstance(layer, Dense)][-1]
+
+    weights = {}
+    for i, layer in enumerate(conv_layers):
+        weights[f"conv{i}_kernel"], weights[f"conv{i}_bias"] = layer.get_weights()
+    weights["dense_kernel"], weights["dense_bias"] = dense_layer.get_weights()
+
+    np.savez(path, **weights)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--name", "-n", help="Name of saved model.", required=True)
+    parser.add_argument(
+        "--format",
+        "-f",
+        required=True,
+        choices=FORMATS,
+        help="Format to export to, matching an --ocr-backend of the solver.",
+    )
+    parser.add_argument(
+        "--quantize",
+        "-q",
+        action="store_true",
+        help="Quantize weights and activations to int8 (tflite and onnx only).",
+    )
+    parser.add_argument(
+        "--min-agreement",
+        type=float,
+        default=0.99,
+        help="Fail if fewer predictions than this agree with the Keras model.",
+    )
+    args = parser.parse_args()
+
+    if args.format == "numpy" and args.quantize:
+        parser.error("--quantize is not supported for the numpy format")
+
+    model = load_model(models.ocr.MODEL_DIR + args.name)
+    cells = puzzle_cells()
+    path = models.ocr.MODEL_DIR + args.name + models.ocr.MODEL_SUFFIXES[args.format]
+
+    if args.format == "tflite":
+        export_tflite(model, path, cells, args.quantize)
+    elif args.format == "onnx":
+        export_onnx(model, path, cells, args.quantize)
+    else:
+        export_numpy(model, path)
+
+    # checking the exported model against the keras model
+    expected = model.predict(cells, verbose=0)
+    exported = models.ocr.load_backend(args.name, args.format).predict(cells)
+    agreement = (expected.argmax(axis=1) == exported.argmax(axis=1)).mean()
+
+    print("Cells compared:", len(cells))
+    print("Prediction agreement:", agreement)
+    print("Max probability difference:", np.abs(expected - exported).max())
+
+    if agreement < args.min_agreement:
+        sys.exit("Exported model disagrees with the Keras model")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import benchmarks.synthetic
+import imageproc.utils
+import models.dataset
+import models.solver
+import pipeline.core
+
+# printed faces of the built-in fonts, each also drawn in italics
+HERSHEY_FACES = (
+    cv2.FONT_HERSHEY_SIMPLEX,
+    cv2.FONT_HERSHEY_PLAIN,
+    cv2.FONT_HERSHEY_DUPLEX,
+    cv2.FONT_HERSHEY_COMPLEX,
+    cv2.FONT_HERSHEY_TRIPLEX,
+    cv2.FONT_HERSHEY_COMPLEX_SMALL,
+)
+
+# TrueType fonts picked up unless --fonts is given
+DEFAULT_FONTS = "/usr/share/fonts/**/*.ttf"
+
+# most distance between the detected and the rendered corners, relative to
+# the grid side, for the cells to be labelled by the rendered puzzle
+MAX_CORNER_ERROR = 0.03
+
+
+def list_fonts(patterns: list) -> list:
+    """
+    Lists the fonts digits are drawn in: every built-in Hershey face and the
+    TrueType files matching the patterns, which need Pillow.
+
+    Returns
+    -------
+        fonts (list): ("hershey", face) and ("truetype", path) specs, cheap to
+            send to the workers, which load the fonts themselves
+    """
+
+    fonts = [("hershey", face) for face in HERSHEY_FACES]
+    fonts += [("hershey", face | cv2.FONT_ITALIC) for face in HERSHEY_FACES]
+
+    paths = sorted(
+        p for pattern in patterns for p in glob.glob(pattern, recursive=True)
+    )
+    if paths:
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            print("Pillow is not installed, skipping TrueType fonts", file=sys.stderr)
+            paths = []
+
+    return fonts + [("truetype", path) for path in paths]
+
+
+def draw_glyph(font: tuple, digit: int, height: int, weight: float) -> np.ndarray:
+    """
+    Draws a digit as an ink mask cropped to its bounding box.
+
+    Parameters
+    ----------
+        font (tuple): spec from list_fonts
+        digit (int): digit to draw
+        height (int): height of the digit in pixels
+        weight (float): stroke width relative to the height, Hershey only
+
+    Returns
+    -------
+        glyph (np.ndarray): uint8 mask, ink as 255
+    """
+
+    canvas = np.zeros((3 * height, 3 * height), dtype="uint8")
+    if font[0] == "hershey":
+        thickness = max(1, int(round(weight * height)))
+        (_, h), _ = cv2.getTextSize(str(digit), font[1], 1.0, thickness)
+        scale = height / max(h, 1)
+        cv2.putText(
+            canvas,
+            str(digit),
+            (height // 2, 2 * height),
+            font[1],
+            scale,
+            255,
+            thickness,
+            cv2.LINE_AA,
+        )
+    else:
+        from PIL import Image, ImageDraw, ImageFont
+
+        # digits are about 0.7 of the font size
+        image = Image.fromarray(canvas)
+        face = ImageFont.truetype(font[1], int(height / 0.7))
+        ImageDraw.Draw(image).text((height // 2, height // 2), str(digit), 255, face)
+        canvas = np.asarray(image)
+
+    ys, xs = np.nonzero(canvas)
+    if not len(ys):
+        return canvas[:height, :height]
+
+    return canvas[ys.min() : ys.max() + 1, xs.min() : xs.max() + 1]
+
+
+def render_page(rng: np.random.Generator, fonts: list, puzzle: np.ndarray) -> tuple:
+    """
+    Renders a printed puzzle on a sheet of paper, as seen from straight above.
+
+    Returns
+    -------
+        page (np.ndarray): BGR image of the sheet
+        corners (np.ndarray): (4, 2) outer corners of the grid on the sheet
+    """
+
+    size = len(puzzle)
+    box_rows, box_cols = models.solver.box_shape(size)
+
+    side = int(rng.integers(360, 900))
+    cell = side / size
+    pad = int(side * rng.uniform(0.45, 0.7))
+    paper = rng.uniform(185, 255) + rng.uniform(-12, 12, size=3)
+    page = np.empty((side + 2 * pad, side + 2 * pad, 3), dtype="float32")
+    page[:] = np.clip(paper, 0, 255)
+
+    # thin lines between cells, thick ones between boxes and around the grid
+    ink = rng.uniform(0, 80)
+    thin = max(1, int(round(side * rng.uniform(0.0015, 0.005))))
+    thick = max(thin + 1, int(round(thin * rng.uniform(1.5, 3.5))))
+    for i in range(size + 1):
+        at = pad + int(round(i * cell))
+        outer = i in (0, size)
+        across = thick if outer or i % box_rows == 0 else thin
+        down = thick if outer or i % box_cols == 0 else thin
+        page[at - across // 2 : at - across // 2 + across, pad : pad + side + 1] = ink
+        page[pad : pad + side + 1, at - down // 2 : at - down // 2 + down] = ink
+
+    # one font per grid, as printed puzzles are
+    font = fonts[rng.integers(len(fonts))]
+    height = int(cell * rng.uniform(0.45, 0.75))
+    weight = rng.uniform(0.06, 0.16)
+    glyphs = {d: draw_glyph(font, d, height, weight) for d in np.unique(puzzle) if d}
+    for (row, col), digit in np.ndenumerate(puzzle):
+        if not digit:
+            continue
+
+        glyph = glyphs[digit][: int(cell) - 2, : int(cell) - 2]
+        gh, gw = glyph.shape
+        jitter = rng.uniform(-0.08, 0.08, size=2) * cell
+        y = int(pad + (row + 0.5) * cell - gh / 2 + jitter[0])
+        x = int(pad + (col + 0.5) * cell - gw / 2 + jitter[1])
+        alpha = glyph[..., None] / 255.0
+        region = page[y : y + gh, x : x + gw]
+        region[:] = region * (1 - alpha) + ink * alpha
+
+    corners = np.array(
+        [[pad, pad], [pad + side, pad], [pad, pad + side], [pad + side, pad + side]],
+        dtype="float32",
+    )
+
+    return page, corners
+
+
+def photograph(
+    rng: np.random.Generator, page: np.ndarray, corners: np.ndarray
+) -> tuple:
+    """
+    Turns a sheet into a camera picture of it: the sheet is put on a
+    background at an angle, lit unevenly, blurred, made noisy and compressed.
+
+    Returns
+    -------
+        photo (np.ndarray): BGR uint8 picture
+        corners (np.ndarray): (4, 2) grid corners in the picture
+    """
+
+    h, w = page.shape[:2]
+
+    # moving the sheet corners independently gives the perspective
+    angle = np.deg2rad(rng.uniform(-12, 12))
+    rotation = np.array(
+        [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    )
+    sheet = np.array([[0, 0], [w, 0], [0, h], [w, h]], dtype="float32")
+    placed = (sheet - [w / 2, h / 2]) @ rotation.T
+    placed += rng.uniform(-0.07, 0.07, size=(4, 2)) * w
+
+    # framing the grid with some of the page around it, as people do
+    grid = cv2.perspectiveTransform(
+        corners[None], cv2.getPerspectiveTransform(sheet, placed.astype("float32"))
+    )[0]
+    side = np.sqrt(cv2.contourArea(grid[[0, 1, 3, 2]]))
+    low = grid.min(axis=0) - rng.uniform(0.05, 0.3, size=2) * side
+    high = grid.max(axis=0) + rng.uniform(0.05, 0.3, size=2) * side
+    width, height = (high - low).astype(int)
+    placed -= low
+    transform = cv2.getPerspectiveTransform(sheet, placed.astype("float32"))
+
+    background = rng.uniform(20, 160, size=3)
+    photo = cv2.warpPerspective(
+        page,
+        transform,
+        (width, height),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=tuple(float(b) for b in background),
+    )
+    corners = cv2.perspectiveTransform(corners[None], transform)[0]
+    corners = imageproc.utils._sort_points(corners, row_size=2)
+
+    # uneven lighting, a linear falloff and a soft shadow
+    ys, xs = np.mgrid[0:height, 0:width].astype("float32")
+    direction = rng.uniform(-1, 1, size=2)
+    light = 1 - rng.uniform(0, 0.35) * (
+        (direction[0] * xs / width + direction[1] * ys / height + 1) / 2
+    )
+    if rng.random() < 0.4:
+        edge = rng.uniform(0.2, 0.8) * width + rng.uniform(-0.5, 0.5) * ys
+        light *= 1 - rng.uniform(0.1, 0.35) / (1 + np.exp((xs - edge) / 20))
+    photo *= light[..., None]
+
+    # camera blur and sensor noise
+    sigma = rng.uniform(0, 1.8)
+    if sigma > 0.3:
+        photo = cv2.GaussianBlur(photo, (0, 0), sigma)
+    photo += rng.normal(0, rng.uniform(0, 8), size=photo.shape).astype("float32")
+    photo = np.clip(photo, 0, 255).astype("uint8")
+
+    # compression artefacts
+    quality = int(rng.integers(40, 96))
+    _, encoded = cv2.imencode(".jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR), corners
+
+
+def generate(task: tuple) -> tuple:
+    """
+    Renders and photographs one puzzle, then finds and crops its cells with
+    the pipeline itself, so the cells carry the same artefacts as real ones.
+    Meant for worker processes.
+
+    Parameters
+    ----------
+        task (tuple): seed sequence of the grid, font specs, cell mode (or
+            None to pick one at random), share of blank cells kept
+
+    Returns
+    -------
+        cells (np.ndarray): (N, 28, 28) uint8 cells, None if the pipeline
+            missed the grid
+        labels (np.ndarray): (N,) digits of the cells, 0 for blanks
+    """
+
+    seed, fonts, cell_mode, keep_blanks = task
+    rng = np.random.default_rng(seed)
+
+    puzzle = benchmarks.synthetic.make_puzzle(rng, clues=int(rng.integers(20, 45)))
+    page, corners = render_page(rng, fonts, puzzle)
+    photo, corners = photograph(rng, page, corners)
+
+    if cell_mode is None:
+        cell_mode = pipeline.core.CELL_MODES[rng.integers(2)]
+    resized, scale, thresh = pipeline.core.preprocess(photo)
+    result = pipeline.core.GridResult(image=resized, source=photo, scale=scale)
+    if not pipeline.core.find_grid(resized, thresh, result, cell_mode=cell_mode):
+        return None, None
+
+    # a different quadrilateral, e.g. a box, would be labelled wrongly
+    side = np.sqrt(cv2.contourArea(corners[[0, 1, 3, 2]]))
+    error = np.abs(result.corners - corners).max()
+    if error > MAX_CORNER_ERROR * side:
+        return None, None
+
+    digits = pipeline.core.extract_digits(result)
+    cells = np.round(digits[..., 0] * 255).astype("uint8")
+    labels = puzzle.flatten()
+
+    keep = (labels > 0) | (rng.random(len(labels)) < keep_blanks)
+
+    return cells[keep], labels[keep]
+
+
+def _init_worker():
+    # one thread per process, parallelism comes from the pool
+    cv2.setNumThreads(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates labelled cells from synthetic photos of puzzles."
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default="data/training/synthetic",
+        help="Directory to write the cell shards to, see models/dataset.py.",
+    )
+    parser.add_argument(
+        "--grids", "-g", type=int, default=1000, help="Number of puzzles to render."
+    )
+    parser.add_argument(
+        "--fonts",
+        nargs="*",
+        default=[DEFAULT_FONTS],
+        help="Glob patterns of TrueType fonts, used besides the built-in fonts.",
+    )
+    parser.add_argument(
+        "--cell-mode",
+        choices=pipeline.core.CELL_MODES,
+        default=None,
+        help="How cells are located, both at random by default.",
+    )
+    parser.add_argument(
+        "--keep-blanks",
+        type=float,
+        default=0.25,
+        help="Share of blank cells kept, most are skipped by the pipeline anyway.",
+    )
+    parser.add_argument(
+        "--processes",
+        "-p",
+        type=int,
+        default=None,
+        help="Number of worker processes, defaults to the CPU count.",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=models.dataset.SHARD_SIZE,
+        help="Cells per shard.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the puzzles.")
+    args = parser.parse_args()
+
+    fonts = list_fonts(args.fonts)
+    seeds = np.random.SeedSequence(args.seed).spawn(args.grids)
+    tasks = ((seed, fonts, args.cell_mode, args.keep_blanks) for seed in seeds)
+    metadata = {
+        "generator": "scripts/generate_cells.py",
+        "grids": args.grids,
+        "fonts": len(fonts),
+        "cell_mode": args.cell_mode,
+        "keep_blanks": args.keep_blanks,
+        "seed": args.seed,
+    }
+
+    start = time.perf_counter()
+    missed = 0
+    writer = models.dataset.ShardWriter(args.output, args.shard_size, metadata=metadata)
+    with multiprocessing.Pool(args.processes, initializer=_init_worker) as pool:
+        # cells are written as they come, only a shard is held in memory
+        for done, (cells, labels) in enumerate(
+            pool.imap_unordered(generate, tasks, chunksize=8), 1
+        ):
+            if cells is None:
+                missed += 1
+            else:
+                writer.write(cells, labels)
+
+            if done % 100 == 0 or done == args.grids:
+                print(
+                    f"{done}/{args.grids} grids, {writer.count} cells written, "
+                    f"{missed} grids missed, {time.perf_counter() - start:.0f}s",
+                    file=sys.stderr,
+                )
+
+    writer.metadata["missed"] = missed
+    writer.close()
+
+    count = writer.count
+    print(f"Wrote {count} cells from {args.grids - missed} grids to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import argparse
 
-import pandas as pd
+import numpy as np
+import tensorflow as tf
 from tensorflow.keras import Sequential
 from tensorflow.keras.layers import (
     Conv2D,
@@ -10,42 +11,80 @@ from tensorflow.keras.layers import (
     InputLayer,
     MaxPooling2D,
 )
-from tensorflow.keras.utils import to_categorical
+
+import models.dataset
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--name", "-n", help="Name of saved model.", required=True)
+parser.add_argument(
+    "--data",
+    "-d",
+    nargs="+",
+    default=["data/training/tmnist"],
+    help="Directories of cell shards trained on together, see "
+    "scripts/data_prepocess.py and scripts/generate_cells.py.",
+)
+parser.add_argument("--epochs", type=int, default=15, help="Number of epochs.")
+parser.add_argument(
+    "--shift",
+    type=int,
+    default=2,
+    help="Most pixels training cells are randomly shifted by, 0 for none.",
+)
+parser.add_argument(
+    "--noisy-blanks",
+    type=float,
+    default=0.5,
+    help="Share of blank training cells filled with random noise.",
+)
+parser.add_argument("--seed", type=int, default=0, help="Seed of splits and shuffles.")
 args = parser.parse_args()
 
 # constants
 N_CLASSES = 10
 INPUT_SHAPE = (28, 28, 1)
 BATCH_SIZE = 128
-EPOCHS = 15
 
-# reading in data
-digits = pd.read_csv("data/training/TMNIST_processed.csv")
+# shards are memory-mapped, nothing is read until batches are streamed
+dataset = models.dataset.CellDataset(*args.data)
 
-# splitting data into train and test
-train = digits.sample(frac=0.8, random_state=0)
-test = digits.drop(train.index)
+# splitting data into train and test, with 30% of train held out for
+# validation
+train, validation, test = dataset.split((0.8 * 0.7, 0.8 * 0.3), seed=args.seed)
+rng = np.random.default_rng(args.seed)
 
-# only the last 784 columns pertain to pixel values
-x_train = train.iloc[:, 1:].to_numpy()
-y_train = train.iloc[:, 0].to_numpy()
-x_test = test.iloc[:, 1:].to_numpy()
-y_test = test.iloc[:, 0].to_numpy()
 
-# rescaling values
-x_train = x_train.astype("float32") / 255.0
-x_test = x_test.astype("float32") / 255.0
+def stream(indices: np.ndarray, shuffle: bool = False) -> tf.data.Dataset:
+    """
+    Batches of cells read from the shards by a generator, shuffled and
+    augmented anew on every epoch if `shuffle` is set. Rescaling and one-hot
+    encoding happen in the tf.data pipeline, overlapping with training.
+    """
 
-# making sure images have correct shape
-x_train = x_train.reshape((x_train.shape[0], 28, 28, 1))
-x_test = x_test.reshape((x_test.shape[0], 28, 28, 1))
+    def generate():
+        return dataset.batches(
+            indices,
+            BATCH_SIZE,
+            rng if shuffle else None,
+            noisy_blanks=args.noisy_blanks,
+            shift=args.shift,
+        )
+
+    spec = (
+        tf.TensorSpec(shape=(None, *models.dataset.CELL_SHAPE), dtype=tf.uint8),
+        tf.TensorSpec(shape=(None,), dtype=tf.uint8),
+    )
+
+    def to_inputs(cells, labels):
+        cells = tf.cast(cells[..., None], tf.float32) / 255.0
+        return cells, tf.one_hot(tf.cast(labels, tf.int32), N_CLASSES)
+
+    return (
+        tf.data.Dataset.from_generator(generate, output_signature=spec)
+        .map(to_inputs, num_parallel_calls=tf.data.AUTOTUNE)
+        .prefetch(tf.data.AUTOTUNE)
+    )
 
-# converting target variables to arrays
-y_train = to_categorical(y_train, N_CLASSES)
-y_test = to_categorical(y_test, N_CLASSES)
 
 # building the model
 model = Sequential(
@@ -63,10 +102,12 @@ model = Sequential(
 
 # fitting the model
 model.compile(loss="categorical_crossentropy", optimizer="adam", metrics=["accuracy"])
-model.fit(x_train, y_train, batch_size=BATCH_SIZE, epochs=EPOCHS, validation_split=0.3)
+model.fit(
+    stream(train, shuffle=True), epochs=args.epochs, validation_data=stream(validation)
+)
 
 # evaluating the model
-score = model.evaluate(x_test, y_test, verbose=0)
+score = model.evaluate(stream(test), verbose=0)
 print("Test Accuracy:", score[1])
 
 model.save("models/" + args.name)
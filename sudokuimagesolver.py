@@ -1,127 +1,530 @@
 import argparse
+import functools
+import json
+import sys
 
 import cv2
 import numpy as np
-from tensorflow.keras.models import load_model
 
-import imageproc.contours
-import imageproc.transforms
-import imageproc.utils
+import models.ocr
 import models.solver
+import pipeline.batch
+import pipeline.cache
+import pipeline.core
+import pipeline.profiling
+import pipeline.server
+import pipeline.sinks
+import pipeline.video
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--image", "-i", required=True, help="Name of image.")
-parser.add_argument("--model", "-m", required=True, help="Name of OCR model")
-args = parser.parse_args()
 
-# reading in image
-image = cv2.imread("data/puzzles/" + args.image)
-if image is None:
-    print("Could not find image:", args.image)
-    exit()
-
-# resizing image, maintaining aspect ratio
-image = imageproc.transforms.resize(image, width=700)
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", "-i", help="Name of image.")
+    parser.add_argument("--model", "-m", required=True, help="Name of OCR model")
+    parser.add_argument(
+        "--solver",
+        "-s",
+        default="bitmask",
+        choices=models.solver.SOLVERS,
+        help="Solving engine.",
+    )
+    parser.add_argument(
+        "--ocr-backend",
+        default="keras",
+        choices=models.ocr.BACKENDS,
+        help="Inference backend for the OCR model, see scripts/export_model.py.",
+    )
+    parser.add_argument(
+        "--sink",
+        default="display",
+        choices=pipeline.sinks.SINKS,
+        help="Where the annotated result goes, 'none' for headless use.",
+    )
+    parser.add_argument(
+        "--annotated", help="Annotated image to write with the file sink."
+    )
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON.")
+    parser.add_argument(
+        "--max-candidates",
+        type=int,
+        default=pipeline.core.MAX_CANDIDATES,
+        help="Most grid candidates warped per image, best ranked first.",
+    )
+    parser.add_argument(
+        "--max-grids",
+        type=int,
+        default=1,
+        help="Most grids solved in a single image, e.g. a newspaper page, 0 "
+        "for every grid found. Only applies to --image, combining it with "
+        "--serve, --batch or --video is an error.",
+    )
+    parser.add_argument(
+        "--cell-mode",
+        default="contours",
+        choices=pipeline.core.CELL_MODES,
+        help="Locate cells by their contours or from grid line projections.",
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=pipeline.core.GRID_SIZE,
+        help="Cells per side of the grid, e.g. 6 or 16. Sizes past 9 need a "
+        "model with a class per value.",
+    )
+    parser.add_argument(
+        "--blank-threshold",
+        type=float,
+        default=pipeline.core.BLANK_THRESHOLD,
+        help="Most ink, relative to the cell, of a cell set to 0 without the "
+        "OCR model. Negative to classify every cell.",
+    )
+    parser.add_argument(
+        "--solve-budget-ms",
+        type=float,
+        default=pipeline.core.SOLVE_BUDGET * 1000,
+        help="Time the solver may spend on a puzzle before giving up on it.",
+    )
+    parser.add_argument(
+        "--max-corrections",
+        type=int,
+        default=pipeline.core.MAX_CORRECTIONS,
+        help="Most misread digits corrected to make an infeasible puzzle solvable.",
+    )
+    parser.add_argument(
+        "--repair-budget-ms",
+        type=float,
+        default=pipeline.core.REPAIR_BUDGET * 1000,
+        help="Time spent looking for corrections, 0 to never correct.",
+    )
+    parser.add_argument(
+        "--uniqueness-nodes",
+        type=int,
+        default=pipeline.core.UNIQUENESS_NODES,
+        help="Most search nodes visited looking for a second solution.",
+    )
+    parser.add_argument(
+        "--uniqueness-budget-ms",
+        type=float,
+        default=pipeline.core.UNIQUENESS_BUDGET * 1000,
+        help="Time spent looking for a second solution, 0 to not check.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent in each stage to standard error.",
+    )
+    parser.add_argument(
+        "--prometheus",
+        metavar="PATH",
+        help="Keep stage metrics in this file in the Prometheus text format.",
+    )
+
+    server = parser.add_argument_group("server")
+    server.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep the model loaded and serve the pipeline over HTTP.",
+    )
+    server.add_argument("--host", default="127.0.0.1", help="Address to serve on.")
+    server.add_argument("--port", type=int, default=8000, help="Port to serve on.")
+    server.add_argument("--socket", help="Serve on this unix socket instead of TCP.")
+    server.add_argument(
+        "--workers", type=int, default=4, help="Requests processed concurrently."
+    )
+    server.add_argument(
+        "--queue-size", type=int, default=16, help="Requests waiting for a worker."
+    )
+    server.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=512,
+        help="Most cells classified in one model call when serving.",
+    )
+    server.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=5.0,
+        help="Time a request waits for others to share its model call.",
+    )
+    server.add_argument(
+        "--max-queue",
+        type=int,
+        default=64,
+        help="Requests allowed to wait for the model.",
+    )
+
+    batch = parser.add_argument_group("batch")
+    batch.add_argument(
+        "--batch",
+        nargs="+",
+        metavar="SOURCE",
+        help="Directories, globs, images or .txt lists of images to solve.",
+    )
+    batch.add_argument(
+        "--output", "-o", default="-", help="Results file, standard output if '-'."
+    )
+    batch.add_argument(
+        "--format",
+        choices=["jsonl", "csv"],
+        help="Results format, guessed from the output extension by default.",
+    )
+    batch.add_argument(
+        "--processes", type=int, help="Worker processes, defaults to the CPU count."
+    )
+    batch.add_argument(
+        "--max-in-flight", type=int, help="Images being processed at any time."
+    )
+    batch.add_argument(
+        "--ocr-batch-size",
+        type=int,
+        default=16,
+        help="Images whose cells are classified in one model call.",
+    )
+
+    video = parser.add_argument_group("video")
+    video.add_argument(
+        "--video",
+        metavar="SOURCE",
+        help="Video file, or camera index or device, to overlay solutions on.",
+    )
+    video.add_argument(
+        "--verify-interval",
+        type=int,
+        default=pipeline.video.VERIFY_INTERVAL,
+        help="Frames between checks that a tracked grid still holds the same "
+        "digits, 0 to never check.",
+    )
+    video.add_argument(
+        "--search-interval",
+        type=int,
+        default=pipeline.video.SEARCH_INTERVAL,
+        help="Frames between full grid searches while no grid is tracked.",
+    )
+
+    cache = parser.add_argument_group("cache")
+    cache.add_argument(
+        "--cache",
+        metavar="PATH",
+        help="SQLite file keeping results across runs and processes.",
+    )
+    cache.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="Results and solutions kept in memory each, 0 for none.",
+    )
+    cache.add_argument(
+        "--cache-max-age",
+        type=float,
+        default=pipeline.cache.MAX_AGE / 86400,
+        metavar="DAYS",
+        help="Days an entry of the SQLite file may go unused before it's pruned.",
+    )
+
+    args = parser.parse_args()
+    if not (args.serve or args.batch or args.video) and args.image is None:
+        parser.error("--image is required unless --serve, --batch or --video is given")
+    if args.max_grids < 0:
+        parser.error("--max-grids must be 0 or more")
+    if args.max_grids != 1 and (args.serve or args.batch or args.video):
+        parser.error("--max-grids only applies to single images (--image)")
+    if args.sink == "file" and args.annotated is None:
+        parser.error("--annotated is required with --sink file")
+    try:
+        models.solver.box_shape(args.size)
+    except ValueError as e:
+        parser.error(str(e))
+
+    return args
+
+
+def make_cache(args: argparse.Namespace) -> pipeline.cache.ResultCache | None:
+    """
+    Creates the result cache, scoped to the model and every parameter that
+    affects results, None if caching is disabled.
+    """
+
+    if args.cache is None and args.cache_size <= 0:
+        return None
+
+    image_fingerprint = pipeline.cache.fingerprint(
+        model=models.ocr.model_fingerprint(args.model, args.ocr_backend),
+        solver=args.solver,
+        max_candidates=args.max_candidates,
+        cell_mode=args.cell_mode,
+        size=args.size,
+        blank_threshold=args.blank_threshold,
+        solve_budget_ms=args.solve_budget_ms,
+        max_corrections=args.max_corrections,
+        repair_budget_ms=args.repair_budget_ms,
+        uniqueness_nodes=args.uniqueness_nodes,
+        uniqueness_budget_ms=args.uniqueness_budget_ms,
+    )
+    grid_fingerprint = pipeline.cache.fingerprint(solver=args.solver)
+
+    return pipeline.cache.ResultCache(
+        image_fingerprint,
+        grid_fingerprint,
+        args.cache_size,
+        args.cache,
+        args.cache_max_age * 86400,
+    )
+
+
+def serve(args: argparse.Namespace):
+    model = pipeline.core.load_model(args.model, args.ocr_backend)
+
+    pipeline.server.serve(
+        pipeline.server.Pipeline(
+            model,
+            args.solver,
+            max_batch_size=args.max_batch_size,
+            max_wait=args.max_wait_ms / 1000,
+            max_queue=args.max_queue,
+            max_candidates=args.max_candidates,
+            cell_mode=args.cell_mode,
+            blank_threshold=args.blank_threshold,
+            cache=make_cache(args),
+            solve_budget=args.solve_budget_ms / 1000,
+            max_corrections=args.max_corrections,
+            repair_budget=args.repair_budget_ms / 1000,
+            uniqueness_nodes=args.uniqueness_nodes,
+            uniqueness_budget=args.uniqueness_budget_ms / 1000,
+            size=args.size,
+        ),
+        host=args.host,
+        port=args.port,
+        socket_path=args.socket,
+        workers=args.workers,
+        queue_size=args.queue_size,
+    )
+
+
+def batch(args: argparse.Namespace):
+    # workers are started before the model is loaded so they don't inherit it
+    runner = pipeline.batch.BatchRunner(
+        processes=args.processes,
+        max_in_flight=args.max_in_flight,
+        ocr_batch_size=args.ocr_batch_size,
+        max_candidates=args.max_candidates,
+        cell_mode=args.cell_mode,
+        blank_threshold=args.blank_threshold,
+        cache=make_cache(args),
+        solve_budget=args.solve_budget_ms / 1000,
+        max_corrections=args.max_corrections,
+        repair_budget=args.repair_budget_ms / 1000,
+        uniqueness_nodes=args.uniqueness_nodes,
+        uniqueness_budget=args.uniqueness_budget_ms / 1000,
+        size=args.size,
+    )
+    writer = pipeline.batch.ResultWriter(args.output, args.format)
+
+    # totals over every image in the batch
+    totals = pipeline.profiling.Profiler()
+    pipeline.profiling.add_hook(totals.merge)
+
+    try:
+        model = pipeline.core.load_model(args.model, args.ocr_backend)
+        paths = pipeline.batch.expand_inputs(args.batch)
+        runner.run(paths, model, writer, args.solver)
+    finally:
+        runner.close()
+        writer.close()
+
+    if args.profile:
+        print(totals.report(), file=sys.stderr)
+        if runner.cache is not None:
+            metrics = runner.cache.metrics()
+            print(
+                "\n".join(f"{k:<20}{v:>8}" for k, v in metrics.items()), file=sys.stderr
+            )
+
+
+def video(args: argparse.Namespace):
+    try:
+        capture = pipeline.video.open_capture(args.video)
+    except ValueError as e:
+        print(e)
+        return
+
+    model = pipeline.core.load_model(args.model, args.ocr_backend)
+
+    # solutions of grids seen before are reused when a lost grid turns up again
+    cache = make_cache(args)
+    process = functools.partial(
+        pipeline.core.process_image,
+        model=model,
+        solver=args.solver,
+        max_candidates=args.max_candidates,
+        cell_mode=args.cell_mode,
+        blank_threshold=args.blank_threshold,
+        cache=cache,
+        solve_budget=args.solve_budget_ms / 1000,
+        max_corrections=args.max_corrections,
+        repair_budget=args.repair_budget_ms / 1000,
+        uniqueness_nodes=args.uniqueness_nodes,
+        uniqueness_budget=args.uniqueness_budget_ms / 1000,
+        size=args.size,
+    )
+    tracker = pipeline.video.GridTracker(
+        process,
+        args.size,
+        verify_interval=args.verify_interval,
+        search_interval=args.search_interval,
+    )
+
+    if args.sink == "file":
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        sink = pipeline.video.VideoFileSink(args.annotated, fps)
+    elif args.sink == "display":
+        sink = pipeline.video.VideoDisplaySink()
+    else:
+        sink = None
+
+    # totals over every frame
+    totals = pipeline.profiling.Profiler()
+    pipeline.profiling.add_hook(totals.merge)
+
+    try:
+        stats = pipeline.video.run(capture, tracker, sink)
+    finally:
+        capture.release()
+        if isinstance(sink, pipeline.video.VideoFileSink):
+            sink.close()
+        if cache is not None:
+            cache.close()
+
+    if args.profile:
+        print(totals.report(), file=sys.stderr)
+    print(json.dumps(stats) if args.json else stats)
+
+
+def solve_image(args: argparse.Namespace):
+    sink = pipeline.sinks.get_sink(args.sink, args.annotated)
+
+    # a single image only benefits from a cache kept across runs
+    cache = make_cache(args) if args.cache is not None else None
+
+    # reading in image
+    profiler = pipeline.profiling.Profiler()
+    with profiler.stage("read"):
+        image = cv2.imread("data/puzzles/" + args.image)
+    if image is None:
+        print("Could not find image:", args.image)
+        return
+
+    # results of several grids are not cached per image
+    if args.max_grids != 1:
+        solve_grids(args, image, profiler, sink, cache)
+        return
+
+    # cached results have no images to draw on
+    key = record = None
+    if cache is not None and args.sink == "none":
+        with open("data/puzzles/" + args.image, "rb") as f:
+            key = pipeline.cache.image_key(f.read())
+        record = cache.get("images", key)
+
+    if record is not None:
+        result = pipeline.core.GridResult.from_dict(record)
+    else:
+        model = pipeline.core.load_model(args.model, args.ocr_backend)
+        result = pipeline.core.process_image(
+            image,
+            model,
+            solver=args.solver,
+            profiler=profiler,
+            max_candidates=args.max_candidates,
+            cell_mode=args.cell_mode,
+            blank_threshold=args.blank_threshold,
+            cache=cache,
+            solve_budget=args.solve_budget_ms / 1000,
+            max_corrections=args.max_corrections,
+            repair_budget=args.repair_budget_ms / 1000,
+            uniqueness_nodes=args.uniqueness_nodes,
+            uniqueness_budget=args.uniqueness_budget_ms / 1000,
+            size=args.size,
+        )
+        if key is not None:
+            cache.put("images", key, result.to_dict())
+
+    if cache is not None:
+        cache.close()
+
+    if args.profile:
+        print(profiler.report(), file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(result.to_dict()))
+    elif not result.found:
+        print("Sudoku grid not found")
+    elif not result.solved:
+        print("No solution found")
+    elif result.unique is False:
+        print("Solution is not unique, a digit was probably missed")
+
+    # drawing only happens in the sink, if at all
+    sink(result)
+
+
+def solve_grids(
+    args: argparse.Namespace,
+    image: np.ndarray,
+    profiler: pipeline.profiling.Profiler,
+    sink,
+    cache: pipeline.cache.ResultCache | None,
+):
+    model = pipeline.core.load_model(args.model, args.ocr_backend)
+    results = pipeline.core.process_grids(
+        image,
+        model,
+        solver=args.solver,
+        profiler=profiler,
+        max_candidates=args.max_candidates,
+        cell_mode=args.cell_mode,
+        blank_threshold=args.blank_threshold,
+        cache=cache,
+        solve_budget=args.solve_budget_ms / 1000,
+        max_corrections=args.max_corrections,
+        repair_budget=args.repair_budget_ms / 1000,
+        uniqueness_nodes=args.uniqueness_nodes,
+        uniqueness_budget=args.uniqueness_budget_ms / 1000,
+        size=args.size,
+        max_grids=args.max_grids or None,
+    )
+
+    if cache is not None:
+        cache.close()
+
+    if args.profile:
+        print(profiler.report(), file=sys.stderr)
+
+    if args.json:
+        print(json.dumps({"grids": [r.to_dict() for r in results]}))
+    else:
+        solved = sum(r.solved for r in results)
+        print(f"Found {len(results)} grids, solved {solved}")
+
+    sink.grids(image, results)
+
+
+def main():
+    args = parse_args()
+
+    if args.prometheus is not None:
+        pipeline.profiling.add_hook(
+            pipeline.profiling.PrometheusExporter(args.prometheus)
+        )
+
+    if args.serve:
+        serve(args)
+    elif args.batch is not None:
+        batch(args)
+    elif args.video is not None:
+        video(args)
+    else:
+        solve_image(args)
+
 
-# preprocessing image
-_, _, thresh = imageproc.utils.grey_blur_threshold(
-    image, (5, 5), cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 5, 2
-)
-
-# outside edge of sudoku grid will likely be quadrilateral contour
-quad_contours, quad_corners = imageproc.contours.find_quadrilaterals(
-    thresh, cv2.RETR_EXTERNAL, 0.01
-)
-
-# sudoku grid will most likely be largest contour by area, sort to find sooner
-temp = list(zip(quad_contours, quad_corners))
-sorted_temp = sorted(temp, key=lambda q: cv2.contourArea(q[0]), reverse=True)
-quad_contours, quad_corners = list(zip(*sorted_temp))
-del temp, sorted_temp
-
-# will populate
-sudoku_grid = None
-candidates = []
-
-# going to loop through all contours to see if any look like sudoku grid
-for c in quad_corners:
-
-    # getting top-down-view of potential grid
-    roi_origin = imageproc.transforms.top_down_view(image.copy(), c.reshape((4, 2)))
-
-    # preprocessing image
-    _, _, roi_thresh = imageproc.utils.grey_blur_threshold(
-        roi_origin, (3, 3), cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 57, 5
-    )
-
-    # contouring top-down view to find cells
-    cell_contours, _ = imageproc.contours.find_quadrilaterals(
-        roi_thresh, mode=cv2.RETR_LIST, error=0.02, bounds=(0.0035, 0.02)
-    )
-
-    # collecting sudoku candidate attributes
-    candidates.append((roi_origin, roi_thresh, len(cell_contours), cell_contours))
-
-    # if 81 contours are found, we assume we found the board
-    if len(cell_contours) == 81:
-        sudoku_grid = roi_origin.copy()
-        break
-
-# in case no grid is found
-if sudoku_grid is None:
-    # choosing the tuple with the most cells
-    steps = max(candidates, key=lambda c: c[2])
-
-    # plotting the various processing steps
-    cv2.imshow("Region of Interest", steps[0])
-    cv2.imshow("Region of Interest - Thresholded", steps[1])
-    cv2.imshow(
-        "Region of Interest - Contours",
-        cv2.drawContours(steps[0], steps[3], -1, (0, 255, 0), 2),
-    )
-    cv2.waitKey()
-
-    print("Sudoku grid not found")
-    exit()
-
-# have to know cell order to transcribe to matrix for solving
-sorted_cells = imageproc.utils.sort_cells(cell_contours)
-
-# cell centours for image annotation, boxes for cropping
-cell_centers = [imageproc.contours.get_center(c) for c in sorted_cells]
-cell_bboxes = [cv2.boundingRect(c) for c in sorted_cells]
-
-# getting a list of cells and then cleaning up noise
-_, cells = imageproc.utils.extract_cells(roi_thresh, cell_bboxes)
-cells = [imageproc.contours.fill_contours(c, cv2.RETR_LIST, (0.0, 0.05)) for c in cells]
-
-# loading the model
-model = load_model("models/" + args.model)
-
-# predicting cell contents with the model
-digits = np.array(cells).reshape(len(cells), 28, 28, 1) / 255.0
-pred_digits = model.predict(digits).argmax(axis=1)
-
-# instantiating solver and solving
-puzzle = pred_digits.reshape((9, 9))
-solver = models.solver.SudokuSolver(puzzle)
-solver.solve()
-
-# displaying solution if one exists
-if solver.problem.status != 1:
-    print("No solution found")
-    annotated = imageproc.utils.write_text(
-        roi_origin, puzzle, solver.solution, cell_centers, mode="starting_values"
-    )
-    cv2.imshow("Thresholded", roi_thresh)
-    cv2.imshow("Predicted Digits", annotated)
-    cv2.waitKey()
-    exit()
-else:
-    solved_grid = imageproc.utils.write_text(
-        sudoku_grid, puzzle, solver.solution, cell_centers, mode="solution"
-    )
-    cv2.imshow("Original Image", image)
-    cv2.imshow("Solved Puzzle", solved_grid)
-    cv2.waitKey()
-    exit()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import models.ocr
+
+tf = pytest.importorskip("tensorflow")
+export_model = pytest.importorskip("scripts.export_model")
+
+# name of the saved Keras model the backends are compared against
+MODEL = "digitnet"
+
+# largest difference allowed between the class probabilities of a backend
+# and those of the Keras model
+TOLERANCE = 1e-4
+
+
+@pytest.fixture(scope="module")
+def cells():
+    return export_model.puzzle_cells()
+
+
+@pytest.fixture(scope="module")
+def keras_model():
+    return tf.keras.models.load_model(models.ocr.MODEL_DIR + MODEL)
+
+
+@pytest.fixture(scope="module")
+def expected(keras_model, cells):
+    return keras_model.predict(cells, verbose=0)
+
+
+def check_parity(predicted: np.ndarray, expected: np.ndarray):
+    assert predicted.shape == expected.shape
+    np.testing.assert_array_equal(predicted.argmax(axis=1), expected.argmax(axis=1))
+    np.testing.assert_allclose(predicted, expected, atol=TOLERANCE)
+
+
+def test_numpy_backend_matches_keras(cells, expected):
+    # the weights shipped in models/, not a fresh export
+    predicted = models.ocr.load_backend(MODEL, "numpy").predict(cells)
+    check_parity(predicted, expected)
+
+
+@pytest.mark.parametrize("backend", ["tflite", "onnx"])
+def test_exported_backend_matches_keras(
+    backend, keras_model, cells, expected, tmp_path, monkeypatch
+):
+    if backend == "onnx":
+        pytest.importorskip("tf2onnx")
+        pytest.importorskip("onnxruntime")
+
+    path = tmp_path / (MODEL + models.ocr.MODEL_SUFFIXES[backend])
+    if backend == "tflite":
+        export_model.export_tflite(keras_model, str(path), cells)
+    else:
+        export_model.export_onnx(keras_model, str(path), cells)
+
+    monkeypatch.setattr(models.ocr, "MODEL_DIR", f"{tmp_path}/")
+    predicted = models.ocr.load_backend(MODEL, backend).predict(cells)
+    check_parity(predicted, expected)